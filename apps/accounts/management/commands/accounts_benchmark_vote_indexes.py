@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.db import connection
+
+from accounts.models import MoodyUser, UserEmotion, UserSongVote
+from base.management.commands import MoodyBenchmarkCommand
+from tunes.models import Emotion, Song
+from tunes.utils import filter_duplicate_votes_on_song_from_playlist, order_votes_by_newest
+
+
+class Command(MoodyBenchmarkCommand):
+    help = 'Generate a large number of votes and compare the plans of the queries that filter UserSongVote ' \
+           'records for a user and emotion, with and without the UserSongVote indexes'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000,
+            help='Number of users to generate votes for'
+        )
+
+        parser.add_argument(
+            '--votes-per-user',
+            type=int,
+            default=2000,
+            help='Number of votes to generate for each user, spread across every emotion'
+        )
+
+        parser.add_argument(
+            '--songs',
+            type=int,
+            default=100000,
+            help='Number of songs to generate for users to vote on'
+        )
+
+        parser.add_argument(
+            '--upvote-ratio',
+            type=float,
+            default=.8,
+            help='Fraction of generated votes that are upvotes'
+        )
+
+    def generate_votes(self, users, songs, votes_per_user, upvote_ratio):
+        """
+        Insert songs and random votes on them for a batch of new users in three statements. Votes that would
+        duplicate an existing vote for the same user, song, emotion, and context are skipped.
+
+        :param users: (int) Number of users to create
+        :param songs: (int) Number of songs to create
+        :param votes_per_user: (int) Number of votes to generate for each user
+        :param upvote_ratio: (float) Fraction of votes that are upvotes
+
+        :return: (list[MoodyUser]) Generated users
+        """
+        prefix = 'benchmark-{}-'.format(self._unique_id.hex[:8])
+
+        generated_users = MoodyUser.objects.bulk_create([
+            MoodyUser(username='{}{}'.format(prefix, i)) for i in range(users)
+        ])
+
+        emotion_ids = list(Emotion.objects.order_by('pk').values_list('pk', flat=True))
+        contexts = [''] + [context for context, _ in UserSongVote.CONTEXT_CHOICES]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (created, updated, artist, name, genre, code, valence, energy, danceability, '
+                'random_key) '
+                'SELECT now(), now(), %s, %s || i, %s, %s || i, random(), random(), random(), random() '
+                'FROM generate_series(1, %s) AS i'.format(table=Song._meta.db_table),
+                ['Benchmark Artist', 'Benchmark Song ', 'benchmark', prefix, songs]
+            )
+
+            cursor.execute(
+                'WITH songs AS (SELECT array_agg(id) AS ids FROM {song_table} WHERE code LIKE %s) '
+                'INSERT INTO {vote_table} (created, updated, user_id, emotion_id, song_id, context, description, vote) '
+                'SELECT now() - (i * interval \'1 second\'), now(), user_id, '
+                '(%s::int[])[1 + i %% %s], '
+                'songs.ids[1 + floor(random() * array_length(songs.ids, 1))::int], '
+                '(%s::varchar[])[1 + floor(random() * %s)::int], '
+                '\'\', random() < %s '
+                'FROM songs, unnest(%s::int[]) AS user_id, generate_series(1, %s) AS i '
+                'ON CONFLICT DO NOTHING'.format(
+                    vote_table=UserSongVote._meta.db_table,
+                    song_table=Song._meta.db_table
+                ),
+                [
+                    prefix + '%',
+                    emotion_ids,
+                    len(emotion_ids),
+                    contexts,
+                    len(contexts),
+                    upvote_ratio,
+                    [user.pk for user in generated_users],
+                    votes_per_user,
+                ]
+            )
+
+            cursor.execute('ANALYZE {}'.format(UserSongVote._meta.db_table))
+            cursor.execute('ANALYZE {}'.format(Song._meta.db_table))
+
+        return generated_users
+
+    def get_queries(self, user, emotion, context):
+        """
+        Build the queries run by views and tasks that filter votes for a single user and emotion
+
+        :param user: (MoodyUser) User to filter votes for
+        :param emotion: (Emotion) Emotion to filter votes for
+        :param context: (str) Context to filter votes for
+
+        :return: (list[tuple]) Pairs of (label, QuerySet)
+        """
+        votes = UserSongVote.objects.filter(user=user, emotion=emotion)
+        upvotes = votes.filter(vote=True)
+        user_emotion = UserEmotion(user=user, emotion=emotion)
+
+        return [
+            ('browse voted song ids', votes.values_list('song_id', flat=True)),
+            ('browse voted song ids for context', votes.filter(context=context).values_list('song_id', flat=True)),
+            (
+                'emotion playlist page',
+                order_votes_by_newest(
+                    filter_duplicate_votes_on_song_from_playlist(upvotes)
+                )[:settings.REST_FRAMEWORK['PAGE_SIZE']]
+            ),
+            (
+                'export playlist',
+                filter_duplicate_votes_on_song_from_playlist(upvotes).values_list('song__code', flat=True)
+            ),
+            (
+                'latest upvoted songs',
+                user_emotion.get_latest_upvoted_songs(settings.CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE)
+            ),
+        ]
+
+    def write_plans(self, queries, iterations, label_suffix):
+        """
+        Write a summary of the plan and the timings for each query to stdout
+
+        :param queries: (list[tuple]) Pairs of (label, QuerySet) returned from `get_queries`
+        :param iterations: (int) Number of times to run each query for timings
+        :param label_suffix: (str) Suffix to add to the label of each query
+        """
+        for label, queryset in queries:
+            label = '{} ({})'.format(label, label_suffix)
+
+            self.write_plan(label, queryset)
+            self.write_timing(label, self.time_call(lambda: list(queryset.all()), iterations))
+
+    def run_benchmark(self, *args, **options):
+        users = self.generate_votes(
+            options['users'],
+            options['songs'],
+            options['votes_per_user'],
+            options['upvote_ratio']
+        )
+
+        self.stdout.write('Benchmarking vote queries with {} votes for {} users on {} songs'.format(
+            UserSongVote.objects.filter(user__in=users).count(),
+            len(users),
+            options['songs']
+        ))
+
+        user = users[0]
+        emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        context = UserSongVote.CONTEXT_CHOICES[0][0]
+        queries = self.get_queries(user, emotion, context)
+
+        with self.without_indexes(UserSongVote):
+            self.write_plans(queries, options['iterations'], 'before')
+
+        self.write_plans(queries, options['iterations'], 'after')
@@ -0,0 +1,149 @@
+import logging
+from itertools import groupby
+
+from django.conf import settings
+
+from accounts.models import UserEmotion, UserSongVote
+from base.management.commands import MoodyBaseCommand
+
+
+class Command(MoodyBaseCommand):
+    help = 'Rebuild the running attribute state for every UserEmotion record from user votes, ' \
+           'and verify the attributes calculated from the state match the attributes calculated from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of UserEmotion records to update in each query'
+        )
+
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Build and verify the attribute state without saving it'
+        )
+
+        parser.add_argument(
+            '--skip-verify',
+            action='store_true',
+            help='Do not verify the attribute state against the attributes calculated from the database'
+        )
+
+    def get_latest_upvoted_songs(self, candidate_batch_size):
+        """
+        Return the most recent distinct songs each user has upvoted for each emotion, in one pass over the votes
+
+        :param candidate_batch_size: (int) Max number of songs to return for each user and emotion
+
+        :return: (dict) Mapping of (user id, emotion id) to a list of song values ordered from oldest to newest
+        """
+        distinct_votes = UserSongVote.objects.filter(
+            vote=True
+        ).order_by(
+            'user_id',
+            'emotion_id',
+            'song_id',
+            '-created'
+        ).distinct(
+            'user_id',
+            'emotion_id',
+            'song_id'
+        ).values('pk')
+
+        votes = UserSongVote.objects.filter(
+            pk__in=distinct_votes
+        ).order_by(
+            'user_id',
+            'emotion_id',
+            '-created'
+        ).values_list(
+            'user_id',
+            'emotion_id',
+            'song__pk',
+            'song__valence',
+            'song__energy',
+            'song__danceability',
+        )
+
+        latest_songs = {}
+
+        for key, user_emotion_votes in groupby(votes.iterator(), key=lambda vote: vote[:2]):
+            songs = [vote[2:] for _, vote in zip(range(candidate_batch_size), user_emotion_votes)]
+            latest_songs[key] = list(reversed(songs))
+
+        return latest_songs
+
+    def verify_attribute_state(self, user_emotion, candidate_batch_size):
+        """
+        Check that the attributes calculated from the attribute state match the attributes calculated from
+        the database for the UserEmotion record
+
+        :param user_emotion: (UserEmotion) Record with the rebuilt attribute state
+        :param candidate_batch_size: (int) Number of songs the attribute state was built for
+
+        :return: (bool)
+        """
+        state_attributes = user_emotion.get_attributes_from_attribute_state()
+        database_attributes = user_emotion.calculate_attributes(candidate_batch_size)
+
+        mismatched_attributes = {
+            attribute: (value, database_attributes['{}__avg'.format(attribute)])
+            for attribute, value in state_attributes.items()
+            if value != database_attributes['{}__avg'.format(attribute)]
+        }
+
+        if mismatched_attributes:
+            self.write_to_log_and_output(
+                'Attribute state for UserEmotion {} does not match database attributes: {}'.format(
+                    user_emotion.pk,
+                    mismatched_attributes
+                ),
+                output_stream='stderr',
+                log_level=logging.WARNING,
+                extra={'user_emotion_id': user_emotion.pk, 'mismatched_attributes': mismatched_attributes}
+            )
+
+            return False
+
+        return True
+
+    def save_attribute_state(self, user_emotions, dry_run):
+        if not dry_run:
+            UserEmotion.objects.bulk_update(user_emotions, ['attribute_state'])
+
+        return len(user_emotions)
+
+    def handle(self, *args, **options):
+        candidate_batch_size = settings.CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE
+        latest_songs = self.get_latest_upvoted_songs(candidate_batch_size)
+
+        user_emotions = []
+        rebuilt_count = 0
+        mismatch_count = 0
+
+        for user_emotion in UserEmotion.objects.select_related('user', 'emotion').order_by('pk').iterator():
+            user_emotion.attribute_state = UserEmotion.build_attribute_state(
+                latest_songs.get((user_emotion.user_id, user_emotion.emotion_id), []),
+                candidate_batch_size
+            )
+
+            if not options['skip_verify'] and not self.verify_attribute_state(user_emotion, candidate_batch_size):
+                mismatch_count += 1
+
+            user_emotions.append(user_emotion)
+
+            if len(user_emotions) >= options['batch_size']:
+                rebuilt_count += self.save_attribute_state(user_emotions, options['dry_run'])
+                user_emotions = []
+
+        rebuilt_count += self.save_attribute_state(user_emotions, options['dry_run'])
+
+        self.write_to_log_and_output(
+            'Rebuilt attribute state for {} UserEmotion records with {} mismatches'.format(
+                rebuilt_count,
+                mismatch_count
+            ),
+            extra={'rebuilt_count': rebuilt_count, 'mismatch_count': mismatch_count, 'dry_run': options['dry_run']}
+        )
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_delete_spotifyuserauth_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useremotion',
+            name='attribute_state',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
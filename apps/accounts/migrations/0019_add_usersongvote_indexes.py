@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-16 23:33
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the table against writes
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0018_add_useremotion_attribute_state'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='usersongvote',
+            index=models.Index(condition=models.Q(vote=True), fields=['user', 'emotion', 'song', '-created'], name='usersongvote_upvote_songs_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usersongvote',
+            index=models.Index(fields=['user', 'emotion', 'context', 'song'], name='usersongvote_voted_songs_idx'),
+        ),
+    ]
@@ -2,12 +2,14 @@ from logging import getLogger
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 from base.models import BaseModel
 from base.validators import validate_decimal_value
 from libs.moody_logging import auto_fingerprint, update_logging_data
 from libs.utils import average
+from tunes.emotion_registry import get_emotion_registry
 from tunes.models import Song
 
 
@@ -73,12 +75,20 @@ class UserEmotion(BaseModel):
     us to store separate attributes for each user for each emotion. Unless
     values are specified upon creation, the attributes will be set to the
     defaults defined in the `Emotion` table.
+
+    `attribute_state` holds the running state used to update the attributes when the
+    user upvotes a song, without aggregating over all of their votes for the emotion:
+        - `batch_size`: Number of songs the state was built for
+        - `songs`: Ring buffer of [song id, valence, energy, danceability] for the most recent
+          distinct songs the user upvoted for the emotion, ordered from oldest to newest
+        - `sums`: Sums of the [valence, energy, danceability] values of the songs in the buffer
     """
     user = models.ForeignKey(MoodyUser, on_delete=models.CASCADE)
     emotion = models.ForeignKey('tunes.Emotion', on_delete=models.CASCADE)
     energy = models.FloatField(validators=[validate_decimal_value])
     valence = models.FloatField(validators=[validate_decimal_value])
     danceability = models.FloatField(validators=[validate_decimal_value], default=0)
+    attribute_state = models.JSONField(default=dict, blank=True)
 
     class Meta:
         unique_together = ('user', 'emotion')
@@ -86,7 +96,14 @@ class UserEmotion(BaseModel):
     def __str__(self):
         return '{} - {}'.format(self.user, self.emotion)
 
+    def _load_emotion_from_registry(self):
+        # Resolve the emotion from the in-process registry instead of querying for it
+        if self.emotion_id is not None and not UserEmotion.emotion.is_cached(self):
+            self.emotion = get_emotion_registry().get(pk=self.emotion_id)
+
     def save(self, *args, **kwargs):
+        self._load_emotion_from_registry()
+
         self.energy = self.energy or self.emotion.energy
         self.valence = self.valence or self.emotion.valence
         self.danceability = self.danceability or self.emotion.danceability
@@ -95,22 +112,22 @@ class UserEmotion(BaseModel):
 
         super().save(*args, **kwargs)
 
-    def update_attributes(self, candidate_batch_size=None):
+    def get_latest_upvoted_songs(self, candidate_batch_size):
         """
-        Update the attributes for this user/emotion mapping to the average attributes of the most recent songs
-        the user has upvoted as making them feel this emotion. If the user doesn't have any upvotes for this
-        emotion, the attributes will be set to `None` and reset to the emotion defaults in the save() call.
+        Return the `candidate_batch_size` most recent distinct songs the user has upvoted for the emotion.
+        If the user has upvoted a song more than once, the most recent upvote for the song is used.
 
-        :param candidate_batch_size: (int) Number of songs to include in batch for calculating new attribute values
-        """
-        if not candidate_batch_size:
-            candidate_batch_size = settings.CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE
+        :param candidate_batch_size: (int) Max number of songs to return
 
-        # First, get the distinct upvotes by the user for the emotion.
+        :return: (QuerySet) Values of (song id, valence, energy, danceability) ordered from newest to oldest
+        """
         # Avoid factoring in a song more than once if there are multiple upvotes for the song
         distinct_votes = self.user.usersongvote_set.filter(
             emotion=self.emotion,
             vote=True
+        ).order_by(
+            'song__pk',
+            '-created'
         ).distinct(
             'song__pk',
         ).values_list(
@@ -118,26 +135,158 @@ class UserEmotion(BaseModel):
             flat=True
         )
 
-        # Next, get the `candidate_batch_size` most recently distinct songs upvoted for the emotion
-        song_pks = UserSongVote.objects.filter(
+        return UserSongVote.objects.filter(
             pk__in=distinct_votes
         ).order_by(
             '-created'
         ).values_list(
             'song__pk',
-            flat=True
+            'song__valence',
+            'song__energy',
+            'song__danceability',
         )[:candidate_batch_size]
 
-        # Finally, calculate the average emotion attributes for the songs the user has most
-        # recently upvoted for the emotion and set the UserEmotion attributes to the average values
+    def calculate_attributes(self, candidate_batch_size=None):
+        """
+        Calculate the average attributes of the most recent songs the user has upvoted for the emotion,
+        by aggregating over the songs in the database. This does not use or update `attribute_state`.
+
+        :param candidate_batch_size: (int) Number of songs to include in batch for calculating attribute values
+
+        :return: (dict) Mapping of `{attribute}__avg` to the average value for the songs
+        """
+        if not candidate_batch_size:
+            candidate_batch_size = settings.CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE
+
+        song_pks = self.get_latest_upvoted_songs(candidate_batch_size).values_list('song__pk', flat=True)
         songs = Song.objects.filter(pk__in=song_pks)
-        attributes = average(songs, 'valence', 'energy', 'danceability')
 
-        self.valence = attributes['valence__avg']
-        self.energy = attributes['energy__avg']
-        self.danceability = attributes['danceability__avg']
+        return average(songs, 'valence', 'energy', 'danceability')
 
-        self.save()
+    @staticmethod
+    def build_attribute_state(songs, candidate_batch_size):
+        """
+        Build the running attribute state for a collection of songs
+
+        :param songs: (list[tuple]) Values of (song id, valence, energy, danceability) ordered from oldest to newest
+        :param candidate_batch_size: (int) Number of songs the state is built for
+
+        :return: (dict)
+        """
+        songs = [list(song) for song in songs][-candidate_batch_size:]
+
+        return {
+            'batch_size': candidate_batch_size,
+            'songs': songs,
+            'sums': [sum(song[index] for song in songs) for index in range(1, 4)],
+        }
+
+    def _add_song_to_attribute_state(self, song):
+        """
+        Add an upvoted song to the running attribute state, evicting the oldest song in the
+        buffer if it is full. Returns False if the song is already in the buffer, as the
+        position of songs in the buffer can then only be determined from the database.
+
+        :param song: (Song) Song the user upvoted for the emotion
+
+        :return: (bool) Whether or not the song was added to the state
+        """
+        state = self.attribute_state
+        songs = state['songs']
+
+        if any(song_id == song.pk for song_id, *_ in songs):
+            return False
+
+        features = [song.valence, song.energy, song.danceability]
+        songs.append([song.pk] + features)
+        state['sums'] = [total + value for total, value in zip(state['sums'], features)]
+
+        if len(songs) > state['batch_size']:
+            _, *evicted_features = songs.pop(0)
+            state['sums'] = [total - value for total, value in zip(state['sums'], evicted_features)]
+
+        return True
+
+    def get_attributes_from_attribute_state(self):
+        """
+        Calculate the average attributes of the songs in the running attribute state, rounded the
+        same way `libs.utils.average` rounds the database aggregate
+
+        :return: (dict) Mapping of attribute to average value, or None if there are no songs in the state
+        """
+        songs = self.attribute_state.get('songs')
+        averages = [None, None, None]
+
+        if songs:
+            averages = [round(total / len(songs), 2) for total in self.attribute_state['sums']]
+
+            # Mirror `libs.utils.average`, which returns all None values if any of the averages are falsy
+            if not all(averages):
+                averages = [None, None, None]
+
+        return dict(zip(('valence', 'energy', 'danceability'), averages))
+
+    def update_attributes(self, candidate_batch_size=None, song=None):
+        """
+        Update the attributes for this user/emotion mapping to the average attributes of the most recent songs
+        the user has upvoted as making them feel this emotion. If the user doesn't have any upvotes for this
+        emotion, the attributes will be reset to the emotion defaults.
+
+        If `song` is provided and the running attribute state is up to date, the song is added to the state
+        and the attributes are updated from the running sums without querying the user votes. Otherwise the
+        state is rebuilt from the user votes in the database.
+
+        :param candidate_batch_size: (int) Number of songs to include in batch for calculating new attribute values
+        :param song: (Song) Optional song the user has just upvoted for the emotion
+        """
+        if not candidate_batch_size:
+            candidate_batch_size = settings.CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE
+
+        with transaction.atomic():
+            # Lock the record so concurrent votes don't overwrite each others changes to the state
+            self.attribute_state = UserEmotion.objects.select_for_update().values_list(
+                'attribute_state',
+                flat=True
+            ).get(pk=self.pk)
+
+            state_is_current = self.attribute_state.get('batch_size') == candidate_batch_size
+
+            if song and state_is_current and self._add_song_to_attribute_state(song):
+                attributes = self.get_attributes_from_attribute_state()
+
+                valence = attributes['valence']
+                energy = attributes['energy']
+                danceability = attributes['danceability']
+            else:
+                latest_songs = list(self.get_latest_upvoted_songs(candidate_batch_size))
+                self.attribute_state = self.build_attribute_state(reversed(latest_songs), candidate_batch_size)
+
+                attributes = average(
+                    Song.objects.filter(pk__in=[song_id for song_id, *_ in latest_songs]),
+                    'valence',
+                    'energy',
+                    'danceability'
+                )
+
+                valence = attributes['valence__avg']
+                energy = attributes['energy__avg']
+                danceability = attributes['danceability__avg']
+
+            # Fall back to the emotion defaults the same way `save` does. Attributes are always
+            # averages of validated song attributes, so we skip the `full_clean` call in `save`
+            self._load_emotion_from_registry()
+            self.valence = valence or self.emotion.valence
+            self.energy = energy or self.emotion.energy
+            self.danceability = danceability or self.emotion.danceability
+            self.updated = timezone.now()
+
+            UserEmotion.objects.filter(pk=self.pk).update(
+                valence=self.valence,
+                energy=self.energy,
+                danceability=self.danceability,
+                attribute_state=self.attribute_state,
+                updated=self.updated,
+            )
 
 
 class UserSongVote(BaseModel):
@@ -168,6 +317,19 @@ class UserSongVote(BaseModel):
 
     class Meta:
         unique_together = ('user', 'song', 'emotion', 'context')
+        indexes = [
+            # Most recent upvote for each song a user upvoted for an emotion (DISTINCT ON song, ordered by created)
+            models.Index(
+                fields=['user', 'emotion', 'song', '-created'],
+                condition=models.Q(vote=True),
+                name='usersongvote_upvote_songs_idx'
+            ),
+            # Songs a user has voted on for an emotion, optionally for a single context
+            models.Index(
+                fields=['user', 'emotion', 'context', 'song'],
+                name='usersongvote_voted_songs_idx'
+            ),
+        ]
 
     def __str__(self):
         return '{} - {} - {}'.format(self.user, self.song, self.emotion)
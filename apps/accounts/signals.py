@@ -3,8 +3,8 @@ from django.contrib.auth.signals import user_login_failed
 from django.db.models.signals import post_save
 
 from accounts.models import UserSongVote
-from accounts.tasks import CreateUserEmotionRecordsForUserTask, UpdateUserEmotionRecordAttributeTask
-from accounts.utils import log_failed_login_attempt
+from accounts.tasks import CreateUserEmotionRecordsForUserTask
+from accounts.utils import dispatch_update_user_emotion_attributes, log_failed_login_attempt, update_vote_version
 
 
 def create_user_emotion_records(sender, instance, created, *args, **kwargs):
@@ -26,9 +26,15 @@ def update_user_emotion_attributes(sender, instance, created, *args, **kwargs):
     trace_id = getattr(instance, '_trace_id', '')
 
     if created and instance.vote:
-        UpdateUserEmotionRecordAttributeTask().delay(instance.user_id, instance.emotion_id, trace_id=trace_id)
+        # Pass along the upvoted song, so the attributes can be updated from the running attribute state
+        dispatch_update_user_emotion_attributes(
+            instance.user_id,
+            instance.emotion_id,
+            song_id=instance.song_id,
+            trace_id=trace_id
+        )
     elif not created:
-        UpdateUserEmotionRecordAttributeTask().delay(instance.user_id, instance.emotion_id, trace_id=trace_id)
+        dispatch_update_user_emotion_attributes(instance.user_id, instance.emotion_id, trace_id=trace_id)
 
 
 post_save.connect(
@@ -38,6 +44,19 @@ post_save.connect(
 )
 
 
+def update_user_song_vote_version(sender, instance, *args, **kwargs):
+    # Creating a vote and deleting a vote (which sets `vote` to False) both save the vote. Hold on to the new
+    # version so the view that saved the vote can add the song to the cached ids of songs voted on
+    instance._vote_version = update_vote_version(instance.user_id, instance.emotion_id)
+
+
+post_save.connect(
+    update_user_song_vote_version,
+    sender=UserSongVote,
+    dispatch_uid=settings.UPDATE_USER_SONG_VOTE_VERSION_SIGNAL_UID
+)
+
+
 user_login_failed.connect(
     log_failed_login_attempt,
     dispatch_uid=settings.LOG_MOODY_USER_FAILED_LOGIN_SIGNAL_UID
@@ -5,7 +5,8 @@ from django.core.exceptions import ValidationError
 from accounts.models import MoodyUser, UserEmotion
 from base.tasks import MoodyBaseTask
 from libs.moody_logging import auto_fingerprint, update_logging_data
-from tunes.models import Emotion
+from tunes.emotion_registry import get_emotion_registry
+from tunes.models import Song
 
 
 logger = getLogger(__name__)
@@ -35,7 +36,7 @@ class CreateUserEmotionRecordsForUserTask(MoodyBaseTask):
             raise
 
         user_emotions = []
-        for emotion in Emotion.objects.all().iterator():
+        for emotion in get_emotion_registry().all():
             user_emotions.append(
                 UserEmotion(
                     user=user,
@@ -66,9 +67,11 @@ class UpdateUserEmotionRecordAttributeTask(MoodyBaseTask):
 
         :param user_id: (int) Primary key for MoodyUser in our system
         :param emotion_id: (int) Primary key for Emotion in our system
+        :kwarg song_id: (int) Optional primary key for the Song the user just upvoted for the Emotion
 
         """
         trace_id = kwargs.get('trace_id', '')
+        song_id = kwargs.get('song_id')
 
         # We should always call get_or_create to ensure that if we add new emotions, we'll auto
         # create the corresponding UserEmotion record the first time a user votes on a song
@@ -97,7 +100,8 @@ class UpdateUserEmotionRecordAttributeTask(MoodyBaseTask):
         old_valence = user_emotion.valence
         old_danceability = user_emotion.danceability
 
-        user_emotion.update_attributes()
+        song = Song.objects.filter(pk=song_id).first() if song_id else None
+        user_emotion.update_attributes(song=song)
 
         logger.info(
             'Updated UserEmotion attributes for user {} for emotion {}'.format(
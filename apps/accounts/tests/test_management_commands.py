@@ -1,15 +1,19 @@
 import logging
+from io import StringIO
 from smtplib import SMTPException
 from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
 from django.urls import reverse
 
 from accounts.management.commands.accounts_recover_user_account import Command as RecoverCommand
+from accounts.models import UserEmotion, UserSongVote
 from libs.tests.helpers import MoodyUtil
+from tunes.models import Emotion
 
 
 class TestRecoverUserAccountCommand(TestCase):
@@ -72,3 +76,85 @@ class TestRecoverUserAccountCommand(TestCase):
             log_level=logging.ERROR,
             extra={'exc': exc}
         )
+
+
+class TestRebuildUserEmotionAttributeStateCommand(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MoodyUtil.create_user()
+        cls.emotion = Emotion.objects.get(name=Emotion.HAPPY)
+
+        # Use `bulk_create` to skip the signal to update UserEmotion attributes
+        UserSongVote.objects.bulk_create([
+            UserSongVote(user=cls.user, emotion=cls.emotion, song=MoodyUtil.create_song(), vote=True)
+            for _ in range(settings.CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE + 2)
+        ])
+
+    def test_command_rebuilds_attribute_state_for_all_user_emotions(self):
+        out = StringIO()
+
+        call_command('accounts_rebuild_user_emotion_attribute_state', stdout=out, stderr=StringIO())
+
+        user_emotion = self.user.get_user_emotion_record(self.emotion.name)
+        expected_song_pks = list(reversed(user_emotion.get_latest_upvoted_songs(
+            settings.CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE
+        ).values_list('song__pk', flat=True)))
+
+        self.assertListEqual([song[0] for song in user_emotion.attribute_state['songs']], expected_song_pks)
+        self.assertIn(
+            'Rebuilt attribute state for {} UserEmotion records with 0 mismatches'.format(UserEmotion.objects.count()),
+            out.getvalue()
+        )
+
+    def test_command_dry_run_does_not_save_attribute_state(self):
+        call_command('accounts_rebuild_user_emotion_attribute_state', dry_run=True, stdout=StringIO())
+
+        user_emotion = self.user.get_user_emotion_record(self.emotion.name)
+        self.assertDictEqual(user_emotion.attribute_state, {})
+
+    @mock.patch('accounts.models.UserEmotion.calculate_attributes')
+    def test_command_reports_mismatched_attributes(self, mock_calculate_attributes):
+        mock_calculate_attributes.return_value = {'valence__avg': 1, 'energy__avg': 1, 'danceability__avg': 1}
+        out = StringIO()
+        err = StringIO()
+
+        call_command('accounts_rebuild_user_emotion_attribute_state', stdout=out, stderr=err)
+
+        self.assertIn('does not match database attributes', err.getvalue())
+        self.assertIn('with {} mismatches'.format(UserEmotion.objects.count()), out.getvalue())
+
+
+class TestBenchmarkVoteIndexesCommand(TestCase):
+    def test_command_reports_plans_before_and_after_indexes(self):
+        out = StringIO()
+
+        call_command(
+            'accounts_benchmark_vote_indexes',
+            users=2,
+            votes_per_user=20,
+            songs=10,
+            iterations=1,
+            stdout=out
+        )
+        output = out.getvalue()
+
+        self.assertIn('for 2 users on 10 songs', output)
+        self.assertIn('emotion playlist page (before)', output)
+        self.assertIn('emotion playlist page (after)', output)
+        self.assertFalse(UserSongVote.objects.exists())
+
+    def test_command_restores_dropped_indexes(self):
+        call_command(
+            'accounts_benchmark_vote_indexes',
+            users=1,
+            votes_per_user=5,
+            songs=5,
+            iterations=1,
+            stdout=StringIO()
+        )
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, UserSongVote._meta.db_table)
+
+        for index in UserSongVote._meta.indexes:
+            self.assertIn(index.name, constraints)
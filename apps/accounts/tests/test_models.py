@@ -117,6 +117,97 @@ class TestUserEmotion(TestCase):
         self.assertEqual(user_emotion.danceability, self.emotion.danceability)
 
 
+class TestUserEmotionAttributeState(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MoodyUtil.create_user()
+        cls.emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        cls.songs = [
+            MoodyUtil.create_song(energy=.1 * i, valence=.2 + .05 * i, danceability=.3) for i in range(1, 6)
+        ]
+
+    def setUp(self):
+        self.user_emotion = self.user.get_user_emotion_record(self.emotion.name)
+
+    def upvote_songs(self, songs, context=''):
+        # Use `bulk_create` to skip the signal to update UserEmotion attributes
+        UserSongVote.objects.bulk_create([
+            UserSongVote(user=self.user, emotion=self.emotion, song=song, vote=True, context=context) for song in songs
+        ])
+
+    def test_update_attributes_builds_attribute_state(self):
+        self.upvote_songs(self.songs[:2])
+
+        self.user_emotion.update_attributes(candidate_batch_size=3)
+        self.user_emotion.refresh_from_db()
+
+        state = self.user_emotion.attribute_state
+        self.assertEqual(state['batch_size'], 3)
+        self.assertListEqual([song[0] for song in state['songs']], [self.songs[0].pk, self.songs[1].pk])
+        self.assertAlmostEqual(state['sums'][1], self.songs[0].energy + self.songs[1].energy)
+
+    def test_update_attributes_with_song_does_not_query_votes(self):
+        self.upvote_songs(self.songs[:2])
+        self.user_emotion.update_attributes(candidate_batch_size=3)
+        self.upvote_songs(self.songs[2:3])
+
+        # One query each to start the transaction, lock the record and update the record
+        with self.assertNumQueries(4):
+            self.user_emotion.update_attributes(candidate_batch_size=3, song=self.songs[2])
+
+        expected_attributes = self.user_emotion.calculate_attributes(candidate_batch_size=3)
+        self.user_emotion.refresh_from_db()
+
+        self.assertEqual(self.user_emotion.valence, expected_attributes['valence__avg'])
+        self.assertEqual(self.user_emotion.energy, expected_attributes['energy__avg'])
+        self.assertEqual(self.user_emotion.danceability, expected_attributes['danceability__avg'])
+
+    def test_update_attributes_with_song_evicts_oldest_song_when_buffer_is_full(self):
+        self.upvote_songs(self.songs[:3])
+        self.user_emotion.update_attributes(candidate_batch_size=3)
+        self.upvote_songs(self.songs[3:4])
+
+        self.user_emotion.update_attributes(candidate_batch_size=3, song=self.songs[3])
+
+        expected_attributes = self.user_emotion.calculate_attributes(candidate_batch_size=3)
+        self.user_emotion.refresh_from_db()
+        state = self.user_emotion.attribute_state
+
+        self.assertListEqual([song[0] for song in state['songs']], [song.pk for song in self.songs[1:4]])
+        self.assertAlmostEqual(state['sums'][1], sum(song.energy for song in self.songs[1:4]))
+        self.assertEqual(self.user_emotion.energy, expected_attributes['energy__avg'])
+
+    def test_update_attributes_with_song_already_in_state_rebuilds_state(self):
+        self.upvote_songs(self.songs[:3])
+        self.user_emotion.update_attributes(candidate_batch_size=3)
+        self.upvote_songs(self.songs[:1], context='WORK')
+
+        self.user_emotion.update_attributes(candidate_batch_size=3, song=self.songs[0])
+
+        self.user_emotion.refresh_from_db()
+        state = self.user_emotion.attribute_state
+        self.assertEqual(state['songs'][-1][0], self.songs[0].pk)
+        self.assertEqual(len(state['songs']), 3)
+
+    def test_update_attributes_with_song_rebuilds_state_for_different_batch_size(self):
+        self.upvote_songs(self.songs[:3])
+        self.user_emotion.update_attributes(candidate_batch_size=3)
+        self.upvote_songs(self.songs[3:4])
+
+        self.user_emotion.update_attributes(candidate_batch_size=5, song=self.songs[3])
+
+        self.user_emotion.refresh_from_db()
+        state = self.user_emotion.attribute_state
+        self.assertEqual(state['batch_size'], 5)
+        self.assertEqual(len(state['songs']), 4)
+
+    def test_get_attributes_from_empty_attribute_state_returns_null_values(self):
+        self.assertDictEqual(
+            self.user_emotion.get_attributes_from_attribute_state(),
+            {'valence': None, 'energy': None, 'danceability': None}
+        )
+
+
 class TestMoodyUser(TestCase):
     @classmethod
     def setUpTestData(cls):
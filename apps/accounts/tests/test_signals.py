@@ -1,8 +1,10 @@
 from unittest import mock
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
 from accounts.models import UserSongVote
+from accounts.utils import get_vote_version
 from libs.tests.helpers import MoodyUtil
 from tunes.models import Emotion
 
@@ -66,3 +68,43 @@ class TestUpdateUserAttributesSignal(TestCase):
         vote.delete()
 
         mock_update.assert_called_once()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestUpdateUserSongVoteVersionSignal(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MoodyUtil.create_user()
+        cls.song = MoodyUtil.create_song()
+        cls.emotion = Emotion.objects.get(name=Emotion.HAPPY)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_creating_vote_updates_vote_version(self):
+        version = get_vote_version(self.user.pk, self.emotion.pk)
+
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+
+        self.assertNotEqual(get_vote_version(self.user.pk, self.emotion.pk), version)
+
+    def test_deleting_vote_updates_vote_version(self):
+        vote = MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+        version = get_vote_version(self.user.pk, self.emotion.pk)
+
+        vote.delete()
+
+        self.assertNotEqual(get_vote_version(self.user.pk, self.emotion.pk), version)
+
+    def test_saving_vote_stores_new_vote_version_on_vote(self):
+        vote = MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+
+        self.assertEqual(vote._vote_version, get_vote_version(self.user.pk, self.emotion.pk))
+
+    def test_vote_does_not_update_vote_version_for_other_emotion(self):
+        other_emotion = Emotion.objects.get(name=Emotion.MELANCHOLY)
+        version = get_vote_version(self.user.pk, other_emotion.pk)
+
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+
+        self.assertEqual(get_vote_version(self.user.pk, other_emotion.pk), version)
@@ -1,8 +1,17 @@
 from unittest import mock
 
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-from accounts.utils import log_failed_login_attempt
+from accounts.models import UserSongVote
+from accounts.utils import (
+    dispatch_update_user_emotion_attributes,
+    get_user_emotion_attributes_update_counts,
+    log_failed_login_attempt,
+)
+from libs.tests.helpers import MoodyUtil
+from tunes.models import Emotion
 
 
 class TestLogFailedLoginAttempt(TestCase):
@@ -31,3 +40,52 @@ class TestLogFailedLoginAttempt(TestCase):
                 'trace_id': trace_id
             }
         )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+@mock.patch('accounts.utils.UpdateUserEmotionRecordAttributeTask')
+class TestDispatchUpdateUserEmotionAttributes(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_first_dispatch_in_window_runs_task_right_away(self, mock_task):
+        dispatch_update_user_emotion_attributes(1, 2, song_id=3, trace_id='test-trace-id')
+
+        mock_task().delay.assert_called_once_with(1, 2, song_id=3, trace_id='test-trace-id')
+        mock_task().apply_async.assert_not_called()
+        self.assertDictEqual(get_user_emotion_attributes_update_counts(), {'dispatched': 1, 'coalesced': 0})
+
+    def test_dispatches_in_window_are_coalesced_into_one_delayed_task(self, mock_task):
+        for song_id in range(5):
+            dispatch_update_user_emotion_attributes(1, 2, song_id=song_id)
+
+        mock_task().delay.assert_called_once_with(1, 2, song_id=0, trace_id='')
+        mock_task().apply_async.assert_called_once_with(
+            args=(1, 2),
+            kwargs={'trace_id': ''},
+            countdown=settings.USER_EMOTION_ATTRIBUTES_UPDATE_WINDOW
+        )
+        self.assertDictEqual(get_user_emotion_attributes_update_counts(), {'dispatched': 2, 'coalesced': 3})
+
+    def test_dispatches_for_different_emotions_are_not_coalesced(self, mock_task):
+        dispatch_update_user_emotion_attributes(1, 2)
+        dispatch_update_user_emotion_attributes(1, 3)
+
+        self.assertEqual(mock_task().delay.call_count, 2)
+
+    def test_deleting_votes_for_song_dispatches_one_update_right_away(self, mock_task):
+        user = MoodyUtil.create_user()
+        song = MoodyUtil.create_song()
+        emotion = Emotion.objects.get(name=Emotion.HAPPY)
+
+        # Use `bulk_create` to skip the signal to update UserEmotion attributes
+        UserSongVote.objects.bulk_create([
+            UserSongVote(user=user, emotion=emotion, song=song, vote=True, context=context)
+            for context in ['WORK', 'PARTY', 'RELAX']
+        ])
+
+        for vote in UserSongVote.objects.filter(user=user):
+            vote.delete()
+
+        mock_task().delay.assert_called_once_with(user.pk, emotion.pk, song_id=None, trace_id='')
+        mock_task().apply_async.assert_called_once()
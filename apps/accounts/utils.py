@@ -1,5 +1,11 @@
 import logging
 
+from django.conf import settings
+from django.core.cache import cache
+
+from accounts.tasks import UpdateUserEmotionRecordAttributeTask
+from libs.utils import get_version_counter, get_version_counter_seed, increment_cache_counter
+
 
 logger = logging.getLogger(__name__)
 
@@ -25,3 +31,86 @@ def log_failed_login_attempt(credentials, request, **kwargs):
             'trace_id': request.trace_id
         }
     )
+
+
+def dispatch_update_user_emotion_attributes(user_id, emotion_id, song_id=None, trace_id=''):
+    """
+    Dispatch a task to update the UserEmotion attributes for a user and emotion, coalescing dispatches
+    that happen within `settings.USER_EMOTION_ATTRIBUTES_UPDATE_WINDOW` seconds of each other.
+
+    The first dispatch in a window runs right away. Any further dispatches in the window are collapsed
+    into a single task that runs when the window ends, which recomputes the attributes from all of the
+    votes for the user and emotion so that none of the coalesced votes are missed.
+
+    :param user_id: (int) Primary key for MoodyUser in our system
+    :param emotion_id: (int) Primary key for Emotion in our system
+    :param song_id: (int) Optional primary key for the Song the user just upvoted for the Emotion
+    :param trace_id: (str) Optional trace id of the request that caused the dispatch
+    """
+    window = settings.USER_EMOTION_ATTRIBUTES_UPDATE_WINDOW
+    cache_key = 'user-emotion-attributes-update:{}:{}'.format(user_id, emotion_id)
+
+    if cache.add(cache_key, True, window):
+        UpdateUserEmotionRecordAttributeTask().delay(user_id, emotion_id, song_id=song_id, trace_id=trace_id)
+        increment_cache_counter(settings.USER_EMOTION_ATTRIBUTES_UPDATE_DISPATCHED_CACHE_KEY)
+
+    elif cache.add('{}:trailing'.format(cache_key), True, window):
+        UpdateUserEmotionRecordAttributeTask().apply_async(
+            args=(user_id, emotion_id),
+            kwargs={'trace_id': trace_id},
+            countdown=window
+        )
+        increment_cache_counter(settings.USER_EMOTION_ATTRIBUTES_UPDATE_DISPATCHED_CACHE_KEY)
+
+    else:
+        increment_cache_counter(settings.USER_EMOTION_ATTRIBUTES_UPDATE_COALESCED_CACHE_KEY)
+
+
+def get_user_emotion_attributes_update_counts():
+    """
+    Return the number of UserEmotion attribute update tasks that were dispatched, and the number
+    that were coalesced into an already dispatched task
+
+    :return: (dict)
+    """
+    counts = cache.get_many([
+        settings.USER_EMOTION_ATTRIBUTES_UPDATE_DISPATCHED_CACHE_KEY,
+        settings.USER_EMOTION_ATTRIBUTES_UPDATE_COALESCED_CACHE_KEY,
+    ])
+
+    return {
+        'dispatched': counts.get(settings.USER_EMOTION_ATTRIBUTES_UPDATE_DISPATCHED_CACHE_KEY, 0),
+        'coalesced': counts.get(settings.USER_EMOTION_ATTRIBUTES_UPDATE_COALESCED_CACHE_KEY, 0),
+    }
+
+
+def _make_vote_version_cache_key(user_id, emotion_id):
+    return 'user-vote-version:{}:{}'.format(user_id, emotion_id)
+
+
+def get_vote_version(user_id, emotion_id):
+    """
+    Return the version of the votes for a user and emotion. The version changes every time the user
+    votes on a song for the emotion or deletes a vote for the emotion.
+
+    :param user_id: (int) Primary key for MoodyUser in our system
+    :param emotion_id: (int) Primary key for Emotion in our system
+
+    :return: (int|None) Version, or None if the cache backend does not store versions
+    """
+    return get_version_counter(_make_vote_version_cache_key(user_id, emotion_id))
+
+
+def update_vote_version(user_id, emotion_id):
+    """
+    Bump the version of the votes for a user and emotion, see `get_vote_version`
+
+    :param user_id: (int) Primary key for MoodyUser in our system
+    :param emotion_id: (int) Primary key for Emotion in our system
+
+    :return: (int|None) New version, or None if the cache backend does not store versions
+    """
+    return increment_cache_counter(
+        _make_vote_version_cache_key(user_id, emotion_id),
+        initial=get_version_counter_seed()
+    )
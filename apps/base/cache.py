@@ -0,0 +1,376 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+_MISSING = object()
+
+
+class TwoTierCache(BaseCache):
+    """
+    Cache backend that keeps a bounded, in-process LRU cache in front of another configured cache. Reads
+    are answered from the local tier when possible, and values read from or written to the remote cache
+    are kept in the local tier for a short time.
+
+    `LOCATION` is the alias of the remote cache in `CACHES`. `OPTIONS` configure the local tier:
+        - MAX_ENTRIES: Max number of values to keep in the local tier
+        - TIMEOUT: Default number of seconds to keep values in the local tier
+        - VERSION_CHECK_INTERVAL: Number of seconds between checks for writes made by other processes
+        - POLICIES: Mapping of key prefix to the policy for keys starting with the prefix. The longest
+          matching prefix wins. A policy may set:
+            - local (bool): Keep values for the keys in the local tier (default True)
+            - timeout (int): Number of seconds to keep values in the local tier
+
+    Every write to a key kept in the local tier bumps a version counter in the remote cache for the
+    policy the key belongs to. Each process checks the counters at most every `VERSION_CHECK_INTERVAL`
+    seconds, and drops its local values for any policy whose counter has changed. Values in the local tier
+    can be stale for up to that long after another process writes them, so keys that are written on most
+    requests or that need to be exact across processes (counters, throttle state) should not be kept locally.
+    Since a write drops the local values for the whole policy, this includes keys specific to a user. Add a
+    policy for the empty prefix to change the policy for keys that match no other prefix.
+
+    Hit and miss counts for each tier are kept per process and added to counters in the remote cache every
+    version check, see `get_stats` and `get_published_stats`.
+    """
+    DEFAULT_POLICY = ''
+    VERSION_KEY_PREFIX = 'two-tier-cache:version:'
+    STATS_KEY_PREFIX = 'two-tier-cache:stats:'
+    STATS = ('local_hits', 'local_misses', 'remote_hits', 'remote_misses')
+
+    def __init__(self, location, params):
+        super().__init__(params)
+
+        options = params.get('OPTIONS', {})
+
+        self._remote_alias = location
+        self._max_local_entries = options.get('MAX_ENTRIES', 1000)
+        self._local_timeout = options.get('TIMEOUT', 60)
+        self._version_check_interval = options.get('VERSION_CHECK_INTERVAL', 1)
+        self._policies = {self.DEFAULT_POLICY: {}}
+        self._policies.update(options.get('POLICIES', {}))
+
+        self._local = OrderedDict()  # Mapping of key to (policy, expiration time, pickled value)
+        self._versions = {}
+        self._last_version_check = 0
+        self._stats = dict.fromkeys(self.STATS, 0)
+        self._unpublished_stats = dict.fromkeys(self.STATS, 0)
+        self._lock = threading.RLock()
+
+    @property
+    def remote(self):
+        return caches[self._remote_alias]
+
+    def _get_policy(self, key):
+        """
+        Return the prefix of the policy for the key
+
+        :param key: (str) Cache key, before any prefix or version is added to it
+
+        :return: (str)
+        """
+        return max((prefix for prefix in self._policies if key.startswith(prefix)), key=len)
+
+    def _is_local(self, policy):
+        return self._policies[policy].get('local', True)
+
+    def _make_local_key(self, key, version):
+        return self.remote.make_key(key, version=version)
+
+    def _record(self, stat):
+        self._stats[stat] += 1
+        self._unpublished_stats[stat] += 1
+
+    def _publish_stats(self):
+        stats = {stat: count for stat, count in self._unpublished_stats.items() if count}
+        self._unpublished_stats = dict.fromkeys(self.STATS, 0)
+
+        for stat, count in stats.items():
+            key = self.STATS_KEY_PREFIX + stat
+            self.remote.add(key, 0, timeout=None)
+
+            try:
+                self.remote.incr(key, count)
+            except ValueError:
+                # Counter was evicted before we could increment it, or the remote cache does not store values
+                pass
+
+    def _check_versions(self):
+        """
+        Drop the local values for every policy whose version counter has been bumped by another process
+        since the last check, and publish the stats collected since the last check
+        """
+        now = time.monotonic()
+        if now - self._last_version_check < self._version_check_interval:
+            return
+
+        self._last_version_check = now
+
+        version_keys = {self.VERSION_KEY_PREFIX + policy: policy for policy in self._policies}
+        versions = {
+            version_keys[version_key]: version
+            for version_key, version in self.remote.get_many(list(version_keys)).items()
+        }
+
+        changed_policies = {
+            policy for policy in self._policies
+            if versions.get(policy) != self._versions.get(policy)
+        }
+
+        if changed_policies:
+            for local_key in [key for key, (policy, _, _) in self._local.items() if policy in changed_policies]:
+                del self._local[local_key]
+
+        self._versions = versions
+        self._publish_stats()
+
+    def _bump_version(self, policy):
+        """
+        Bump the version counter for the policy, so other processes drop their local values for it. Our own
+        local tier is updated by the write itself, so we record the new version as already seen.
+        """
+        version_key = self.VERSION_KEY_PREFIX + policy
+        self.remote.add(version_key, 0, timeout=None)
+
+        try:
+            new_version = self.remote.incr(version_key)
+        except ValueError:
+            # Counter was evicted before we could increment it, or the remote cache does not store values
+            return
+
+        # If another process bumped the version since our last check, leave our recorded version alone
+        # so the next check drops the values that process wrote
+        if new_version == (self._versions.get(policy) or 0) + 1:
+            self._versions[policy] = new_version
+
+    def _get_local_timeout(self, policy, timeout):
+        local_timeout = self._policies[policy].get('timeout', self._local_timeout)
+
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            local_timeout = min(local_timeout, timeout)
+
+        return local_timeout
+
+    def _set_local(self, local_key, policy, value, timeout=DEFAULT_TIMEOUT):
+        local_timeout = self._get_local_timeout(policy, timeout)
+
+        if local_timeout <= 0:
+            self._local.pop(local_key, None)
+            return
+
+        self._local[local_key] = (
+            policy,
+            time.monotonic() + local_timeout,
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        )
+        self._local.move_to_end(local_key)
+
+        while len(self._local) > self._max_local_entries:
+            self._local.popitem(last=False)
+
+    def _get_local(self, local_key):
+        entry = self._local.get(local_key)
+
+        if entry is None:
+            return _MISSING
+
+        _, expires_at, pickled_value = entry
+
+        if expires_at < time.monotonic():
+            del self._local[local_key]
+            return _MISSING
+
+        self._local.move_to_end(local_key)
+
+        return pickle.loads(pickled_value)
+
+    def get(self, key, default=None, version=None):
+        policy = self._get_policy(key)
+
+        if not self._is_local(policy):
+            return self.remote.get(key, default, version=version)
+
+        local_key = self._make_local_key(key, version)
+
+        with self._lock:
+            self._check_versions()
+
+            value = self._get_local(local_key)
+
+            if value is not _MISSING:
+                self._record('local_hits')
+                return value
+
+            self._record('local_misses')
+
+        value = self.remote.get(key, _MISSING, version=version)
+
+        with self._lock:
+            if value is _MISSING:
+                self._record('remote_misses')
+                return default
+
+            self._record('remote_hits')
+            self._set_local(local_key, policy, value)
+
+        return value
+
+    def get_many(self, keys, version=None):
+        values = {}
+        remote_keys = []
+
+        with self._lock:
+            self._check_versions()
+
+            for key in keys:
+                if not self._is_local(self._get_policy(key)):
+                    remote_keys.append(key)
+                    continue
+
+                value = self._get_local(self._make_local_key(key, version))
+
+                if value is _MISSING:
+                    self._record('local_misses')
+                    remote_keys.append(key)
+                else:
+                    self._record('local_hits')
+                    values[key] = value
+
+        if not remote_keys:
+            return values
+
+        remote_values = self.remote.get_many(remote_keys, version=version)
+
+        with self._lock:
+            for key in remote_keys:
+                policy = self._get_policy(key)
+
+                if not self._is_local(policy):
+                    continue
+
+                if key in remote_values:
+                    self._record('remote_hits')
+                    self._set_local(self._make_local_key(key, version), policy, remote_values[key])
+                else:
+                    self._record('remote_misses')
+
+        values.update(remote_values)
+
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.remote.set(key, value, timeout=timeout, version=version)
+        self._write_local(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = self.remote.set_many(data, timeout=timeout, version=version)
+        changed_policies = set()
+
+        with self._lock:
+            for key, value in data.items():
+                policy = self._get_policy(key)
+
+                if self._is_local(policy):
+                    self._set_local(self._make_local_key(key, version), policy, value, timeout)
+                    changed_policies.add(policy)
+
+            # Bump each policy once, instead of once for every key written
+            for policy in changed_policies:
+                self._bump_version(policy)
+
+        return failed_keys
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.remote.add(key, value, timeout=timeout, version=version)
+
+        if added:
+            self._write_local(key, value, timeout, version)
+
+        return added
+
+    def _write_local(self, key, value, timeout, version):
+        policy = self._get_policy(key)
+
+        if not self._is_local(policy):
+            return
+
+        with self._lock:
+            self._set_local(self._make_local_key(key, version), policy, value, timeout)
+            self._bump_version(policy)
+
+    def delete(self, key, version=None):
+        deleted = self.remote.delete(key, version=version)
+        self._delete_local(key, version)
+
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self.remote.delete_many(keys, version=version)
+        changed_policies = set()
+
+        with self._lock:
+            for key in keys:
+                policy = self._get_policy(key)
+
+                if self._is_local(policy):
+                    self._local.pop(self._make_local_key(key, version), None)
+                    changed_policies.add(policy)
+
+            for policy in changed_policies:
+                self._bump_version(policy)
+
+    def _delete_local(self, key, version):
+        policy = self._get_policy(key)
+
+        if not self._is_local(policy):
+            return
+
+        with self._lock:
+            self._local.pop(self._make_local_key(key, version), None)
+            self._bump_version(policy)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.remote.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.remote.incr(key, delta, version=version)
+        self._delete_local(key, version)
+
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self.remote.clear()
+
+        with self._lock:
+            self._local.clear()
+
+            for policy in self._policies:
+                self._bump_version(policy)
+
+    def close(self, **kwargs):
+        self.remote.close(**kwargs)
+
+    def get_stats(self):
+        """
+        Return the hit and miss counts for each tier in this process
+
+        :return: (dict) Mapping of stat name to count
+        """
+        with self._lock:
+            return dict(self._stats, local_entries=len(self._local))
+
+    def get_published_stats(self):
+        """
+        Return the hit and miss counts for each tier published by every process using the remote cache
+
+        :return: (dict) Mapping of stat name to count
+        """
+        published_stats = self.remote.get_many([self.STATS_KEY_PREFIX + stat for stat in self.STATS])
+
+        return {stat: published_stats.get(self.STATS_KEY_PREFIX + stat, 0) for stat in self.STATS}
@@ -1,7 +1,23 @@
 import logging
+import statistics
+import time
 import uuid
+from contextlib import contextmanager
 
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+
+def get_plan_nodes(plan):
+    """
+    Yield every node in an EXPLAIN plan, depth first
+
+    :param plan: (dict) Plan node from the output of EXPLAIN (FORMAT JSON)
+    """
+    yield plan
+
+    for child in plan.get('Plans', []):
+        yield from get_plan_nodes(child)
 
 
 class MoodyBaseCommand(BaseCommand):
@@ -51,3 +67,130 @@ class MoodyBaseCommand(BaseCommand):
         )
 
         return super().execute(*args, **options)
+
+
+class MoodyBenchmarkCommand(MoodyBaseCommand):
+    """
+    Base class for commands that benchmark a code path against generated data.
+
+    Override the run_benchmark() method of your command class to generate data and time the code
+    paths you are interested in. Everything done in run_benchmark() happens inside a transaction
+    that is rolled back when the benchmark finishes, so generated records never outlive the command.
+
+    Generating large datasets is write heavy, so these commands should only be run against a
+    development database.
+    """
+    default_iterations = 20
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=self.default_iterations,
+            help='Number of times to run each benchmarked code path'
+        )
+
+    def run_benchmark(self, *args, **options):
+        raise NotImplementedError('Benchmark commands must define a run_benchmark() method')
+
+    def time_call(self, func, iterations):
+        """
+        Call `func` `iterations` times and return timing statistics for the calls.
+
+        :param func: (callable) Function to benchmark, called with no arguments
+        :param iterations: (int) Number of times to call the function
+
+        :return: (dict) Timings in milliseconds
+            - median (float)
+            - p95 (float)
+            - max (float)
+        """
+        timings = []
+
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+
+        return {
+            'median': statistics.median(timings),
+            'p95': timings[min(len(timings) - 1, int(len(timings) * .95))],
+            'max': timings[-1],
+        }
+
+    def explain_analyze(self, queryset):
+        """
+        Run EXPLAIN ANALYZE for the queryset and return the plan. Django's `QuerySet.explain()` returns
+        the plan as text, so we run EXPLAIN ourselves to get the plan as JSON.
+
+        :param queryset: (QuerySet) Query to explain
+
+        :return: (dict) Plan from the output of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+        """
+        sql, params = queryset.query.sql_with_params()
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {}'.format(sql), params)
+            return cursor.fetchone()[0][0]
+
+    def write_plan(self, label, queryset):
+        """
+        Run EXPLAIN ANALYZE for the queryset and write a summary of the plan to stdout.
+
+        :param label: (str) Name of the benchmarked query
+        :param queryset: (QuerySet) Query to explain
+        """
+        plan = self.explain_analyze(queryset)
+        nodes = list(get_plan_nodes(plan['Plan']))
+
+        indexes = sorted({node['Index Name'] for node in nodes if 'Index Name' in node})
+        sorts = sum(1 for node in nodes if node['Node Type'] == 'Sort')
+
+        self.stdout.write(
+            '{label:<50} execution={execution_time:.3f}ms sorts={sorts} indexes={indexes}'.format(
+                label=label,
+                execution_time=plan['Execution Time'],
+                sorts=sorts,
+                indexes=','.join(indexes) or '-'
+            )
+        )
+
+    @contextmanager
+    def without_indexes(self, model):
+        """
+        Drop the indexes declared in `Meta.indexes` of the model for the duration of the block. The indexes
+        are dropped in a savepoint that is rolled back when the block exits, which restores them.
+
+        :param model: (Model) Model to drop the indexes of
+        """
+        with transaction.atomic():
+            with connection.schema_editor() as schema_editor:
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
+
+            yield
+
+            transaction.set_rollback(True)
+
+    def write_timing(self, label, timings):
+        """
+        Write the timing statistics returned from `time_call` to stdout.
+
+        :param label: (str) Name of the benchmarked code path
+        :param timings: (dict) Timing statistics returned from `time_call`
+        """
+        self.stdout.write(
+            '{label:<40} median={median:>10.3f}ms p95={p95:>10.3f}ms max={max:>10.3f}ms'.format(
+                label=label,
+                **timings
+            )
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run_benchmark(*args, **options)
+
+            # Throw away all the data generated for the benchmark
+            transaction.set_rollback(True)
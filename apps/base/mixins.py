@@ -1,6 +1,10 @@
 import copy
+import hashlib
+import json
 import logging
 
+from django.utils.cache import get_conditional_response, patch_cache_control
+
 from base.responses import BadRequest
 from libs.moody_logging import auto_fingerprint, update_logging_data
 
@@ -12,6 +16,74 @@ class MoodyMixin(object):
     """Base class for mixins in mtdj"""
 
 
+class ConditionalGetMixin(MoodyMixin):
+    """
+    Mixin to answer GET requests for unchanged data with a `304 Not Modified` response, without building the
+    response again.
+
+    Views using this mixin define `get_etag_versions()`, which returns cheap version values (usually counters kept
+    in the cache) that change whenever the data in the response changes. The ETag for a response is built from the
+    versions, the request user, and the full path of the request. If the ETag matches the `If-None-Match` header
+    of the request, we return a 304 response before calling the view handler.
+
+    ETags are weak, because responses can include values that change on every request (like the trace id) without
+    the data in the response changing.
+
+    When used along with `GetRequestValidatorMixin`, this mixin must come after it so the request data is validated
+    before the versions are looked up.
+    """
+
+    def get_etag_versions(self):
+        """
+        Return the versions of the data included in the response for the request. If any version is None, the
+        request is handled without an ETag.
+
+        :return: (list|None)
+        """
+        raise NotImplementedError('{} must implement get_etag_versions()'.format(self.__class__.__name__))
+
+    def get_etag(self, request):
+        """
+        Build the ETag for the response to the request from the versions returned by `get_etag_versions()`
+
+        :param request: (rest_framework.request.Request) Request to build the ETag for
+
+        :return: (str|None) Quoted weak ETag, or None if the versions could not be determined
+        """
+        versions = self.get_etag_versions()
+
+        if versions is None or None in versions:
+            return None
+
+        key = json.dumps([request.user.pk, request.get_full_path(), versions], sort_keys=True, default=str)
+
+        return 'W/"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+
+    def _set_etag_headers(self, response, etag):
+        response['ETag'] = etag
+
+        # Clients should revalidate their copy of the response on every request, and shared caches
+        # should not store responses for a user
+        patch_cache_control(response, private=True, no_cache=True)
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+
+        if etag is not None:
+            not_modified_response = get_conditional_response(request, etag=etag)
+
+            if not_modified_response is not None:
+                self._set_etag_headers(not_modified_response, etag)
+                return not_modified_response
+
+        response = super().get(request, *args, **kwargs)
+
+        if etag is not None and response.status_code == 200:
+            self._set_etag_headers(response, etag)
+
+        return response
+
+
 class ValidateRequestDataMixin(MoodyMixin):
     """
     Mixin to verify incoming request data. This class contains logic to validate incoming request data for various
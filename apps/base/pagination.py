@@ -0,0 +1,212 @@
+import base64
+import json
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.fields import BooleanField
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class AnnotatedPagePaginator(Paginator):
+    """
+    Paginator that adds annotations to the query for the requested page only. The object list is
+    counted without the annotations, so annotations that are expensive to compute (like window
+    aggregates over the whole object list) are not computed again by the count query.
+    """
+
+    def __init__(self, object_list, per_page, page_annotations=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.page_annotations = page_annotations or {}
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+
+        if top + self.orphans >= self.count:
+            top = self.count
+
+        return self._get_page(self.object_list.annotate(**self.page_annotations)[bottom:top], number, self)
+
+
+class AnnotatedPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination that adds the annotations returned from the `get_page_annotations()`
+    method of the view to the query for the page, see `AnnotatedPagePaginator`
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_annotations = view.get_page_annotations() if hasattr(view, 'get_page_annotations') else {}
+        self.django_paginator_class = partial(AnnotatedPagePaginator, page_annotations=page_annotations)
+
+        return super().paginate_queryset(queryset, request, view=view)
+
+
+class CreatedKeysetPagination(BasePagination):
+    """
+    Keyset pagination over records ordered from newest to oldest by (`created`, `id`).
+
+    Each page is fetched by filtering on the (`created`, `id`) values of the last record on the
+    previous page, instead of counting and skipping over every record before the page. This keeps
+    the cost of a page the same no matter how deep into the results it is. The position is passed
+    between requests in an opaque `cursor` query parameter.
+
+    The total count of records is skipped unless the request asks for it with `include_count=true`. If the
+    view validates the request into `cleaned_data`, the validated `include_count` value is used.
+    """
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    cursor_query_param = 'cursor'
+    count_query_param = 'include_count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def encode_cursor(self, position, reverse=False):
+        """
+        Build the opaque cursor for a position in the results
+
+        :param position: (tuple|None) (`created`, `id`) values of the record to page from. If None, page from
+            the start of the results (or the end of the results for reverse cursors)
+        :param reverse: (bool) Page backwards from the position instead of forwards
+
+        :return: (str)
+        """
+        data = {'r': reverse}
+
+        if position is not None:
+            created, pk = position
+            data['p'] = [created.isoformat(), pk]
+
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        Parse an opaque cursor built by `encode_cursor`
+
+        :param cursor: (str) Cursor passed in the request
+
+        :return: (tuple) (position, reverse)
+
+        :raises: `NotFound` if the cursor is invalid
+        """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            reverse = bool(data['r'])
+            position = None
+
+            if 'p' in data:
+                created, pk = data['p']
+                position = (parse_datetime(created), int(pk))
+
+                if position[0] is None:
+                    raise ValueError('Invalid created value')
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def get_include_count(self, request, view=None):
+        """
+        Return True if the request asks for the total count of records
+
+        :param request: (rest_framework.request.Request) Request for the page
+        :param view: (rest_framework.views.APIView) View paginating the records
+
+        :return: (bool)
+        """
+        cleaned_data = getattr(view, 'cleaned_data', None)
+
+        if cleaned_data is not None:
+            return bool(cleaned_data.get(self.count_query_param))
+
+        return request.query_params.get(self.count_query_param) in BooleanField.TRUE_VALUES
+
+    def _get_position(self, record):
+        return record.created, record.pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = None
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        position, reverse = self.decode_cursor(cursor) if cursor else (None, False)
+
+        if self.get_include_count(request, view):
+            self.count = queryset.count()
+
+        if reverse:
+            queryset = queryset.order_by('created', 'id')
+
+            if position is not None:
+                created, pk = position
+                queryset = queryset.filter(Q(created__gt=created) | Q(created=created, id__gt=pk))
+        else:
+            queryset = queryset.order_by('-created', '-id')
+
+            if position is not None:
+                created, pk = position
+                queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+
+        # Fetch one extra record to find out if there are more records after this page
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self._get_position(self.page[-1]))
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self._get_position(self.page[0]), reverse=True)
+        )
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_last_link(self):
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(None, reverse=True)
+        )
+
+    def get_paginated_response(self, data):
+        response_data = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+
+        if self.count is not None:
+            response_data['count'] = self.count
+
+        return Response(response_data)
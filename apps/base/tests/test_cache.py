@@ -0,0 +1,214 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from base.cache import TwoTierCache
+
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    'remote': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'two-tier-cache-tests',
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestTwoTierCache(TestCase):
+    def setUp(self):
+        caches['remote'].clear()
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        options.setdefault('POLICIES', {'remote-only:': {'local': False}, 'short:': {'timeout': 0}})
+
+        return TwoTierCache('remote', {'OPTIONS': options})
+
+    def test_get_returns_value_from_remote_cache(self):
+        caches['remote'].set('foo', 'bar')
+
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.assertEqual(self.cache.get_stats()['remote_hits'], 1)
+
+    def test_get_returns_default_for_missing_key(self):
+        self.assertEqual(self.cache.get('foo', 'default'), 'default')
+        self.assertEqual(self.cache.get_stats()['remote_misses'], 1)
+
+    def test_get_for_value_read_from_remote_cache_is_answered_locally(self):
+        caches['remote'].set('foo', 'bar')
+        self.cache.get('foo')
+
+        with mock.patch.object(caches['remote'], 'get') as mock_remote_get:
+            value = self.cache.get('foo')
+
+        mock_remote_get.assert_not_called()
+        self.assertEqual(value, 'bar')
+        self.assertEqual(self.cache.get_stats()['local_hits'], 1)
+
+    def test_set_writes_to_remote_cache_and_local_tier(self):
+        self.cache.set('foo', 'bar')
+
+        self.assertEqual(caches['remote'].get('foo'), 'bar')
+        self.assertEqual(self.cache.get_stats()['local_entries'], 1)
+
+    def test_get_returns_copy_of_local_value(self):
+        self.cache.set('foo', ['bar'])
+        self.cache.get('foo').append('baz')
+
+        self.assertEqual(self.cache.get('foo'), ['bar'])
+
+    def test_delete_removes_value_from_both_tiers(self):
+        self.cache.set('foo', 'bar')
+        self.cache.delete('foo')
+
+        self.assertIsNone(caches['remote'].get('foo'))
+        self.assertIsNone(self.cache.get('foo'))
+
+    def test_get_many_reads_remote_cache_only_for_keys_missing_locally(self):
+        self.cache.set('foo', 'bar')
+        caches['remote'].set_many({'baz': 'qux', 'remote-only:foo': 'bar'})
+
+        with mock.patch.object(caches['remote'], 'get_many', wraps=caches['remote'].get_many) as mock_get_many:
+            values = self.cache.get_many(['foo', 'baz', 'remote-only:foo', 'missing'])
+
+        mock_get_many.assert_called_with(['baz', 'remote-only:foo', 'missing'], version=None)
+        self.assertEqual(values, {'foo': 'bar', 'baz': 'qux', 'remote-only:foo': 'bar'})
+
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['remote_hits'], 1)
+        self.assertEqual(stats['remote_misses'], 1)
+
+    def test_get_many_keeps_values_read_from_remote_cache_locally(self):
+        caches['remote'].set_many({'foo': 'bar', 'remote-only:foo': 'bar'})
+        self.cache.get_many(['foo', 'remote-only:foo'])
+
+        with mock.patch.object(caches['remote'], 'get_many', wraps=caches['remote'].get_many) as mock_get_many:
+            self.cache.get_many(['foo'])
+
+        mock_get_many.assert_not_called()
+        self.assertEqual(self.cache.get_stats()['local_entries'], 1)
+
+    def test_set_many_writes_to_remote_cache_and_local_tier(self):
+        self.cache.set_many({'foo': 'bar', 'baz': 'qux', 'remote-only:foo': 'bar'})
+
+        self.assertEqual(
+            caches['remote'].get_many(['foo', 'baz', 'remote-only:foo']),
+            {'foo': 'bar', 'baz': 'qux', 'remote-only:foo': 'bar'}
+        )
+        self.assertEqual(self.cache.get_stats()['local_entries'], 2)
+
+    def test_set_many_bumps_policy_version_once(self):
+        with mock.patch.object(self.cache, '_bump_version') as mock_bump_version:
+            self.cache.set_many({'foo': 'bar', 'baz': 'qux', 'remote-only:foo': 'bar'})
+
+        mock_bump_version.assert_called_once_with(TwoTierCache.DEFAULT_POLICY)
+
+    def test_delete_many_removes_values_from_both_tiers(self):
+        self.cache.set_many({'foo': 'bar', 'baz': 'qux'})
+
+        with mock.patch.object(self.cache, '_bump_version') as mock_bump_version:
+            self.cache.delete_many(['foo', 'baz'])
+
+        mock_bump_version.assert_called_once_with(TwoTierCache.DEFAULT_POLICY)
+        self.assertEqual(caches['remote'].get_many(['foo', 'baz']), {})
+        self.assertEqual(self.cache.get_many(['foo', 'baz']), {})
+
+    def test_add_does_not_overwrite_existing_value(self):
+        caches['remote'].set('foo', 'bar')
+
+        self.assertFalse(self.cache.add('foo', 'baz'))
+        self.assertEqual(self.cache.get('foo'), 'bar')
+
+    def test_incr_drops_local_value(self):
+        self.cache.set('counter', 1)
+
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.get('counter'), 2)
+
+    def test_local_tier_evicts_least_recently_used_value(self):
+        cache = self.make_cache(MAX_ENTRIES=2)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        cache.get('foo')
+        cache.set('baz', 3)
+
+        local_keys = list(cache._local)
+
+        self.assertEqual(local_keys, [caches['remote'].make_key('foo'), caches['remote'].make_key('baz')])
+
+    @mock.patch('base.cache.time.monotonic')
+    def test_local_value_expires_after_timeout(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        cache = self.make_cache(TIMEOUT=10, VERSION_CHECK_INTERVAL=1000)
+        cache.set('foo', 'bar')
+        caches['remote'].set('foo', 'baz')
+
+        mock_monotonic.return_value = 105
+        self.assertEqual(cache.get('foo'), 'bar')
+
+        mock_monotonic.return_value = 111
+        self.assertEqual(cache.get('foo'), 'baz')
+
+    def test_local_value_timeout_is_capped_by_write_timeout(self):
+        self.cache.set('foo', 'bar', timeout=0)
+
+        self.assertEqual(self.cache.get_stats()['local_entries'], 0)
+
+    def test_policy_with_local_disabled_always_reads_remote_cache(self):
+        self.cache.set('remote-only:foo', 'bar')
+        caches['remote'].set('remote-only:foo', 'baz')
+
+        self.assertEqual(self.cache.get('remote-only:foo'), 'baz')
+        self.assertEqual(self.cache.get_stats()['local_entries'], 0)
+
+    def test_policy_timeout_is_used_for_matching_keys(self):
+        self.cache.set('short:foo', 'bar')
+
+        self.assertEqual(self.cache.get_stats()['local_entries'], 0)
+
+    def test_get_policy_returns_longest_matching_prefix(self):
+        cache = self.make_cache(POLICIES={'browse:': {}, 'browse:cached-playlist:': {}})
+
+        self.assertEqual(cache._get_policy('browse:cached-playlist:foo'), 'browse:cached-playlist:')
+        self.assertEqual(cache._get_policy('browse:voted-song-ids:foo'), 'browse:')
+        self.assertEqual(cache._get_policy('foo'), TwoTierCache.DEFAULT_POLICY)
+
+    def test_write_in_other_process_drops_local_value(self):
+        cache = self.make_cache(VERSION_CHECK_INTERVAL=0)
+        other_cache = self.make_cache(VERSION_CHECK_INTERVAL=0)
+
+        cache.set('foo', 'bar')
+        self.assertEqual(cache.get('foo'), 'bar')
+
+        other_cache.set('foo', 'baz')
+
+        self.assertEqual(cache.get('foo'), 'baz')
+
+    def test_own_write_does_not_drop_local_values(self):
+        cache = self.make_cache(VERSION_CHECK_INTERVAL=0)
+        cache.set('foo', 'bar')
+        cache.set('baz', 'qux')
+
+        cache.get('foo')
+
+        self.assertEqual(cache.get_stats()['local_hits'], 1)
+
+    def test_stats_are_published_to_remote_cache(self):
+        cache = self.make_cache(VERSION_CHECK_INTERVAL=0)
+        cache.set('foo', 'bar')
+        cache.get('foo')
+        cache.get('missing')
+
+        # Stats are published on the next version check
+        cache.get('foo')
+
+        published_stats = cache.get_published_stats()
+
+        self.assertEqual(published_stats['local_hits'], 1)
+        self.assertEqual(published_stats['local_misses'], 1)
+        self.assertEqual(published_stats['remote_misses'], 1)
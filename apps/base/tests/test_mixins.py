@@ -1,10 +1,12 @@
 from unittest import mock
 
 from django.test import TestCase
+from rest_framework import generics
 from rest_framework.request import Request
+from rest_framework.response import Response
 from rest_framework.test import APIRequestFactory
 
-from base.mixins import ValidateRequestDataMixin
+from base.mixins import ConditionalGetMixin, ValidateRequestDataMixin
 from libs.tests.helpers import MoodyUtil
 
 
@@ -107,3 +109,69 @@ class TestValidateRequestDataMixin(TestCase):
 
         self.assertFalse(resp)
         mock_bad_request_logger.assert_called_once_with(request, mock_serializer)
+
+
+class ContentView(generics.GenericAPIView):
+    def get(self, request, *args, **kwargs):
+        return Response({'foo': 'bar'})
+
+
+class ConditionalGetView(ConditionalGetMixin, ContentView):
+    versions = [1]
+
+    def get_etag_versions(self):
+        return self.versions
+
+
+class TestConditionalGetMixin(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = MoodyUtil.create_user()
+
+    def get(self, **headers):
+        request = self.factory.get('/test/', **headers)
+        request.user = self.user
+
+        return ConditionalGetView.as_view()(request)
+
+    def test_response_includes_etag(self):
+        resp = self.get()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['ETag'].startswith('W/"'))
+        self.assertIn('no-cache', resp['Cache-Control'])
+        self.assertIn('private', resp['Cache-Control'])
+
+    def test_matching_etag_returns_not_modified_without_calling_handler(self):
+        etag = self.get()['ETag']
+
+        with mock.patch.object(ContentView, 'get') as mock_get:
+            resp = self.get(HTTP_IF_NONE_MATCH=etag)
+
+        mock_get.assert_not_called()
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], etag)
+
+    def test_changed_versions_return_full_response(self):
+        etag = self.get()['ETag']
+
+        with mock.patch.object(ConditionalGetView, 'versions', [2]):
+            resp = self.get(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+    def test_etag_is_different_for_each_user(self):
+        etag = self.get()['ETag']
+        self.user = MoodyUtil.create_user(username='other-user')
+
+        resp = self.get(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_missing_version_skips_etag(self):
+        with mock.patch.object(ConditionalGetView, 'versions', [1, None]):
+            resp = self.get(HTTP_IF_NONE_MATCH='*')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.has_header('ETag'))
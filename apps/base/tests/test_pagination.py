@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.db import connection
+from django.db.models import Count, Window
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from base.pagination import AnnotatedPagePaginator, CreatedKeysetPagination
+from libs.tests.helpers import MoodyUtil
+from tunes.models import Song
+
+
+class TestCreatedKeysetPagination(TestCase):
+    def setUp(self):
+        self.paginator = CreatedKeysetPagination()
+
+    def test_decode_cursor_returns_encoded_position(self):
+        position = (datetime(2020, 1, 1, 12, 30, 15, 123456, tzinfo=timezone.utc), 42)
+        cursor = self.paginator.encode_cursor(position, reverse=True)
+
+        self.assertEqual(self.paginator.decode_cursor(cursor), (position, True))
+
+    def test_decode_cursor_without_position_returns_none_position(self):
+        cursor = self.paginator.encode_cursor(None)
+
+        self.assertEqual(self.paginator.decode_cursor(cursor), (None, False))
+
+    def test_decode_cursor_with_invalid_cursor_raises_not_found(self):
+        for cursor in ['foo', self.paginator.encode_cursor(None)[:-4], 'eyJwIjogWyJmb28iLCAxXSwgInIiOiBmYWxzZX0=']:
+            with self.assertRaises(NotFound):
+                self.paginator.decode_cursor(cursor)
+
+    def test_get_include_count_uses_validated_value_from_view(self):
+        request = Request(APIRequestFactory().get('/', {'include_count': 'false'}))
+        view = mock.Mock(cleaned_data={'include_count': True})
+
+        self.assertTrue(self.paginator.get_include_count(request, view))
+
+    def test_get_include_count_without_validated_data_accepts_boolean_values(self):
+        for value, expected in [('yes', True), ('on', True), ('True', True), ('0', False), ('foo', False)]:
+            request = Request(APIRequestFactory().get('/', {'include_count': value}))
+
+            self.assertEqual(self.paginator.get_include_count(request), expected)
+
+
+class TestAnnotatedPagePaginator(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for _ in range(5):
+            MoodyUtil.create_song()
+
+    def test_page_adds_annotations_to_page_query(self):
+        paginator = AnnotatedPagePaginator(
+            Song.objects.order_by('id'),
+            2,
+            page_annotations={'song_count': Window(Count('id'))}
+        )
+
+        page = paginator.page(2)
+
+        self.assertEqual([song.song_count for song in page], [5, 5])
+
+    def test_count_does_not_include_annotations(self):
+        paginator = AnnotatedPagePaginator(
+            Song.objects.order_by('id'),
+            2,
+            page_annotations={'song_count': Window(Count('id'))}
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            list(paginator.page(1))
+
+        self.assertNotIn('OVER', queries.captured_queries[0]['sql'])
+        self.assertIn('OVER', queries.captured_queries[1]['sql'])
@@ -2,11 +2,11 @@ import random
 
 from django import forms
 from django.conf import settings
-from django.core.cache import cache
 
 from accounts.models import UserSongVote
 from base.forms import RangeInput
-from tunes.models import Emotion, Song
+from tunes.models import Emotion
+from tunes.utils import get_genres
 
 
 default_option = [('', '-----------')]
@@ -18,11 +18,7 @@ def get_genre_choices():
 
     :return: (list[tuples]) List of options for genre field in forms
     """
-    genres = cache.get(settings.GENRE_CHOICES_CACHE_KEY)
-
-    if not genres:
-        genres = list(Song.objects.all().values_list('genre', flat=True).distinct().order_by('genre'))
-        cache.set(settings.GENRE_CHOICES_CACHE_KEY, genres, settings.GENRE_CHOICES_CACHE_TIMEOUT)
+    genres = get_genres()
 
     return default_option + [(genre, genre.split('_')[0].capitalize()) for genre in genres if genre]
 
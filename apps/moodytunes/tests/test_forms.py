@@ -35,9 +35,9 @@ class TestGetGenreChoices(TestCase):
 
         self.assertEqual(choices, expected_choices)
 
-    @mock.patch('tunes.models.Song.objects.all')
+    @mock.patch('tunes.utils.Genre.objects.order_by')
     @mock.patch('django.core.cache.cache.get')
-    def test_method_uses_cached_return_value_if_present(self, mock_cache, mock_song_lookup):
+    def test_method_uses_cached_return_value_if_present(self, mock_cache, mock_genre_lookup):
         genres = ['foo']
         mock_cache.return_value = genres
 
@@ -45,7 +45,7 @@ class TestGetGenreChoices(TestCase):
         returned_genres = get_genre_choices()
 
         self.assertEqual(returned_genres, expected_genres)
-        mock_song_lookup.assert_not_called()
+        mock_genre_lookup.assert_not_called()
 
 
 class TestBrowseForm(TestCase):
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from base.admin import MoodyBaseAdmin
-from spotify.models import SpotifyAuth
+from spotify.models import PendingSpotifySong, SpotifyAuth
 
 
 class SpotifyAuthAdmin(MoodyBaseAdmin):
@@ -13,4 +13,13 @@ class SpotifyAuthAdmin(MoodyBaseAdmin):
         return False
 
 
+class PendingSpotifySongAdmin(MoodyBaseAdmin):
+    list_display = ('code', 'name', 'artist', 'username', 'attempts', 'created')
+    readonly_fields = ('code', 'name', 'artist', 'username', 'trace_id', 'claimed_at', 'attempts')
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(SpotifyAuth, SpotifyAuthAdmin)
+admin.site.register(PendingSpotifySong, PendingSpotifySongAdmin)
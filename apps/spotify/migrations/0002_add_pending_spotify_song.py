@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-17 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify', '0001_create_spotify_auth_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingSpotifySong',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('code', models.CharField(max_length=36, unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('artist', models.CharField(max_length=200)),
+                ('username', models.CharField(default='anonymous', max_length=150)),
+                ('trace_id', models.CharField(blank=True, max_length=100)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
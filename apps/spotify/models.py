@@ -131,3 +131,23 @@ class SpotifyAuth(BaseModel):
         :return: (bool)
         """
         return scope in self.scopes
+
+
+class PendingSpotifySong(BaseModel):
+    """
+    Song suggested by a user that is waiting for its audio features to be requested from Spotify. Pending songs
+    from every suggestion are batched into one audio features request by `CreatePendingSpotifySongsTask`.
+
+    `claimed_at` is set while a run of the task is requesting features for the song, and `attempts` counts the
+    runs that failed to create the song from the features they got.
+    """
+    code = models.CharField(max_length=36, unique=True)
+    name = models.CharField(max_length=200)
+    artist = models.CharField(max_length=200)
+    username = models.CharField(max_length=150, default='anonymous')
+    trace_id = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '{} - {}'.format(self.artist, self.name)
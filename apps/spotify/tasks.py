@@ -1,16 +1,21 @@
 import logging
 import os
+from datetime import timedelta
 
 from celery.schedules import crontab
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from spotify_client import SpotifyClient
 from spotify_client.exceptions import ClientException, SpotifyException
 
 from base.tasks import MoodyBaseTask, MoodyPeriodicTask
 from libs.moody_logging import auto_fingerprint, update_logging_data
 from spotify.exceptions import InsufficientSpotifyScopesError
-from spotify.models import SpotifyAuth, SpotifyUserData
+from spotify.models import PendingSpotifySong, SpotifyAuth, SpotifyUserData
 from tunes.models import Song
 
 
@@ -263,7 +268,9 @@ class FetchSongFromSpotifyTask(MoodyBaseTask):
     @update_logging_data
     def run(self, spotify_code, username='anonymous', *args, **kwargs):
         """
-        Use Spotify API to fetch song data for a given song and save the song to the database
+        Use Spotify API to fetch song data for a given song and add it to the songs waiting for audio features.
+        Audio features for the pending songs are requested in batches by `CreatePendingSpotifySongsTask`,
+        which saves the songs to the database.
 
         :param spotify_code: (str) Spotify URI for the song to be created
         :param username: (str) [Optional] Username for the user that requested this song
@@ -283,30 +290,220 @@ class FetchSongFromSpotifyTask(MoodyBaseTask):
 
             return
 
+        # Early exit: if song is already waiting for audio features don't do the work to fetch it
+        if PendingSpotifySong.objects.filter(code=spotify_code).exists():
+            logger.info(
+                'Song with code {} is already pending'.format(spotify_code),
+                extra={
+                    'fingerprint': auto_fingerprint('song_already_pending', **kwargs),
+                    'trace_id': trace_id,
+                }
+            )
+
+            return
+
         client = SpotifyClient(identifier=signature)
 
         track_data = client.get_attributes_for_track(spotify_code)
-        song_data = client.get_audio_features_for_tracks([track_data])[0]
+
+        PendingSpotifySong.objects.get_or_create(
+            code=track_data['code'],
+            defaults={
+                'name': track_data['name'],
+                'artist': track_data['artist'],
+                'username': username,
+                'trace_id': trace_id,
+            }
+        )
+
+        logger.info(
+            'Added song {} to songs pending audio features'.format(spotify_code),
+            extra={
+                'fingerprint': auto_fingerprint('added_pending_song', **kwargs),
+                'track_data': track_data,
+                'username': username,
+                'trace_id': trace_id,
+            }
+        )
+
+        # Request features right away once there is a full batch. Otherwise, schedule one run to pick up the
+        # songs suggested in the next few seconds, instead of waiting for the next periodic run
+        if PendingSpotifySong.objects.count() >= CreatePendingSpotifySongsTask.batch_size:
+            CreatePendingSpotifySongsTask().delay(trace_id=trace_id)
+
+        else:
+            batch_wait = settings.SPOTIFY['pending_songs_batch_wait']
+
+            if cache.add(CreatePendingSpotifySongsTask.scheduled_cache_key, True, batch_wait):
+                CreatePendingSpotifySongsTask().apply_async(kwargs={'trace_id': trace_id}, countdown=batch_wait)
+
+
+class CreatePendingSpotifySongsTask(MoodyPeriodicTask):
+    run_every = crontab(minute='*')
+    default_retry_delay = 60
+    autoretry_for = (SpotifyException,)
+
+    batch_size = SpotifyClient.PLAYLIST_BATCH_SIZE_LIMIT
+    claim_timeout = 60 * 5  # Seconds before songs claimed by a run that never finished can be claimed again
+    max_attempts = 5  # Number of failed attempts to create a song before it is dropped
+    scheduled_cache_key = 'create-pending-spotify-songs-scheduled'
+
+    @update_logging_data
+    def run(self, *args, **kwargs):
+        """
+        Request audio features for the songs suggested by users in batches of `batch_size` songs, and save
+        the songs to the database. Songs that Spotify has no features for, or that fail validation, are kept
+        for a later run to try again, up to `max_attempts` times.
+        """
+        trace_id = kwargs.get('trace_id', '')
+        client = SpotifyClient(identifier='spotify.tasks.CreatePendingSpotifySongsTask-{}'.format(trace_id))
+        claimed_ids = set()
+
+        while True:
+            pending_songs = self.claim_pending_songs(claimed_ids)
+
+            if not pending_songs:
+                return
+
+            claimed_ids.update(song.pk for song in pending_songs)
+
+            # Songs may have been added by our ingestion since they were suggested
+            existing_codes = set(
+                Song.objects.filter(code__in=[song.code for song in pending_songs]).values_list('code', flat=True)
+            )
+            tracks = [
+                {'code': song.code, 'name': song.name, 'artist': song.artist}
+                for song in pending_songs if song.code not in existing_codes
+            ]
+
+            if tracks:
+                logger.info(
+                    'Calling Spotify API to get feature data for {} pending songs'.format(len(tracks)),
+                    extra={
+                        'fingerprint': auto_fingerprint('get_feature_data_for_pending_songs', **kwargs),
+                        'trace_id': trace_id,
+                    }
+                )
+
+                try:
+                    client.get_audio_features_for_tracks(tracks)
+                except SpotifyException:
+                    # Let the retry of the task pick the songs up again
+                    PendingSpotifySong.objects.filter(pk__in=[song.pk for song in pending_songs]).update(
+                        claimed_at=None
+                    )
+                    raise
+
+            song_data_by_code = {track['code']: track for track in tracks}
+            done_songs, failed_songs = [], []
+
+            for pending_song in pending_songs:
+                if pending_song.code in existing_codes:
+                    done_songs.append(pending_song)
+                elif self.create_song(pending_song, song_data_by_code[pending_song.code], **kwargs):
+                    done_songs.append(pending_song)
+                else:
+                    failed_songs.append(pending_song)
+
+            PendingSpotifySong.objects.filter(pk__in=[song.pk for song in done_songs]).delete()
+            self.release_failed_songs(failed_songs, **kwargs)
+
+            if len(pending_songs) < self.batch_size:
+                return
+
+    def claim_pending_songs(self, claimed_ids):
+        """
+        Claim the oldest batch of pending songs that are not claimed by another run of the task. The claim is
+        committed before we request features, so the rows are not locked while we wait on Spotify.
+
+        :param claimed_ids: (set[int]) Primary keys of songs already claimed by this run
+
+        :return: (list[PendingSpotifySong])
+        """
+        now = timezone.now()
+
+        with transaction.atomic():
+            # Skip songs locked by another run claiming its batch, so concurrent runs claim different songs
+            pending_songs = list(
+                PendingSpotifySong.objects.select_for_update(skip_locked=True).filter(
+                    Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - timedelta(seconds=self.claim_timeout))
+                ).exclude(
+                    pk__in=claimed_ids
+                ).order_by('created')[:self.batch_size]
+            )
+
+            PendingSpotifySong.objects.filter(pk__in=[song.pk for song in pending_songs]).update(claimed_at=now)
+
+        return pending_songs
+
+    def release_failed_songs(self, failed_songs, **kwargs):
+        """
+        Release the claim on songs we failed to create so a later run tries them again, or drop the songs
+        that have failed `max_attempts` times
+
+        :param failed_songs: (list[PendingSpotifySong]) Songs claimed by this run that were not created
+        """
+        dropped_songs = [song for song in failed_songs if song.attempts + 1 >= self.max_attempts]
+
+        for pending_song in dropped_songs:
+            logger.warning(
+                'Dropping pending song {} after {} failed attempts'.format(pending_song.code, self.max_attempts),
+                extra={
+                    'fingerprint': auto_fingerprint('dropped_pending_song', **kwargs),
+                    'username': pending_song.username,
+                    'trace_id': pending_song.trace_id,
+                }
+            )
+
+        PendingSpotifySong.objects.filter(pk__in=[song.pk for song in dropped_songs]).delete()
+        PendingSpotifySong.objects.filter(
+            pk__in=[song.pk for song in failed_songs if song not in dropped_songs]
+        ).update(claimed_at=None, attempts=F('attempts') + 1)
+
+    def create_song(self, pending_song, song_data, **kwargs):
+        """
+        Save a song with its audio features to the database
+
+        :param pending_song: (PendingSpotifySong) Pending song the audio features were requested for
+        :param song_data: (dict) Song mapping with audio features
+
+        :return: (bool) True if the song was created
+        """
+        # Spotify leaves out the features for tracks it has not analyzed yet
+        if 'valence' not in song_data:
+            logger.warning(
+                'Spotify returned no audio features for song {}'.format(pending_song.code),
+                extra={
+                    'fingerprint': auto_fingerprint('missing_audio_features_for_song', **kwargs),
+                    'song_data': song_data,
+                    'trace_id': pending_song.trace_id,
+                }
+            )
+
+            return False
 
         try:
             Song.objects.create(**song_data)
 
             logger.info(
-                'Created song {} in database'.format(spotify_code),
+                'Created song {} in database'.format(pending_song.code),
                 extra={
                     'fingerprint': auto_fingerprint('created_song', **kwargs),
                     'song_data': song_data,
-                    'username': username,
-                    'trace_id': trace_id,
+                    'username': pending_song.username,
+                    'trace_id': pending_song.trace_id,
                 }
             )
         except ValidationError:
             logger.exception(
-                'Failed to create song {}, already exists in database'.format(spotify_code),
+                'Failed to create song {}'.format(pending_song.code),
                 extra={
                     'fingerprint': auto_fingerprint('failed_to_create_song', **kwargs),
-                    'trace_id': trace_id,
+                    'song_data': song_data,
+                    'trace_id': pending_song.trace_id,
                 }
             )
 
-            raise
+            return False
+
+        return True
@@ -1,13 +1,18 @@
+from datetime import timedelta
 from unittest import mock
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from spotify_client.exceptions import ClientException, SpotifyException
 
 from libs.tests.helpers import MoodyUtil, generate_random_unicode_string
 from spotify.exceptions import InsufficientSpotifyScopesError
-from spotify.models import SpotifyAuth
+from spotify.models import PendingSpotifySong, SpotifyAuth
 from spotify.tasks import (
+    CreatePendingSpotifySongsTask,
     ExportSpotifyPlaylistFromSongsTask,
     FetchSongFromSpotifyTask,
     RefreshTopArtistsFromSpotifyTask,
@@ -431,9 +436,10 @@ class TestExportSpotifyPlaylistFromSongs(TestCase):
 
 
 class TestFetchSongFromSpotify(TestCase):
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.apply_async')
     @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
     @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
-    def test_happy_path(self, mock_get_attributes, mock_get_features):
+    def test_happy_path(self, mock_get_attributes, mock_get_features, mock_apply_async):
         song_code = 'spotify:track:1234567'
 
         mock_get_attributes.return_value = {
@@ -442,17 +448,16 @@ class TestFetchSongFromSpotify(TestCase):
             'artist': 'Madlib'
         }
 
-        mock_get_features.return_value = [{
-            'code': song_code,
-            'name': 'Sickfit',
-            'artist': 'Madlib',
-            'valence': .5,
-            'energy': .5
-        }]
+        FetchSongFromSpotifyTask().run(song_code, username='madlib', trace_id='some-trace')
 
-        FetchSongFromSpotifyTask().run(song_code)
+        pending_song = PendingSpotifySong.objects.get(code=song_code)
 
-        self.assertTrue(Song.objects.filter(code=song_code).exists())
+        self.assertEqual(pending_song.name, 'Sickfit')
+        self.assertEqual(pending_song.artist, 'Madlib')
+        self.assertEqual(pending_song.username, 'madlib')
+        self.assertEqual(pending_song.trace_id, 'some-trace')
+        self.assertFalse(Song.objects.filter(code=song_code).exists())
+        mock_get_features.assert_not_called()
 
     @mock.patch('spotify.tasks.FetchSongFromSpotifyTask.retry')
     @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
@@ -474,57 +479,218 @@ class TestFetchSongFromSpotify(TestCase):
         mock_get_attributes.assert_not_called()
         mock_get_features.assert_not_called()
 
+    @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
+    def test_task_does_not_call_spotify_if_song_is_already_pending(self, mock_get_attributes):
+        pending_song = PendingSpotifySong.objects.create(code='spotify:track:1234567', name='Sickfit', artist='Madlib')
+
+        FetchSongFromSpotifyTask().run(pending_song.code)
+
+        mock_get_attributes.assert_not_called()
+
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.apply_async')
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.delay')
+    @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
+    def test_task_schedules_features_request_for_partial_batch(self, mock_get_attributes, mock_delay, mock_apply_async):
+        mock_get_attributes.return_value = {'code': 'spotify:track:1234567', 'name': 'Sickfit', 'artist': 'Madlib'}
+
+        FetchSongFromSpotifyTask().run('spotify:track:1234567', trace_id='some-trace')
+
+        mock_delay.assert_not_called()
+        mock_apply_async.assert_called_once_with(
+            kwargs={'trace_id': 'some-trace'},
+            countdown=settings.SPOTIFY['pending_songs_batch_wait']
+        )
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.apply_async')
+    @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
+    def test_task_schedules_one_features_request_for_many_songs(self, mock_get_attributes, mock_apply_async):
+        cache.clear()
+
+        for code in ['spotify:track:1234567', 'spotify:track:7654321']:
+            mock_get_attributes.return_value = {'code': code, 'name': 'Sickfit', 'artist': 'Madlib'}
+            FetchSongFromSpotifyTask().run(code)
+
+        mock_apply_async.assert_called_once()
+
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.batch_size', 2)
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.delay')
+    @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
+    def test_task_requests_features_once_batch_is_full(self, mock_get_attributes, mock_create_songs):
+        PendingSpotifySong.objects.create(code='spotify:track:7654321', name='Raid', artist='Madvillain')
+        mock_get_attributes.return_value = {'code': 'spotify:track:1234567', 'name': 'Sickfit', 'artist': 'Madlib'}
+
+        FetchSongFromSpotifyTask().run('spotify:track:1234567', trace_id='some-trace')
+
+        mock_create_songs.assert_called_once_with(trace_id='some-trace')
+
+
+class TestCreatePendingSpotifySongsTask(TestCase):
+    def create_pending_song(self, code, name='Sickfit', artist='Madlib'):
+        return PendingSpotifySong.objects.create(code=code, name=name, artist=artist)
+
+    def get_features(self, tracks):
+        for track in tracks:
+            track.update({'valence': .5, 'energy': .5})
+
+        return tracks
+
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_happy_path(self, mock_get_features):
+        mock_get_features.side_effect = self.get_features
+        self.create_pending_song('spotify:track:1234567')
+        self.create_pending_song('spotify:track:7654321', name='Raid', artist='Madvillain')
+
+        CreatePendingSpotifySongsTask().run()
+
+        mock_get_features.assert_called_once()
+        self.assertEqual(Song.objects.filter(code__in=['spotify:track:1234567', 'spotify:track:7654321']).count(), 2)
+        self.assertFalse(PendingSpotifySong.objects.exists())
+
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.batch_size', 2)
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_features_are_requested_in_batches(self, mock_get_features):
+        mock_get_features.side_effect = self.get_features
+
+        for i in range(3):
+            self.create_pending_song('spotify:track:{}'.format(i), name='Song {}'.format(i))
+
+        CreatePendingSpotifySongsTask().run()
+
+        batch_sizes = [len(call[0][0]) for call in mock_get_features.call_args_list]
+        self.assertEqual(batch_sizes, [2, 1])
+        self.assertFalse(PendingSpotifySong.objects.exists())
+
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_task_does_not_call_spotify_without_pending_songs(self, mock_get_features):
+        CreatePendingSpotifySongsTask().run()
+
+        mock_get_features.assert_not_called()
+
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.retry')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_task_is_retried_on_spotify_error(self, mock_get_features, mock_retry):
+        mock_get_features.side_effect = SpotifyException
+        self.create_pending_song('spotify:track:1234567')
+
+        CreatePendingSpotifySongsTask().run()
+
+        mock_retry.assert_called_once()
+        self.assertTrue(PendingSpotifySong.objects.filter(code='spotify:track:1234567').exists())
+
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_pending_songs_are_claimed_before_calling_spotify(self, mock_get_features):
+        def get_features(tracks):
+            # The claim is saved, so the rows are not locked while we wait on Spotify
+            self.assertFalse(PendingSpotifySong.objects.filter(claimed_at__isnull=True).exists())
+            return self.get_features(tracks)
+
+        mock_get_features.side_effect = get_features
+        self.create_pending_song('spotify:track:1234567')
+
+        CreatePendingSpotifySongsTask().run()
+
+        mock_get_features.assert_called_once()
+
+    @mock.patch('spotify.tasks.CreatePendingSpotifySongsTask.retry')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_claim_is_released_on_spotify_error(self, mock_get_features, mock_retry):
+        mock_get_features.side_effect = SpotifyException
+        pending_song = self.create_pending_song('spotify:track:1234567')
+
+        CreatePendingSpotifySongsTask().run()
+
+        pending_song.refresh_from_db()
+        self.assertIsNone(pending_song.claimed_at)
+        self.assertEqual(pending_song.attempts, 0)
+
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_songs_claimed_by_other_run_are_skipped(self, mock_get_features):
+        mock_get_features.side_effect = self.get_features
+        pending_song = self.create_pending_song('spotify:track:1234567')
+        PendingSpotifySong.objects.filter(pk=pending_song.pk).update(claimed_at=timezone.now())
+
+        CreatePendingSpotifySongsTask().run()
+
+        mock_get_features.assert_not_called()
+        self.assertTrue(PendingSpotifySong.objects.filter(pk=pending_song.pk).exists())
+
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_songs_claimed_by_run_that_did_not_finish_are_claimed_again(self, mock_get_features):
+        mock_get_features.side_effect = self.get_features
+        pending_song = self.create_pending_song('spotify:track:1234567')
+        claimed_at = timezone.now() - timedelta(seconds=CreatePendingSpotifySongsTask.claim_timeout + 1)
+        PendingSpotifySong.objects.filter(pk=pending_song.pk).update(claimed_at=claimed_at)
+
+        CreatePendingSpotifySongsTask().run()
+
+        self.assertTrue(Song.objects.filter(code=pending_song.code).exists())
+        self.assertFalse(PendingSpotifySong.objects.exists())
+
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_task_does_not_request_features_for_existing_songs(self, mock_get_features):
+        song = MoodyUtil.create_song()
+        self.create_pending_song(song.code, name=song.name, artist=song.artist)
+
+        CreatePendingSpotifySongsTask().run()
+
+        mock_get_features.assert_not_called()
+        self.assertFalse(PendingSpotifySong.objects.exists())
+
     @mock.patch('tunes.models.Song.objects.create')
     @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
-    @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
-    def test_validation_error_on_song_create_raises_exception(
-            self,
-            mock_get_attributes,
-            mock_get_features,
-            mock_song_create
-    ):
-        song_code = 'spotify:track:1234567'
+    def test_validation_error_on_song_create_does_not_stop_batch(self, mock_get_features, mock_song_create):
+        mock_get_features.side_effect = self.get_features
+        mock_song_create.side_effect = [ValidationError('Oops!'), mock.Mock()]
+        failed_song = self.create_pending_song('spotify:track:1234567')
+        self.create_pending_song('spotify:track:7654321', name='Raid', artist='Madvillain')
 
-        mock_get_attributes.return_value = {
-            'code': song_code,
-            'name': 'Sickfit',
-            'artist': 'Madlib'
-        }
+        CreatePendingSpotifySongsTask().run()
 
-        mock_get_features.return_value = [{
-            'code': song_code,
-            'name': 'Sickfit',
-            'artist': 'Madlib',
-            'valence': .5,
-            'energy': .5
-        }]
+        self.assertEqual(mock_song_create.call_count, 2)
+
+        # The song that failed is kept for a later run to try again
+        failed_song.refresh_from_db()
+        self.assertEqual(list(PendingSpotifySong.objects.all()), [failed_song])
+        self.assertIsNone(failed_song.claimed_at)
+        self.assertEqual(failed_song.attempts, 1)
+
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_song_without_audio_features_is_kept_for_retry(self, mock_get_features):
+        mock_get_features.side_effect = lambda tracks: tracks
+        pending_song = self.create_pending_song('spotify:track:1234567')
+
+        with mock.patch('spotify.tasks.logger') as mock_logger:
+            CreatePendingSpotifySongsTask().run()
 
-        mock_song_create.side_effect = ValidationError('Oops!')
+        mock_logger.warning.assert_called_once()
+        self.assertFalse(Song.objects.filter(code=pending_song.code).exists())
 
-        with self.assertRaises(ValidationError):
-            FetchSongFromSpotifyTask().run(song_code)
+        pending_song.refresh_from_db()
+        self.assertEqual(pending_song.attempts, 1)
 
     @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
-    @mock.patch('spotify_client.SpotifyClient.get_attributes_for_track')
-    def test_task_handles_song_with_unicode_data(self, mock_get_attributes, mock_get_features):
-        song_code = 'spotify:track:1234567'
-        song_name = generate_random_unicode_string(10)
-        song_artist = generate_random_unicode_string(10)
+    def test_song_is_dropped_after_max_attempts(self, mock_get_features):
+        mock_get_features.side_effect = lambda tracks: tracks
+        pending_song = self.create_pending_song('spotify:track:1234567')
+        PendingSpotifySong.objects.filter(pk=pending_song.pk).update(
+            attempts=CreatePendingSpotifySongsTask.max_attempts - 1
+        )
 
-        mock_get_attributes.return_value = {
-            'code': song_code,
-            'name': song_name,
-            'artist': song_artist
-        }
+        CreatePendingSpotifySongsTask().run()
 
-        mock_get_features.return_value = [{
-            'code': song_code,
-            'name': song_name,
-            'artist': song_artist,
-            'valence': .5,
-            'energy': .5
-        }]
+        self.assertFalse(PendingSpotifySong.objects.exists())
 
-        FetchSongFromSpotifyTask().run(song_code)
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_task_handles_song_with_unicode_data(self, mock_get_features):
+        mock_get_features.side_effect = self.get_features
+        song_code = 'spotify:track:1234567'
+        self.create_pending_song(
+            song_code,
+            name=generate_random_unicode_string(10),
+            artist=generate_random_unicode_string(10)
+        )
+
+        CreatePendingSpotifySongsTask().run()
 
         self.assertTrue(Song.objects.filter(code=song_code).exists())
@@ -1,7 +1,10 @@
+import threading
+from unittest import mock
+
 from django.test import TestCase
 
 from libs.tests.helpers import MoodyUtil
-from spotify.utils import ExportPlaylistHelper
+from spotify.utils import AudioFeatureBatcher, ExportPlaylistHelper, RateLimitedSpotifyClient
 from tunes.models import Emotion
 
 
@@ -54,3 +57,97 @@ class TestExportPlaylistHelper(TestCase):
         songs = ExportPlaylistHelper.get_export_playlist_for_user(self.user, self.emotion.name)
 
         self.assertEqual(len(songs), 1)
+
+
+class TestRateLimitedSpotifyClient(TestCase):
+    @mock.patch('spotify_client.SpotifyClient._make_spotify_request')
+    def test_request_takes_token_from_rate_limiter(self, mock_request):
+        rate_limiter = mock.Mock()
+        client = RateLimitedSpotifyClient(rate_limiter)
+
+        client._make_spotify_request('GET', 'https://example.com/', headers={'foo': 'bar'})
+
+        rate_limiter.acquire.assert_called_once_with()
+        mock_request.assert_called_once_with('GET', 'https://example.com/', headers={'foo': 'bar'})
+
+    @mock.patch('spotify_client.SpotifyClient._make_spotify_request')
+    def test_get_playlist_snapshot_id(self, mock_request):
+        mock_request.return_value = {'snapshot_id': 'some-snapshot'}
+        client = RateLimitedSpotifyClient(mock.Mock())
+
+        snapshot_id = client.get_playlist_snapshot_id({'uri': 'some-playlist', 'user': 'some-user'})
+
+        self.assertEqual(snapshot_id, 'some-snapshot')
+        mock_request.assert_called_once_with(
+            'GET',
+            '{}/playlists/some-playlist'.format(client.API_URL),
+            params={'fields': 'snapshot_id'}
+        )
+
+
+class TestAudioFeatureBatcher(TestCase):
+    def setUp(self):
+        self.spotify = mock.Mock()
+        self.spotify.get_audio_features_for_tracks.side_effect = self.get_features
+
+    def get_features(self, tracks):
+        for track in tracks:
+            track.update({'energy': .5, 'valence': .5})
+
+        return tracks
+
+    def test_tracks_from_several_callers_are_requested_in_one_batch(self):
+        batcher = AudioFeatureBatcher(self.spotify, batch_size=2, max_wait=10)
+        first_tracks = [{'code': 'first'}]
+        second_tracks = [{'code': 'second'}]
+
+        thread = threading.Thread(target=batcher.get_audio_features_for_tracks, args=(first_tracks,))
+        thread.start()
+        batcher.get_audio_features_for_tracks(second_tracks)
+        thread.join()
+
+        self.spotify.get_audio_features_for_tracks.assert_called_once()
+        self.assertEqual(batcher.num_requests, 1)
+        self.assertEqual(first_tracks[0]['energy'], .5)
+        self.assertEqual(second_tracks[0]['energy'], .5)
+
+    def test_partial_batch_is_requested_after_max_wait(self):
+        batcher = AudioFeatureBatcher(self.spotify, batch_size=2, max_wait=0)
+        tracks = [{'code': 'first'}]
+
+        batcher.get_audio_features_for_tracks(tracks)
+
+        self.spotify.get_audio_features_for_tracks.assert_called_once_with(tracks)
+        self.assertEqual(tracks[0]['valence'], .5)
+
+    def test_tracks_are_requested_in_batches_of_batch_size(self):
+        batcher = AudioFeatureBatcher(self.spotify, batch_size=2, max_wait=0)
+        tracks = [{'code': 'song-{}'.format(i)} for i in range(5)]
+
+        batcher.get_audio_features_for_tracks(tracks)
+
+        batch_sizes = [len(call[0][0]) for call in self.spotify.get_audio_features_for_tracks.call_args_list]
+        self.assertEqual(batch_sizes, [2, 2, 1])
+
+    def test_tracks_are_updated_with_results_from_client(self):
+        self.spotify.get_audio_features_for_tracks.side_effect = None
+        self.spotify.get_audio_features_for_tracks.return_value = [{'code': 'first', 'energy': .25}]
+        batcher = AudioFeatureBatcher(self.spotify, max_wait=0)
+        tracks = [{'code': 'first'}]
+
+        batcher.get_audio_features_for_tracks(tracks)
+
+        self.assertEqual(tracks[0]['energy'], .25)
+
+    def test_exception_for_batch_is_raised_to_caller(self):
+        self.spotify.get_audio_features_for_tracks.side_effect = ValueError('Oops!')
+        batcher = AudioFeatureBatcher(self.spotify, max_wait=0)
+
+        with self.assertRaises(ValueError):
+            batcher.get_audio_features_for_tracks([{'code': 'first'}])
+
+    def test_no_request_is_made_for_empty_tracks(self):
+        batcher = AudioFeatureBatcher(self.spotify, max_wait=0)
+
+        self.assertEqual(batcher.get_audio_features_for_tracks([]), [])
+        self.spotify.get_audio_features_for_tracks.assert_not_called()
@@ -1,4 +1,9 @@
+import threading
+
+from spotify_client import SpotifyClient
+
 from accounts.models import UserSongVote
+from tunes.emotion_registry import get_emotion_registry
 from tunes.utils import filter_duplicate_votes_on_song_from_playlist
 
 
@@ -17,7 +22,8 @@ class ExportPlaylistHelper(object):
 
         :return: (list) List of Spotify song URIs for the playlist to build in Spotify
         """
-        votes = UserSongVote.objects.filter(user=user, emotion__name=emotion, vote=True)
+        emotion_id = get_emotion_registry().get(name=emotion).id
+        votes = UserSongVote.objects.filter(user=user, emotion_id=emotion_id, vote=True)
 
         if genre:
             votes = votes.filter(song__genre=genre)
@@ -26,3 +32,153 @@ class ExportPlaylistHelper(object):
             votes = votes.filter(context=context)
 
         return list(filter_duplicate_votes_on_song_from_playlist(votes).values_list('song__code', flat=True))
+
+
+class RateLimitedSpotifyClient(SpotifyClient):
+    """
+    SpotifyClient that takes a token from a `RateLimiter` before every request it makes to Spotify. Clients
+    used from several threads can share one limiter to keep their combined request rate under a budget.
+    """
+
+    def __init__(self, rate_limiter, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+
+    def _make_spotify_request(self, *args, **kwargs):
+        self.rate_limiter.acquire()
+
+        return super()._make_spotify_request(*args, **kwargs)
+
+    def get_playlist_snapshot_id(self, playlist):
+        """
+        Get the snapshot id for the current version of a playlist. Spotify changes the snapshot id of a
+        playlist every time tracks are added to or removed from it.
+
+        :param playlist: (dict) Playlist mapping returned from `get_playlists_for_category`
+
+        :return: (str|None) Snapshot id for the playlist
+        """
+        url = '{api_url}/playlists/{playlist_id}'.format(api_url=self.API_URL, playlist_id=playlist['uri'])
+
+        response = self._make_spotify_request('GET', url, params={'fields': 'snapshot_id'})
+
+        return response.get('snapshot_id')
+
+
+class _BatchedFeaturesRequest(object):
+    """Tracks the outstanding tracks for one call to `AudioFeatureBatcher.get_audio_features_for_tracks`"""
+
+    def __init__(self, num_tracks):
+        self.remaining = num_tracks
+        self.error = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def track_done(self, error=None):
+        with self._lock:
+            if error is not None:
+                self.error = error
+
+            self.remaining -= 1
+
+            if self.remaining == 0:
+                self.done.set()
+
+
+class AudioFeatureBatcher(object):
+    """
+    Collect tracks that need audio features from several callers (like the ingestion workers for each Spotify
+    category) and request the features in batches of `batch_size` tracks, instead of making a request for
+    each caller with however many tracks it has.
+
+    Use `get_audio_features_for_tracks` in place of the `SpotifyClient` method of the same name. A call blocks
+    until its tracks are part of a full batch, or until `max_wait` seconds pass, in which case the caller
+    requests features for every pending track itself. Tracks are updated in place with their features, and an
+    exception raised for a batch is raised to every caller with tracks in the batch.
+
+    :param spotify: (SpotifyClient) Client to request audio features with. This is shared by every caller
+    :param batch_size: (int) Number of tracks to request features for in one request
+    :param max_wait: (float) Max number of seconds to wait for a batch to fill before requesting features
+    """
+
+    def __init__(self, spotify, batch_size=SpotifyClient.PLAYLIST_BATCH_SIZE_LIMIT, max_wait=1):
+        self.spotify = spotify
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.num_requests = 0
+
+        self._pending = []  # List of (track, _BatchedFeaturesRequest)
+        self._lock = threading.Lock()
+
+    def get_audio_features_for_tracks(self, tracks):
+        """
+        Add audio features to the tracks, batched with the tracks from other callers
+
+        :param tracks: (list[dict]) Song mappings
+
+        :return: (list[dict]) Song mappings + (energy, valence, danceability)
+        """
+        if not tracks:
+            return tracks
+
+        request = _BatchedFeaturesRequest(len(tracks))
+
+        with self._lock:
+            self._pending.extend((track, request) for track in tracks)
+            batches = self._take_batches(full_only=True)
+
+        for batch in batches:
+            self._request_features(batch)
+
+        if not request.done.wait(self.max_wait):
+            with self._lock:
+                batches = self._take_batches(full_only=False)
+
+            for batch in batches:
+                self._request_features(batch)
+
+        # Another caller may have taken our tracks in a batch it is still requesting
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+
+        return tracks
+
+    def _take_batches(self, full_only):
+        """
+        Remove batches of pending tracks for the caller to request features for. Must be called with the lock held.
+
+        :param full_only: (bool) Leave a final batch of less than `batch_size` tracks pending
+
+        :return: (list[list[tuple]])
+        """
+        num_tracks = len(self._pending)
+
+        if full_only:
+            num_tracks -= num_tracks % self.batch_size
+
+        batches = [self._pending[start:start + self.batch_size] for start in range(0, num_tracks, self.batch_size)]
+        self._pending = self._pending[num_tracks:]
+
+        return batches
+
+    def _request_features(self, batch):
+        error = None
+
+        with self._lock:
+            self.num_requests += 1
+
+        try:
+            tracks = [track for track, _ in batch]
+            updated_tracks = self.spotify.get_audio_features_for_tracks(tracks)
+
+            # SpotifyClient updates the tracks in place, but copy the results over in case a client does not
+            for track, updated_track in zip(tracks, updated_tracks):
+                if updated_track is not track:
+                    track.update(updated_track)
+        except Exception as exc:
+            error = exc
+
+        for _, request in batch:
+            request.track_done(error)
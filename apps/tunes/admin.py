@@ -3,7 +3,7 @@ from django.contrib import admin
 
 from base.admin import MoodyBaseAdmin
 from moodytunes.forms import get_genre_choices
-from tunes.models import Emotion, Song
+from tunes.models import Emotion, Genre, PlaylistCheckpoint, Song
 
 
 class GenreFormField(forms.ModelForm):
@@ -37,5 +37,19 @@ class SongAdmin(MoodyBaseAdmin):
         return False
 
 
+class GenreAdmin(MoodyBaseAdmin):
+    list_display = ('name', 'created')
+    search_fields = ('name',)
+
+
+class PlaylistCheckpointAdmin(MoodyBaseAdmin):
+    list_display = ('playlist_id', 'category', 'snapshot_id', 'updated')
+    list_filter = ('category',)
+    search_fields = ('playlist_id',)
+    readonly_fields = ('playlist_id', 'category', 'snapshot_id', 'processed_codes')
+
+
 admin.site.register(Emotion, EmotionAdmin)
+admin.site.register(Genre, GenreAdmin)
+admin.site.register(PlaylistCheckpoint, PlaylistCheckpointAdmin)
 admin.site.register(Song, SongAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class TunesConfig(AppConfig):
     name = 'tunes'
+
+    def ready(self):
+        # Register signals
+        import tunes.signals  # noqa: F401
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from tunes.models import Emotion
+
+
+logger = logging.getLogger(__name__)
+
+_emotion_registry = None
+_emotion_registry_lock = threading.Lock()
+
+
+class EmotionRegistry(object):
+    """
+    In-process registry of the `Emotion` records in our system. There are only a handful of emotions and
+    they almost never change, so we load all of them once per worker process and resolve emotions by name
+    or primary key from memory instead of querying the emotion table on every request.
+
+    Saving or deleting an `Emotion` bumps the emotion version counter in the cache and marks the registry in
+    the current process as stale. Other processes pick up the change the next time they check the version
+    counter, at most once every `EMOTION_REGISTRY_VERSION_CHECK_INTERVAL` seconds.
+
+    Lookups return copies of the loaded records, so callers are free to modify the emotions they get back
+    without changing the emotions seen by the rest of the process.
+    """
+
+    def __init__(self):
+        self.emotions_by_name = {}
+        self.emotions_by_pk = {}
+        self.version = None
+        self.is_stale = True
+        self.last_version_check = 0
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.emotions_by_pk)
+
+    def _copy_emotion(self, emotion):
+        field_names = [field.attname for field in Emotion._meta.concrete_fields]
+
+        return Emotion.from_db(emotion._state.db, field_names, [getattr(emotion, name) for name in field_names])
+
+    def _should_refresh(self):
+        if self.is_stale:
+            return True
+
+        now = time.monotonic()
+        if now - self.last_version_check < settings.EMOTION_REGISTRY_VERSION_CHECK_INTERVAL:
+            return False
+
+        self.last_version_check = now
+        version = cache.get(settings.EMOTION_VERSION_CACHE_KEY)
+
+        return version is not None and version != self.version
+
+    def invalidate(self):
+        """Mark the registry as stale, so the emotions are loaded again on the next refresh"""
+        self.is_stale = True
+
+    def refresh(self, force=False):
+        """
+        Load every emotion in our system into the registry, if the registry is stale or the emotion
+        version counter has changed since the last refresh
+
+        :param force: (bool) Refresh the registry even if the emotion version has not changed
+        """
+        with self._lock:
+            if not force and not self._should_refresh():
+                return
+
+            version = cache.get(settings.EMOTION_VERSION_CACHE_KEY)
+            emotions = list(Emotion.objects.order_by('pk'))
+
+            self.emotions_by_name = {emotion.name: emotion for emotion in emotions}
+            self.emotions_by_pk = {emotion.pk: emotion for emotion in emotions}
+            self.version = version
+            self.is_stale = False
+            self.last_version_check = time.monotonic()
+
+            logger.info(
+                'Refreshed emotion registry with {} emotions'.format(len(emotions)),
+                extra={
+                    'fingerprint': 'tunes.emotion_registry.EmotionRegistry.refresh.refreshed_registry',
+                    'version': version,
+                }
+            )
+
+    def get(self, name=None, pk=None):
+        """
+        Return the emotion with the given name or primary key. If the emotion is not in the registry, the
+        registry is refreshed once in case the emotion was added since the last refresh.
+
+        :param name: (str) `Emotion.name` constant of the emotion to return
+        :param pk: (int) Primary key of the emotion to return
+
+        :return: (Emotion)
+
+        :raises: `Emotion.DoesNotExist` if no emotion exists with the given name or primary key
+        """
+        if (name is None) == (pk is None):
+            raise ValueError('Must provide exactly one of name or pk')
+
+        field, key = ('name', name) if name is not None else ('pk', pk)
+        emotions = self.emotions_by_name if field == 'name' else self.emotions_by_pk
+
+        if key not in emotions:
+            self.refresh(force=True)
+            emotions = self.emotions_by_name if field == 'name' else self.emotions_by_pk
+
+            if key not in emotions:
+                raise Emotion.DoesNotExist('No emotion exists with {}={}'.format(field, key))
+
+        return self._copy_emotion(emotions[key])
+
+    def all(self):
+        """
+        Return every emotion in the registry ordered by primary key
+
+        :return: (list[Emotion])
+        """
+        return [self._copy_emotion(emotion) for emotion in self.emotions_by_pk.values()]
+
+
+def get_emotion_registry():
+    """
+    Return the emotion registry for this process, loading or refreshing it if needed
+
+    :return: (EmotionRegistry)
+    """
+    global _emotion_registry
+
+    if _emotion_registry is None:
+        with _emotion_registry_lock:
+            if _emotion_registry is None:
+                _emotion_registry = EmotionRegistry()
+
+    _emotion_registry.refresh()
+
+    return _emotion_registry
+
+
+def invalidate_emotion_registry():
+    """Mark the emotion registry for this process as stale, if it has been created"""
+    if _emotion_registry is not None:
+        _emotion_registry.invalidate()
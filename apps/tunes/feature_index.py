@@ -0,0 +1,412 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from scipy.spatial import cKDTree
+
+from tunes.models import Song
+
+
+logger = logging.getLogger(__name__)
+
+_song_feature_index = None
+_song_feature_index_lock = threading.Lock()
+
+
+class SongFeatureSnapshot(object):
+    """
+    Arrays of the song attributes in a `SongFeatureIndex` as of one refresh. The arrays are read-only, and a
+    refresh builds a new snapshot instead of changing the arrays of the current one. Queries read every array
+    from a single snapshot, so a concurrent refresh can't pair the ids from one refresh with the attributes
+    from another.
+    """
+    ARRAYS = ('ids', 'valence', 'energy', 'danceability', 'genre_codes')
+
+    def __init__(self, ids, valence, energy, danceability, genre_codes, genres):
+        self.ids = ids
+        self.valence = valence
+        self.energy = energy
+        self.danceability = danceability
+        self.genre_codes = genre_codes
+        self.genres = genres  # Mapping of genre name to the code stored in `genre_codes`
+
+        for name in self.ARRAYS:
+            getattr(self, name).setflags(write=False)
+
+        # KD-trees over the attributes in this snapshot, built the first time they are needed
+        self._trees = {}
+        self._tree_lock = threading.Lock()
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            ids=np.empty(0, dtype=np.int32),
+            valence=np.empty(0, dtype=np.float64),
+            energy=np.empty(0, dtype=np.float64),
+            danceability=np.empty(0, dtype=np.float64),
+            genre_codes=np.empty(0, dtype=np.int16),
+            genres={},
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_tree(self, attributes, weights, genre=None):
+        """
+        Return a KD-tree over the attributes of the songs in the snapshot, scaled by the square root of
+        their weights so Euclidean distances in the tree are weighted distances between songs. Trees for
+        a genre only hold the songs in the genre, so they don't need to be filtered after a query.
+
+        :param attributes: (tuple[str]) Attributes to build the tree over, in order
+        :param weights: (dict) Mapping of song attribute to its weight in the distance between songs
+        :param genre: (str) Optional genre of the songs to build the tree over
+
+        :return: (tuple(cKDTree, np.ndarray)) Tree, and the position in the snapshot arrays of each song in it
+        """
+        tree_key = (tuple(weights[attribute] for attribute in attributes), genre)
+
+        with self._tree_lock:
+            if tree_key not in self._trees:
+                if genre:
+                    positions = np.flatnonzero(self.genre_codes == self.genres[genre])
+                else:
+                    positions = np.arange(len(self.ids))
+
+                features = np.column_stack([
+                    getattr(self, attribute)[positions] * np.sqrt(weights[attribute]) for attribute in attributes
+                ])
+
+                self._trees[tree_key] = (cKDTree(features), positions)
+
+            return self._trees[tree_key]
+
+
+class SongFeatureIndex(object):
+    """
+    In-process index of the emotion attributes for every song in our system. The attributes are
+    stored in contiguous NumPy arrays (one element per song, sorted by song id) so that the bounding
+    box filters for browse playlists can be answered with vectorized masks instead of range queries
+    against the song table.
+
+    The index is loaded once per worker process and refreshed incrementally. Saving a `Song` bumps
+    the song catalog version counter in the cache; when the index sees a new version (or the refresh
+    interval has passed) it loads only the songs that were created or updated since its last refresh.
+
+    Nearest neighbour lookups use a KD-tree over the song attributes, built the first time it is needed
+    after each refresh that changes the index. Attributes are scaled by the square root of their weights
+    before building the tree, so Euclidean distances in the tree are weighted distances between songs.
+
+    The arrays are held in a `SongFeatureSnapshot` that is swapped for a new one on refresh, so queries
+    running during a refresh keep reading the arrays from before it.
+    """
+    ATTRIBUTES = ('valence', 'energy', 'danceability')
+
+    # Songs updated shortly before the last refresh are loaded again, to account for clock drift
+    # between the processes saving songs and the process refreshing the index
+    REFRESH_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self):
+        self.snapshot = SongFeatureSnapshot.empty()
+        self.version = None
+        self.refreshed_at = None
+        self.last_version_check = 0
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    @property
+    def ids(self):
+        return self.snapshot.ids
+
+    @property
+    def valence(self):
+        return self.snapshot.valence
+
+    @property
+    def energy(self):
+        return self.snapshot.energy
+
+    @property
+    def danceability(self):
+        return self.snapshot.danceability
+
+    @property
+    def genre_codes(self):
+        return self.snapshot.genre_codes
+
+    @property
+    def genres(self):
+        return self.snapshot.genres
+
+    def _build_columns(self, rows, genres):
+        """
+        Convert rows of (id, valence, energy, danceability, genre) values to NumPy arrays
+
+        :param rows: (list[tuple]) Song values to convert
+        :param genres: (dict) Mapping of genre name to code, genres missing from it are added to it
+
+        :return: (dict) Mapping of index attribute to array of values
+        """
+        def get_genre_code(genre):
+            if genre not in genres:
+                genres[genre] = len(genres)
+
+            return genres[genre]
+
+        return {
+            'ids': np.fromiter((row[0] for row in rows), dtype=np.int32, count=len(rows)),
+            'valence': np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+            'energy': np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)),
+            'danceability': np.fromiter((row[3] for row in rows), dtype=np.float64, count=len(rows)),
+            'genre_codes': np.fromiter(
+                (get_genre_code(row[4]) for row in rows),
+                dtype=np.int16,
+                count=len(rows)
+            ),
+        }
+
+    def _apply_rows(self, rows):
+        """
+        Update the index with the given song rows, by swapping in a new snapshot where rows for songs
+        already in the index are updated and rows for new songs are inserted at their sorted position.
+
+        Ids are not committed in order when songs are created concurrently, so a new song can have
+        a lower id than songs already in the index.
+
+        :param rows: (list[tuple]) Song values ordered by id
+        """
+        snapshot = self.snapshot
+        genres = dict(snapshot.genres)
+        columns = self._build_columns(rows, genres)
+        positions = np.searchsorted(snapshot.ids, columns['ids'])
+
+        is_indexed = np.zeros(len(positions), dtype=bool)
+        in_bounds = positions < len(snapshot.ids)
+        is_indexed[in_bounds] = snapshot.ids[positions[in_bounds]] == columns['ids'][in_bounds]
+        is_new_song = ~is_indexed
+
+        arrays = {}
+        for name in SongFeatureSnapshot.ARRAYS:
+            array = getattr(snapshot, name).copy()
+
+            if name != 'ids':
+                array[positions[is_indexed]] = columns[name][is_indexed]
+
+            arrays[name] = np.insert(array, positions[is_new_song], columns[name][is_new_song])
+
+        self.snapshot = SongFeatureSnapshot(genres=genres, **arrays)
+
+    def _should_refresh(self):
+        if self.refreshed_at is None:
+            return True
+
+        now = time.monotonic()
+        if now - self.last_version_check < settings.SONG_FEATURE_INDEX_VERSION_CHECK_INTERVAL:
+            return False
+
+        self.last_version_check = now
+        version = cache.get(settings.SONG_CATALOG_VERSION_CACHE_KEY)
+
+        if version is not None and version != self.version:
+            return True
+
+        return timezone.now() - self.refreshed_at > timedelta(seconds=settings.SONG_FEATURE_INDEX_REFRESH_INTERVAL)
+
+    def refresh(self, force=False):
+        """
+        Load songs created or updated since the last refresh into the index. The first refresh
+        loads every song in our system.
+
+        :param force: (bool) Refresh the index even if the song catalog version has not changed
+        """
+        with self._lock:
+            if not force and not self._should_refresh():
+                return
+
+            version = cache.get(settings.SONG_CATALOG_VERSION_CACHE_KEY)
+            refresh_start = timezone.now()
+
+            songs = Song.objects.all()
+
+            if self.refreshed_at is not None:
+                max_song_id = int(self.snapshot.ids[-1]) if len(self.snapshot) else 0
+                songs = songs.filter(Q(id__gt=max_song_id) | Q(updated__gte=self.refreshed_at - self.REFRESH_OVERLAP))
+
+            rows = list(songs.order_by('id').values_list('id', 'valence', 'energy', 'danceability', 'genre'))
+
+            if rows:
+                self._apply_rows(rows)
+
+            self.version = version
+            self.refreshed_at = refresh_start
+            self.last_version_check = time.monotonic()
+
+            memory_usage = self.get_memory_usage()
+            if memory_usage['total'] > settings.SONG_FEATURE_INDEX_MEMORY_BUDGET:
+                logger.warning(
+                    'Song feature index is over its memory budget',
+                    extra={
+                        'fingerprint': 'tunes.feature_index.SongFeatureIndex.refresh.over_memory_budget',
+                        'memory_usage': memory_usage,
+                        'memory_budget': settings.SONG_FEATURE_INDEX_MEMORY_BUDGET,
+                    }
+                )
+
+            logger.info(
+                'Refreshed song feature index with {} songs'.format(len(rows)),
+                extra={
+                    'fingerprint': 'tunes.feature_index.SongFeatureIndex.refresh.refreshed_index',
+                    'loaded_songs': len(rows),
+                    'indexed_songs': len(self),
+                    'version': version,
+                }
+            )
+
+    def get_candidate_song_ids(self, ranges, genre=None):
+        """
+        Return the ids of the songs whose attributes fall within the given ranges
+
+        :param ranges: (dict) Mapping of song attribute to a tuple of (lower limit, upper limit)
+        :param genre: (str) Optional genre of songs to return
+
+        :return: (np.ndarray) Ids of the matching songs
+        """
+        snapshot = self.snapshot
+        mask = np.ones(len(snapshot), dtype=bool)
+
+        for attribute, (lower_limit, upper_limit) in ranges.items():
+            if attribute not in self.ATTRIBUTES:
+                raise ValueError('Invalid attribute, must be one of: {}'.format(', '.join(self.ATTRIBUTES)))
+
+            values = getattr(snapshot, attribute)
+            mask &= (values >= lower_limit) & (values <= upper_limit)
+
+        if genre:
+            if genre not in snapshot.genres:
+                return np.empty(0, dtype=np.int32)
+
+            mask &= snapshot.genre_codes == snapshot.genres[genre]
+
+        return snapshot.ids[mask]
+
+    def get_nearest_song_ids(self, point, limit, weights=None, exclude_song_ids=None, genre=None):
+        """
+        Return the ids of the songs closest to the given point, ordered by their weighted distance to it.
+        Songs at the same distance from the point are returned in random order.
+
+        Excluded songs are dropped from the results of the tree query, so we ask the tree for more songs
+        until enough are left. Asking for a lot of songs gets close to scanning the whole catalog, so we
+        stop at `SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE` songs and let the caller fall back to sampling
+        songs from the database.
+
+        :param point: (dict) Mapping of song attribute to the value to search around
+        :param limit: (int) Max number of song ids to return
+        :param weights: (dict) Optional mapping of song attribute to its weight in the distance between songs
+        :param exclude_song_ids: (iterable[int]) Optional ids of songs to leave out of the results
+        :param genre: (str) Optional genre of songs to return
+
+        :return: (np.ndarray|None) Ids of the nearest songs, or None if there were not enough songs that are
+            not excluded within the max query size
+        """
+        weights = weights or settings.BROWSE_NEAREST_FEATURE_WEIGHTS
+
+        if set(point) != set(self.ATTRIBUTES) or set(weights) != set(self.ATTRIBUTES):
+            raise ValueError('Point and weights must have values for: {}'.format(', '.join(self.ATTRIBUTES)))
+
+        snapshot = self.snapshot
+
+        if genre and genre not in snapshot.genres:
+            return np.empty(0, dtype=np.int32)
+
+        tree, tree_positions = snapshot.get_tree(self.ATTRIBUTES, weights, genre=genre)
+        song_count = tree.n
+        max_query_size = settings.SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE
+
+        # The excluded ids are usually a NumPy array, so never test the argument itself for truthiness
+        excluded_song_ids = np.unique(np.asarray(
+            exclude_song_ids if exclude_song_ids is not None else [],
+            dtype=np.int64
+        ))
+        query_point = [point[attribute] * np.sqrt(weights[attribute]) for attribute in self.ATTRIBUTES]
+
+        # Ask for a few more songs than the limit so songs tied with the last one returned can be shuffled,
+        # and keep asking for more if excluded songs leave us short of the limit
+        query_size = min(2 * limit, song_count, max_query_size)
+
+        while True:
+            if query_size == 0:
+                return np.empty(0, dtype=np.int32)
+
+            distances, positions = tree.query(query_point, k=query_size)
+            distances = np.atleast_1d(distances)
+            positions = tree_positions[np.atleast_1d(positions)]
+
+            keep = ~np.isin(snapshot.ids[positions], excluded_song_ids)
+            kept_songs = keep.sum()
+
+            if kept_songs > limit or query_size == song_count:
+                break
+
+            if query_size >= max_query_size:
+                if kept_songs == limit:
+                    break
+
+                return None
+
+            query_size = min(2 * query_size, song_count, max_query_size)
+
+        distances = distances[keep]
+        positions = positions[keep]
+
+        order = np.lexsort((np.random.random(len(positions)), distances))
+
+        return snapshot.ids[positions[order][:limit]]
+
+    def get_memory_usage(self):
+        """
+        Return the number of bytes used by the arrays in the index
+
+        :return: (dict) Mapping of array name to bytes used, including the `total` bytes used
+        """
+        snapshot = self.snapshot
+        usage = {name: getattr(snapshot, name).nbytes for name in SongFeatureSnapshot.ARRAYS}
+
+        usage['total'] = sum(usage.values())
+
+        return usage
+
+    def get_bytes_per_song(self):
+        """
+        Return the number of bytes each song takes up in the index
+
+        :return: (int)
+        """
+        snapshot = self.snapshot
+
+        return sum(getattr(snapshot, name).itemsize for name in SongFeatureSnapshot.ARRAYS)
+
+
+def get_song_feature_index():
+    """
+    Return the song feature index for this process, loading or refreshing it if needed
+
+    :return: (SongFeatureIndex)
+    """
+    global _song_feature_index
+
+    if _song_feature_index is None:
+        with _song_feature_index_lock:
+            if _song_feature_index is None:
+                _song_feature_index = SongFeatureIndex()
+
+    _song_feature_index.refresh()
+
+    return _song_feature_index
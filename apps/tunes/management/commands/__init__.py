@@ -0,0 +1,54 @@
+from django.db import connection
+
+from accounts.models import MoodyUser, UserSongVote
+from base.management.commands import MoodyBenchmarkCommand
+from tunes.models import Song
+
+
+class VoteBenchmarkCommand(MoodyBenchmarkCommand):
+    """Base class for benchmark commands that need a user with a large number of votes"""
+
+    def create_user(self):
+        """
+        Create a user for the benchmark without sending signals, so no UserEmotion tasks are queued for it
+
+        :return: (MoodyUser)
+        """
+        return MoodyUser.objects.bulk_create([MoodyUser(username='benchmark-{}'.format(self._unique_id.hex[:8]))])[0]
+
+    def generate_votes(self, user, emotion, start, end, contexts=('',)):
+        """
+        Insert songs and upvotes for them by the user in two statements. Votes for each song are created one
+        second apart, so the newest votes are for the songs generated last.
+
+        :param user: (MoodyUser) User to create votes for
+        :param emotion: (Emotion) Emotion to create votes for
+        :param start: (int) Sequence number of the first song to generate
+        :param end: (int) Sequence number of the last song to generate
+        :param contexts: (iterable[str]) Contexts to create a vote in for each song. Passing more than one
+            context creates duplicate votes for the same song in the emotion playlist
+        """
+        code_prefix = 'benchmark:{}:'.format(self._unique_id.hex[:8])
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (created, updated, artist, name, genre, code, valence, energy, danceability, '
+                'random_key) '
+                'SELECT now(), now(), %s, %s || i, %s, %s || i, random(), random(), random(), random() '
+                'FROM generate_series(%s, %s) AS i'.format(table=Song._meta.db_table),
+                ['Benchmark Artist', 'Benchmark Song ', 'benchmark', code_prefix, start, end]
+            )
+
+            cursor.execute(
+                'INSERT INTO {vote_table} (created, updated, user_id, emotion_id, song_id, context, description, vote) '
+                'SELECT now() + (i * interval \'1 second\'), now(), %s, %s, song.id, context, \'\', true '
+                'FROM generate_series(%s, %s) AS i '
+                'JOIN {song_table} AS song ON song.code = %s || i '
+                'CROSS JOIN unnest(%s::varchar[]) AS context'.format(
+                    vote_table=UserSongVote._meta.db_table,
+                    song_table=Song._meta.db_table
+                ),
+                [user.pk, emotion.pk, start, end, code_prefix, list(contexts)]
+            )
+
+            cursor.execute('ANALYZE {}'.format(UserSongVote._meta.db_table))
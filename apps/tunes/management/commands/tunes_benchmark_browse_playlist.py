@@ -0,0 +1,176 @@
+import random
+
+from django.conf import settings
+from django.db import connection
+
+from base.management.commands import MoodyBenchmarkCommand
+from tunes.feature_index import SongFeatureIndex
+from tunes.models import Emotion, Song
+from tunes.utils import generate_browse_playlist, sample_songs, sample_songs_from_feature_index
+
+
+class Command(MoodyBenchmarkCommand):
+    help = 'Benchmark the different methods of generating browse playlists against a generated song catalog'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Number of generated songs to run the benchmark against'
+        )
+
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=settings.BROWSE_DEFAULT_LIMIT,
+            help='Number of songs to return in each browse playlist'
+        )
+
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=settings.BROWSE_DEFAULT_JITTER,
+            help='Jitter to use for the bounding box of each browse playlist'
+        )
+
+    def generate_songs(self, start, end):
+        """
+        Insert songs with random attributes into the song table in one statement
+
+        :param start: (int) Sequence number of the first song to generate
+        :param end: (int) Sequence number of the last song to generate
+        """
+        genres = settings.SPOTIFY['categories']
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} '
+                '(created, updated, artist, name, genre, code, valence, energy, danceability, random_key) '
+                'SELECT now(), now(), %s || (i %% 5000), %s || i, (%s::varchar[])[1 + i %% %s], %s || i, '
+                'random(), random(), random(), random() '
+                'FROM generate_series(%s, %s) AS i'.format(table=Song._meta.db_table),
+                [
+                    'Benchmark Artist ',
+                    'Benchmark Song ',
+                    genres,
+                    len(genres),
+                    'benchmark:{}:'.format(self._unique_id.hex[:8]),
+                    start,
+                    end,
+                ]
+            )
+
+            cursor.execute('ANALYZE {}'.format(Song._meta.db_table))
+
+    def get_browse_candidates(self, emotions, jitter):
+        """
+        Return the songs inside the bounding box around a random emotion
+
+        :param emotions: (list[Emotion]) Emotions to pick the bounding box from
+        :param jitter: (float) Size of the bounding box around the emotion attributes
+
+        :return: (QuerySet)
+        """
+        emotion = random.choice(emotions)
+
+        return Song.objects.filter(
+            energy__range=(emotion.energy - jitter, emotion.energy + jitter),
+            valence__range=(emotion.valence - jitter, emotion.valence + jitter),
+            danceability__range=(emotion.danceability - jitter, emotion.danceability + jitter),
+        )
+
+    def get_emotion_point(self, emotions):
+        emotion = random.choice(emotions)
+
+        return {attribute: getattr(emotion, attribute) for attribute in SongFeatureIndex.ATTRIBUTES}
+
+    def benchmark_sampling_methods(self, emotions, limit, jitter, iterations):
+        for method in settings.BROWSE_PLAYLIST_SAMPLING_METHODS:
+            timings = self.time_call(
+                lambda: list(sample_songs(self.get_browse_candidates(emotions, jitter), limit, method=method)),
+                iterations
+            )
+
+            self.write_timing('sampling method={}'.format(method), timings)
+
+    def benchmark_song_indexes(self, emotions, limit, jitter, iterations):
+        """
+        Write the plan and timings of a randomly ordered browse playlist for every strategy, first with
+        the `Song` indexes dropped and then with the indexes in place
+        """
+        emotion = random.choice(emotions)
+        strategies = [None] + list(settings.BROWSE_PLAYLIST_STRATEGIES)
+
+        def write_plans(label_suffix):
+            for strategy in strategies:
+                label = 'browse filter strategy={} ({})'.format(strategy or 'all', label_suffix)
+                playlist = generate_browse_playlist(
+                    emotion.energy,
+                    emotion.valence,
+                    emotion.danceability,
+                    strategy=strategy,
+                    jitter=jitter
+                )[:limit]
+
+                self.write_plan(label, playlist)
+                self.write_timing(label, self.time_call(lambda: list(playlist.all()), iterations))
+
+        with self.without_indexes(Song):
+            write_plans('without song indexes')
+
+        write_plans('with song indexes')
+
+    def benchmark_feature_index(self, emotions, limit, jitter, iterations):
+        song_feature_index = SongFeatureIndex()
+        timings = self.time_call(lambda: song_feature_index.refresh(force=True), 1)
+        self.write_timing('feature index load', timings)
+
+        def sample_from_feature_index():
+            emotion = random.choice(emotions)
+            ranges = {
+                attribute: (getattr(emotion, attribute) - jitter, getattr(emotion, attribute) + jitter)
+                for attribute in SongFeatureIndex.ATTRIBUTES
+            }
+
+            return sample_songs_from_feature_index(
+                Song.objects.all(),
+                ranges,
+                limit,
+                song_feature_index=song_feature_index
+            )
+
+        timings = self.time_call(sample_from_feature_index, iterations)
+
+        self.write_timing('feature index sampling', timings)
+
+        # Build the KD-tree outside of the timed nearest neighbour lookups
+        timings = self.time_call(
+            lambda: song_feature_index.get_nearest_song_ids(self.get_emotion_point(emotions), limit),
+            1
+        )
+        self.write_timing('nearest KD-tree build', timings)
+
+        timings = self.time_call(
+            lambda: song_feature_index.get_nearest_song_ids(self.get_emotion_point(emotions), limit),
+            iterations
+        )
+        self.write_timing('nearest KD-tree lookup', timings)
+        self.stdout.write('feature index memory: {} bytes'.format(song_feature_index.get_memory_usage()['total']))
+
+    def run_benchmark(self, *args, **options):
+        emotions = list(Emotion.objects.all())
+        generated_songs = 0
+
+        for size in sorted(options['sizes']):
+            self.generate_songs(generated_songs + 1, size)
+            generated_songs = size
+
+            self.stdout.write('Benchmarking browse playlists with {} generated songs'.format(size))
+
+            self.benchmark_sampling_methods(emotions, options['limit'], options['jitter'], options['iterations'])
+            self.benchmark_song_indexes(emotions, options['limit'], options['jitter'], options['iterations'])
+            self.benchmark_feature_index(emotions, options['limit'], options['jitter'], options['iterations'])
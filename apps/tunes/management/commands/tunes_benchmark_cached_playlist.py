@@ -0,0 +1,74 @@
+import pickle
+
+from django.conf import settings
+
+from accounts.models import MoodyUser
+from base.management.commands import MoodyBenchmarkCommand
+from tunes.models import Emotion, Song
+from tunes.utils import CachedPlaylistManager
+
+
+class Command(MoodyBenchmarkCommand):
+    help = 'Benchmark the size and hydration time of cached browse playlists in the legacy and compact formats'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[settings.BROWSE_DEFAULT_LIMIT, 50, 500],
+            help='Number of songs in the cached playlists to run the benchmark against'
+        )
+
+    def generate_songs(self, count):
+        """
+        Create songs with fixed attributes for the cached playlists
+
+        :param count: (int) Number of songs to create
+
+        :return: (list[Song])
+        """
+        return Song.objects.bulk_create([
+            Song(
+                artist='Benchmark Artist {}'.format(i),
+                name='Benchmark Song {}'.format(i),
+                genre='benchmark',
+                code='benchmark:{}:{}'.format(self._unique_id.hex[:8], i),
+                valence=.5,
+                energy=.5,
+                danceability=.5,
+            ) for i in range(count)
+        ])
+
+    def run_benchmark(self, *args, **options):
+        # The user is only used to build cache keys, it is never saved
+        manager = CachedPlaylistManager(MoodyUser(username='benchmark'))
+        songs = self.generate_songs(max(options['sizes']))
+
+        for size in sorted(options['sizes']):
+            playlist = songs[:size]
+
+            # Cache backends pickle the values they store, so the pickled value is what takes up space in the cache
+            legacy_entry = pickle.dumps({
+                'emotion': Emotion.HAPPY,
+                'context': '',
+                'description': '',
+                'playlist': playlist,
+            })
+            compact_entry = pickle.dumps(manager.build_cache_data(playlist, Emotion.HAPPY, '', ''))
+
+            self.stdout.write('Benchmarking cached playlists with {} songs'.format(size))
+            self.stdout.write('legacy entry size: {} bytes'.format(len(legacy_entry)))
+            self.stdout.write('compact entry size: {} bytes'.format(len(compact_entry)))
+
+            timings = self.time_call(lambda: pickle.loads(legacy_entry)['playlist'], options['iterations'])
+            self.write_timing('legacy hydration', timings)
+
+            def hydrate_compact_entry():
+                cached_playlist = manager.parse_cache_data(pickle.loads(compact_entry))
+                return manager.get_playlist_songs(cached_playlist['song_ids'])
+
+            timings = self.time_call(hydrate_compact_entry, options['iterations'])
+            self.write_timing('compact hydration', timings)
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.test import RequestFactory
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+
+from accounts.models import UserSongVote
+from base.pagination import CreatedKeysetPagination
+from tunes.management.commands import VoteBenchmarkCommand
+from tunes.models import Emotion
+from tunes.utils import filter_duplicate_votes_on_song_from_playlist, order_votes_by_newest
+
+
+class Command(VoteBenchmarkCommand):
+    help = 'Benchmark page number and cursor pagination of emotion playlists against generated votes'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000],
+            help='Number of generated votes in the emotion playlist to run the benchmark against'
+        )
+
+    def get_playlist(self, user, emotion):
+        votes = UserSongVote.objects.filter(user=user, emotion=emotion, vote=True)
+
+        return order_votes_by_newest(filter_duplicate_votes_on_song_from_playlist(votes))
+
+    def make_request(self, **params):
+        return Request(RequestFactory().get('/tunes/playlist/', params))
+
+    def benchmark_page_number_pagination(self, user, emotion, page, iterations):
+        def get_page():
+            paginator = PageNumberPagination()
+            paginator.page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+            return paginator.paginate_queryset(self.get_playlist(user, emotion), self.make_request(page=page))
+
+        return self.time_call(get_page, iterations)
+
+    def benchmark_cursor_pagination(self, user, emotion, offset, iterations):
+        paginator = CreatedKeysetPagination()
+        params = {}
+
+        # Build the cursor for the page outside of the timed calls, the same way a client
+        # following `next` links would already have it
+        if offset:
+            vote = self.get_playlist(user, emotion)[offset - 1]
+            params['cursor'] = paginator.encode_cursor((vote.created, vote.pk))
+
+        def get_page():
+            return CreatedKeysetPagination().paginate_queryset(
+                self.get_playlist(user, emotion),
+                self.make_request(**params)
+            )
+
+        return self.time_call(get_page, iterations)
+
+    def run_benchmark(self, *args, **options):
+        user = self.create_user()
+        emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        generated_votes = 0
+
+        for size in sorted(options['sizes']):
+            self.generate_votes(user, emotion, generated_votes + 1, size)
+            generated_votes = size
+
+            self.stdout.write('Benchmarking emotion playlist pagination with {} votes'.format(size))
+
+            last_page = (size - 1) // page_size + 1
+
+            for page in sorted({1, (last_page + 1) // 2, last_page}):
+                timings = self.benchmark_page_number_pagination(user, emotion, page, options['iterations'])
+                self.write_timing('page number pagination page={}'.format(page), timings)
+
+                timings = self.benchmark_cursor_pagination(
+                    user,
+                    emotion,
+                    (page - 1) * page_size,
+                    options['iterations']
+                )
+                self.write_timing('cursor pagination page={}'.format(page), timings)
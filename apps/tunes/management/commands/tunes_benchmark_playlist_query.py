@@ -0,0 +1,99 @@
+from django.conf import settings
+
+from accounts.models import UserSongVote
+from base.management.commands import get_plan_nodes
+from tunes.management.commands import VoteBenchmarkCommand
+from tunes.models import Emotion, Song
+from tunes.utils import filter_duplicate_votes_on_song_from_playlist, order_votes_by_newest
+
+
+def filter_duplicate_votes_with_song_join(user_votes):
+    """Previous implementation of `filter_duplicate_votes_on_song_from_playlist`, kept for comparison"""
+    vote_ids = user_votes.distinct('song__code').values_list('id', flat=True)
+
+    return UserSongVote.objects.select_related('song').filter(id__in=vote_ids).order_by('-created')
+
+
+def filter_duplicate_votes_newest_first(user_votes):
+    """Current emotion playlist query, ordered from newest to oldest vote the same way as `PlaylistView`"""
+    return order_votes_by_newest(filter_duplicate_votes_on_song_from_playlist(user_votes))
+
+
+class Command(VoteBenchmarkCommand):
+    help = 'Benchmark the emotion playlist query with EXPLAIN ANALYZE against generated votes'
+
+    implementations = [
+        ('song join', filter_duplicate_votes_with_song_join),
+        ('song id', filter_duplicate_votes_newest_first),
+    ]
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000],
+            help='Number of generated songs in the emotion playlist to run the benchmark against'
+        )
+
+        parser.add_argument(
+            '--contexts',
+            nargs='+',
+            default=['', 'WORK'],
+            help='Contexts to vote on each song in. More than one context creates duplicate votes for each song'
+        )
+
+    def explain(self, queryset):
+        """
+        Run EXPLAIN ANALYZE for the queryset and summarize the plan
+
+        :param queryset: (QuerySet) Query to explain
+
+        :return: (dict)
+            - cost (float): Total cost estimated by the planner
+            - execution_time (float): Milliseconds spent executing the query
+            - shared_buffers (int): Shared buffers hit or read by the query
+            - song_scans (int): Number of times the plan scans the song table
+        """
+        plan = self.explain_analyze(queryset)
+        root = plan['Plan']
+
+        return {
+            'cost': root['Total Cost'],
+            'execution_time': plan['Execution Time'],
+            'shared_buffers': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0),
+            'song_scans': sum(
+                1 for node in get_plan_nodes(root)
+                if node.get('Relation Name') == Song._meta.db_table
+            ),
+        }
+
+    def run_benchmark(self, *args, **options):
+        user = self.create_user()
+        emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        generated_songs = 0
+
+        for size in sorted(options['sizes']):
+            self.generate_votes(user, emotion, generated_songs + 1, size, contexts=options['contexts'])
+            generated_songs = size
+
+            self.stdout.write('Benchmarking emotion playlist query with {} songs and {} votes'.format(
+                size,
+                size * len(options['contexts'])
+            ))
+
+            for label, implementation in self.implementations:
+                votes = UserSongVote.objects.filter(user=user, emotion=emotion, vote=True)
+                playlist = implementation(votes)[:page_size]
+
+                plan = self.explain(playlist)
+                self.stdout.write(
+                    '{label:<40} cost={cost:.2f} execution={execution_time:.3f}ms '
+                    'shared_buffers={shared_buffers} song_scans={song_scans}'.format(label=label, **plan)
+                )
+
+                timings = self.time_call(lambda: list(implementation(votes)[:page_size]), options['iterations'])
+                self.write_timing(label, timings)
@@ -1,19 +1,55 @@
 import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.management import CommandError
-from spotify_client import SpotifyClient
+from django.db import connection, transaction
+from django.db.models import Q
 from spotify_client.exceptions import SpotifyException
 
 from base.management.commands import MoodyBaseCommand
 from libs.moody_logging import auto_fingerprint, update_logging_data
-from tunes.models import Song
+from libs.utils import RateLimiter, get_version_counter_seed, increment_cache_counter
+from spotify.utils import AudioFeatureBatcher, RateLimitedSpotifyClient
+from tunes.models import Genre, PlaylistCheckpoint, Song
+
+
+CategoryResult = namedtuple('CategoryResult', ['category', 'num_tracks', 'error'])
+
+
+class PipelineStats(object):
+    """Thread safe collector for the number of tracks and time spent in each stage of the ingestion pipeline"""
+
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, num_tracks, elapsed):
+        with self._lock:
+            total_tracks, total_elapsed = self._totals.get(stage, (0, 0))
+            self._totals[stage] = (total_tracks + num_tracks, total_elapsed + elapsed)
+
+    def get_totals(self):
+        """
+        :return: (dict) Mapping of stage name to (number of tracks, seconds spent), in the order stages first ran
+        """
+        with self._lock:
+            return dict(self._totals)
 
 
 class Command(MoodyBaseCommand):
     help = 'Management command to fetch and create songs from Spotify API'
 
+    save_batch_size = 500
+    chunk_size = 100  # Spotify accepts up to 100 tracks in one audio features request
+    queue_size = 10  # Max number of chunks waiting for the main thread to save them
+    playlist_track_limit = 100  # Max number of tracks Spotify returns for a playlist in one response
+
     def save_songs_to_database(self, tracks):
         """
         Given a list of parameters for Song records, create the objects in the database.
@@ -23,130 +59,502 @@ class Command(MoodyBaseCommand):
         :return: (tuple(int, int)) Number of songs successfully saved and number of songs failed to save
         """
         success, fail = 0, 0
+
+        for start in range(0, len(tracks), self.save_batch_size):
+            batch_success, batch_fail = self._save_song_batch(tracks[start:start + self.save_batch_size])
+            success += batch_success
+            fail += batch_fail
+
+        return success, fail
+
+    def _save_song_batch(self, tracks):
+        """
+        Create Song records for a batch of tracks with one query to find existing songs and one query to
+        insert the new songs. Tracks are checked in order, so a track that duplicates an earlier track in
+        the batch is rejected the same way as a track that duplicates a song already in our database.
+
+        Songs inserted by another process after we looked up existing songs are skipped by the insert, so
+        the result for each new song is only known (and written to the output) after the insert.
+
+        :param tracks: (list[dict]) List of dictionaries containing data to store for Song records
+
+        :return: (tuple(int, int)) Number of songs successfully saved and number of songs failed to save
+        """
+        existing_songs = Song.objects.filter(
+            Q(code__in={track['code'] for track in tracks}) |
+            Q(name__in={track['name'] for track in tracks}, artist__in={track['artist'] for track in tracks})
+        ).values_list('code', 'name', 'artist')
+
+        existing_codes = set()
+        existing_names = set()
+        for code, name, artist in existing_songs:
+            existing_codes.add(code)
+            existing_names.add((name, artist))
+
+        new_songs = []
+        results = []  # Output line for each track, or the Song to insert for the track
+        fail = 0
         for track in tracks:
             # Check if song with name and artist already exists in our system
             # There is the potential for a song by an artist to be present in
             # Spotify's system multiple times, each with a different Spotify code.
-            if Song.objects.filter(name=track['name'], artist=track['artist']).exists():
-                self.stdout.write('Song {} by {} already exists in our database'.format(
+            if (track['name'], track['artist']) in existing_names:
+                results.append('Song {} by {} already exists in our database'.format(
                     track['name'],
                     track['artist']
                 ))
                 fail += 1
                 continue
 
+            if track['code'] in existing_codes:
+                results.append('Song with code {} already exists'.format(track['code']))
+                fail += 1
+                continue
+
+            song = Song(**track)
+
             try:
-                song, created = Song.objects.get_or_create(code=track['code'], defaults=track)
-
-                if created:
-                    self.stdout.write('Created song with code {}'.format(song.code))
-                    success += 1
-                else:
-                    self.stdout.write('Song with code {} already exists'.format(song.code))
-                    fail += 1
+                # Uniqueness was checked against the songs we looked up above
+                song.full_clean(validate_unique=False)
             except ValidationError:
                 self.stderr.write('ERROR: Could not create song with data: {}'.format(track))
                 fail += 1
+                continue
 
-        return success, fail
+            existing_codes.add(song.code)
+            existing_names.add((song.name, song.artist))
+            new_songs.append(song)
+            results.append(song)
+
+        inserted_codes = set()
+
+        if new_songs:
+            Song.objects.bulk_create(new_songs, ignore_conflicts=True)
+
+            # `bulk_create` does not tell us which rows were skipped for conflicts, so look up the songs that
+            # made it into the table. `created` is set on our songs before they are inserted, so a song with
+            # the same code inserted by another process will not match it
+            created_by_code = {song.code: song.created for song in new_songs}
+            inserted_codes = {
+                code for code, created in Song.objects.filter(code__in=created_by_code).values_list('code', 'created')
+                if created == created_by_code[code]
+            }
+
+        for result in results:
+            if not isinstance(result, Song):
+                self.stdout.write(result)
+            elif result.code in inserted_codes:
+                self.stdout.write('Created song with code {}'.format(result.code))
+            else:
+                self.stdout.write('Song with code {} already exists'.format(result.code))
+                fail += 1
+
+        if inserted_codes:
+            # `bulk_create` does not send the post_save signal, so we add the genres of the new songs
+            # and bump the song catalog version ourselves
+            for genre in {song.genre for song in new_songs if song.genre and song.code in inserted_codes}:
+                Genre.objects.get_or_create(name=genre)
+
+            increment_cache_counter(settings.SONG_CATALOG_VERSION_CACHE_KEY, initial=get_version_counter_seed())
+
+        return len(inserted_codes), fail
 
     @update_logging_data
-    def get_tracks_from_spotify(self, **kwargs):
+    def fetch_tracks(self, spotify, category, checkpoints, stats, **kwargs):
         """
-        Request, format, and return tracks from Spotify's API.
+        First stage of the ingestion pipeline. Yield chunks of tracks we have not processed before from the
+        playlists for a category, up to `SPOTIFY['max_songs_from_category']` tracks. After the chunks for a
+        playlist, yield an unsaved `PlaylistCheckpoint` recording the tracks processed for the playlist.
 
-        :return: (list(dict)) Track data for saving as Song records
+        Playlists with the same snapshot as their checkpoint are skipped, and tracks we already have songs for
+        are not yielded, so we only request audio features for tracks that are new to us.
+
+        :param spotify: (RateLimitedSpotifyClient) Client to make requests to Spotify with
+        :param category: (str) Spotify category to collect tracks for
+        :param checkpoints: (dict) Mapping of playlist id to the saved `PlaylistCheckpoint` for the playlist
+        :param stats: (PipelineStats) Collector for the throughput of each stage
+
+        :yield: (list[dict]|PlaylistCheckpoint)
         """
-        spotify = SpotifyClient(identifier='create_songs_from_spotify-{}'.format(self._unique_id))
+        playlists = spotify.get_playlists_for_category(category, settings.SPOTIFY['max_playlist_from_category'])
+        self.logger.info(
+            'Got {} playlists for category: {}'.format(len(playlists), category),
+            extra={
+                'fingerprint': auto_fingerprint('retrieved_playlists_for_category', **kwargs),
+                'command_id': self._unique_id
+            }
+        )
 
-        tracks = []
+        tracks_from_category = 0
 
-        for category in settings.SPOTIFY['categories']:
-            songs_from_category = 0
+        for playlist in playlists:
+            if tracks_from_category >= settings.SPOTIFY['max_songs_from_category']:
+                break
 
-            try:
-                playlists = spotify.get_playlists_for_category(category, settings.SPOTIFY['max_playlist_from_category'])
+            start = time.monotonic()
+            checkpoint = checkpoints.get(playlist['uri'])
+            snapshot_id = spotify.get_playlist_snapshot_id(playlist)
+
+            if checkpoint and snapshot_id and checkpoint.snapshot_id == snapshot_id:
+                stats.record('fetch', 0, time.monotonic() - start)
                 self.logger.info(
-                    'Got {} playlists for category: {}'.format(len(playlists), category),
+                    'Skipping unchanged playlist {}'.format(playlist['name']),
                     extra={
-                        'fingerprint': auto_fingerprint('retrieved_playlists_for_category', **kwargs),
+                        'fingerprint': auto_fingerprint('skipped_unchanged_playlist', **kwargs),
                         'command_id': self._unique_id
                     }
                 )
+                continue
 
-                for playlist in playlists:
-                    if songs_from_category < settings.SPOTIFY['max_songs_from_category']:
-                        num_tracks = settings.SPOTIFY['max_songs_from_category'] - songs_from_category
-                        self.logger.info(
-                            'Calling Spotify API to get {} track(s) for playlist {}'.format(
-                                num_tracks,
-                                playlist['name']
-                            ),
-                            extra={
-                                'fingerprint': auto_fingerprint('get_tracks_from_playlist', **kwargs),
-                                'tracks_to_retrieve': num_tracks,
-                                'command_id': self._unique_id
-                            }
-                        )
-
-                        raw_tracks = spotify.get_songs_from_playlist(playlist, num_tracks)
-
-                        self.logger.info(
-                            'Calling Spotify API to get feature data for {} tracks'.format(len(raw_tracks)),
-                            extra={
-                                'fingerprint': auto_fingerprint('get_feature_data_for_tracks', **kwargs),
-                                'command_id': self._unique_id
-                            }
-                        )
-
-                        complete_tracks = spotify.get_audio_features_for_tracks(raw_tracks)
-
-                        # Add genre information to each track. We can use the category search term as the genre
-                        # for songs found for that category
-                        for track in complete_tracks:
-                            track.update({'genre': category})
-
-                        self.logger.info(
-                            'Got {} tracks from {}'.format(len(complete_tracks), playlist['name']),
-                            extra={
-                                'fingerprint': auto_fingerprint('retrieved_tracks_from_playlist', **kwargs),
-                                'command_id': self._unique_id
-                            }
-                        )
-
-                        tracks.extend(complete_tracks)
-                        songs_from_category += len(complete_tracks)
-
-                self.write_to_log_and_output(
-                    'Finished processing {} tracks for category: {}'.format(songs_from_category, category),
-                    extra={'fingerprint': auto_fingerprint('processed_tracks_for_category', **kwargs)}
-                )
+            processed_codes = set(checkpoint.processed_codes) if checkpoint else set()
+            num_tracks = settings.SPOTIFY['max_songs_from_category'] - tracks_from_category
+            self.logger.info(
+                'Calling Spotify API to get {} track(s) for playlist {}'.format(
+                    num_tracks,
+                    playlist['name']
+                ),
+                extra={
+                    'fingerprint': auto_fingerprint('get_tracks_from_playlist', **kwargs),
+                    'tracks_to_retrieve': num_tracks,
+                    'command_id': self._unique_id
+                }
+            )
 
-            except SpotifyException as exc:
-                self.write_to_log_and_output(
-                    'Error connecting to Spotify! Exception detail: {}. '
-                    'Got {} track(s) successfully.'.format(exc, len(tracks)),
-                    output_stream='stderr',
-                    log_level=logging.ERROR,
-                    extra={'fingerprint': auto_fingerprint('caught_spotify_exception', **kwargs)},
-                    exc_info=True,
-                )
+            # Spotify returns every track in the playlist in one response, so we ask for all of them
+            # and pick the tracks we have not processed before from the (shuffled) results
+            playlist_tracks = spotify.get_songs_from_playlist(playlist, self.playlist_track_limit)
+            unprocessed_tracks = [track for track in playlist_tracks if track['code'] not in processed_codes]
+            existing_codes = set(Song.objects.filter(
+                code__in=[track['code'] for track in unprocessed_tracks]
+            ).values_list('code', flat=True))
+            unprocessed_tracks = [track for track in unprocessed_tracks if track['code'] not in existing_codes]
+            raw_tracks = unprocessed_tracks[:num_tracks]
+
+            stats.record('fetch', len(raw_tracks), time.monotonic() - start)
+            self.logger.info(
+                'Got {} tracks from {}'.format(len(raw_tracks), playlist['name']),
+                extra={
+                    'fingerprint': auto_fingerprint('retrieved_tracks_from_playlist', **kwargs),
+                    'command_id': self._unique_id
+                }
+            )
 
-                break
+            for chunk_start in range(0, len(raw_tracks), self.chunk_size):
+                yield raw_tracks[chunk_start:chunk_start + self.chunk_size]
+
+            tracks_from_category += len(raw_tracks)
+
+            # Only keep codes for tracks still in the playlist, and only record the snapshot once every
+            # track in it has been processed, so the rest of the tracks are picked up by later runs
+            playlist_codes = {track['code'] for track in playlist_tracks}
+            processed_codes.update(track['code'] for track in raw_tracks)
+            processed_codes.update(existing_codes)
+            is_complete = len(raw_tracks) == len(unprocessed_tracks)
+
+            yield PlaylistCheckpoint(
+                playlist_id=playlist['uri'],
+                category=category,
+                snapshot_id=(snapshot_id or '') if is_complete else getattr(checkpoint, 'snapshot_id', ''),
+                processed_codes=sorted(processed_codes & playlist_codes),
+            )
+
+    @update_logging_data
+    def add_audio_features(self, spotify, chunks, stats, **kwargs):
+        """
+        Second stage of the ingestion pipeline. Request audio features for each chunk of tracks.
+
+        :param spotify: (AudioFeatureBatcher|RateLimitedSpotifyClient) Batcher or client to request features with
+        :param chunks: (iterable[list[dict]|PlaylistCheckpoint]) Output of the previous stage
+        :param stats: (PipelineStats) Collector for the throughput of each stage
+
+        :yield: (list[dict]|PlaylistCheckpoint)
+        """
+        for chunk in chunks:
+            if isinstance(chunk, PlaylistCheckpoint):
+                yield chunk
+                continue
+
+            self.logger.info(
+                'Calling Spotify API to get feature data for {} tracks'.format(len(chunk)),
+                extra={
+                    'fingerprint': auto_fingerprint('get_feature_data_for_tracks', **kwargs),
+                    'command_id': self._unique_id
+                }
+            )
+
+            start = time.monotonic()
+            tracks = spotify.get_audio_features_for_tracks(chunk)
+            stats.record('features', len(tracks), time.monotonic() - start)
+
+            yield tracks
+
+    def add_genre(self, category, chunks, stats):
+        """
+        Third stage of the ingestion pipeline. Add genre information to each track. We can use the category
+        search term as the genre for songs found for that category.
+
+        :param category: (str) Spotify category the tracks were collected for
+        :param chunks: (iterable[list[dict]|PlaylistCheckpoint]) Output of the previous stage
+        :param stats: (PipelineStats) Collector for the throughput of each stage
+
+        :yield: (list[dict]|PlaylistCheckpoint)
+        """
+        for chunk in chunks:
+            if isinstance(chunk, PlaylistCheckpoint):
+                yield chunk
+                continue
 
-            except Exception as exc:
-                self.write_to_log_and_output(
-                    'Unhandled exception when collecting songs from Spotify! Exception detail: {}. '
-                    'Got {} track(s) successfully.'.format(exc, len(tracks)),
-                    output_stream='stderr',
-                    log_level=logging.ERROR,
-                    extra={'fingerprint': auto_fingerprint('caught_unhandled_exception', **kwargs)},
-                    exc_info=True,
+            start = time.monotonic()
+            for track in chunk:
+                track.update({'genre': category})
+            stats.record('genre', len(chunk), time.monotonic() - start)
+
+            yield chunk
+
+    def collect_category(self, category, rate_limiter, batcher, checkpoints, results, stats, cancelled):
+        """
+        Run the fetch, audio features, and genre stages of the ingestion pipeline for a category, and put each
+        chunk they yield on the `results` queue for the main thread to save. This runs in a worker thread, so it
+        only logs its progress and leaves writing to the command output (and the database) to the main thread.
+
+        The queue is bounded, so a worker waits for the main thread to catch up before fetching more tracks.
+        After the last chunk, a `CategoryResult` is put on the queue. If a request to Spotify fails, we stop
+        collecting tracks for the category and include the exception in the result.
+
+        :param category: (str) Spotify category to collect tracks for
+        :param rate_limiter: (libs.utils.RateLimiter) Rate limiter shared by the requests for every category
+        :param batcher: (AudioFeatureBatcher) Batcher shared by every category to request audio features with
+        :param checkpoints: (dict) Mapping of playlist id to the saved `PlaylistCheckpoint` for the playlist
+        :param results: (queue.Queue) Queue to put chunks on for the main thread
+        :param stats: (PipelineStats) Collector for the throughput of each stage
+        :param cancelled: (threading.Event) Set by the main thread if it stops reading from the queue
+        """
+        num_tracks = 0
+        error = None
+
+        try:
+            spotify = RateLimitedSpotifyClient(
+                rate_limiter,
+                identifier='create_songs_from_spotify-{}-{}'.format(self._unique_id, category)
+            )
+
+            chunks = self.fetch_tracks(spotify, category, checkpoints, stats)
+            chunks = self.add_audio_features(batcher, chunks, stats)
+            chunks = self.add_genre(category, chunks, stats)
+
+            for chunk in chunks:
+                if not self._put_result(results, chunk, cancelled):
+                    return
+
+                if not isinstance(chunk, PlaylistCheckpoint):
+                    num_tracks += len(chunk)
+
+        except Exception as exc:
+            error = exc
+
+        finally:
+            # Looking up existing songs opened a database connection for this thread
+            connection.close()
+
+        self._put_result(results, CategoryResult(category, num_tracks, error), cancelled)
+
+    def _put_result(self, results, item, cancelled):
+        while not cancelled.is_set():
+            try:
+                results.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def save_chunk(self, tracks, checkpoints, stats):
+        """
+        Final stage of the ingestion pipeline. Save a chunk of tracks as Song records, along with the checkpoints
+        for the playlists whose tracks have all been saved, in one transaction.
+
+        :param tracks: (list[dict]) List of dictionaries containing data to store for Song records
+        :param checkpoints: (list[PlaylistCheckpoint]) Unsaved checkpoints for playlists
+        :param stats: (PipelineStats) Collector for the throughput of each stage
+
+        :return: (tuple(int, int)) Number of songs successfully saved and number of songs failed to save
+        """
+        start = time.monotonic()
+
+        with transaction.atomic():
+            succeeded, failed = self.save_songs_to_database(tracks)
+            self.save_playlist_checkpoints(checkpoints)
+
+        stats.record('save', len(tracks), time.monotonic() - start)
+
+        return succeeded, failed
+
+    def save_playlist_checkpoints(self, checkpoints):
+        """
+        Save the checkpoints for the playlists processed in this run. This should only be called after the
+        tracks from the playlists are saved, so a run that is interrupted before then processes the tracks
+        again on the next run.
+
+        :param checkpoints: (list[PlaylistCheckpoint]) Unsaved checkpoints from `fetch_tracks`
+        """
+        for checkpoint in checkpoints:
+            PlaylistCheckpoint.objects.update_or_create(
+                playlist_id=checkpoint.playlist_id,
+                defaults={
+                    'category': checkpoint.category,
+                    'snapshot_id': checkpoint.snapshot_id,
+                    'processed_codes': checkpoint.processed_codes,
+                }
+            )
+
+    @update_logging_data
+    def write_category_result(self, result, completed, total, **kwargs):
+        if isinstance(result.error, SpotifyException):
+            self.write_to_log_and_output(
+                'Error connecting to Spotify for category {}! Exception detail: {}. '
+                'Got {} track(s) successfully.'.format(result.category, result.error, result.num_tracks),
+                output_stream='stderr',
+                log_level=logging.ERROR,
+                extra={'fingerprint': auto_fingerprint('caught_spotify_exception', **kwargs)},
+                exc_info=(type(result.error), result.error, result.error.__traceback__),
+            )
+
+        elif result.error is not None:
+            self.write_to_log_and_output(
+                'Unhandled exception when collecting songs from Spotify for category {}! '
+                'Exception detail: {}. Got {} track(s) successfully.'.format(
+                    result.category,
+                    result.error,
+                    result.num_tracks
+                ),
+                output_stream='stderr',
+                log_level=logging.ERROR,
+                extra={'fingerprint': auto_fingerprint('caught_unhandled_exception', **kwargs)},
+                exc_info=(type(result.error), result.error, result.error.__traceback__),
+            )
+
+        self.write_to_log_and_output(
+            'Finished processing {} tracks for category: {} ({} of {} categories)'.format(
+                result.num_tracks,
+                result.category,
+                completed,
+                total
+            ),
+            extra={'fingerprint': auto_fingerprint('processed_tracks_for_category', **kwargs)}
+        )
+
+    @update_logging_data
+    def write_stage_throughput(self, stats, batcher, **kwargs):
+        for stage, (num_tracks, elapsed) in stats.get_totals().items():
+            self.write_to_log_and_output(
+                'Stage {}: {} tracks in {:.2f}s ({:.1f} tracks/s)'.format(
+                    stage,
+                    num_tracks,
+                    elapsed,
+                    num_tracks / elapsed if elapsed else 0
+                ),
+                extra={
+                    'fingerprint': auto_fingerprint('ingestion_stage_throughput', **kwargs),
+                    'stage': stage,
+                    'tracks': num_tracks,
+                    'elapsed': elapsed,
+                }
+            )
+
+        self.write_to_log_and_output(
+            'Requested audio features in {} request(s)'.format(batcher.num_requests),
+            extra={
+                'fingerprint': auto_fingerprint('audio_feature_requests', **kwargs),
+                'requests': batcher.num_requests,
+            }
+        )
+
+    def ingest_tracks_from_spotify(self):
+        """
+        Collect tracks from Spotify's API and save them as Song records, as a streaming pipeline of
+        fetch -> audio features -> genre -> save stages that pass fixed-size chunks of tracks along.
+
+        Categories are collected in parallel, up to `SPOTIFY['max_concurrent_categories']` at a time, and the
+        requests for every category share a budget of `SPOTIFY['ingestion_requests_per_second']`. A failure
+        in one category does not stop the other categories from being collected. Audio features for the tracks
+        from every category are requested together in full batches, see `AudioFeatureBatcher`.
+
+        Chunks are saved on the main thread every `save_batch_size` tracks, so songs are stored as soon as their
+        chunk is saved and only a bounded number of tracks is held in memory at once.
+
+        :return: (tuple(int, int, int, list[str])) Number of tracks fetched, number of songs successfully saved,
+            number of songs failed to save, and the categories that failed
+        """
+        categories = settings.SPOTIFY['categories']
+        rate_limiter = RateLimiter(settings.SPOTIFY['ingestion_requests_per_second'])
+        checkpoints = {checkpoint.playlist_id: checkpoint for checkpoint in PlaylistCheckpoint.objects.all()}
+        stats = PipelineStats()
+        batcher = AudioFeatureBatcher(
+            RateLimitedSpotifyClient(rate_limiter, identifier='create_songs_from_spotify-{}'.format(self._unique_id)),
+            max_wait=settings.SPOTIFY['audio_features_batch_wait'],
+        )
+
+        results = queue.Queue(maxsize=self.queue_size)
+        cancelled = threading.Event()
+
+        fetched, succeeded, failed = 0, 0, 0
+        failed_categories = []
+        completed = 0
+
+        pending_tracks = []
+        pending_checkpoints = []
+
+        with ThreadPoolExecutor(max_workers=settings.SPOTIFY['max_concurrent_categories']) as executor:
+            for category in categories:
+                executor.submit(
+                    self.collect_category,
+                    category,
+                    rate_limiter,
+                    batcher,
+                    checkpoints,
+                    results,
+                    stats,
+                    cancelled
                 )
 
-                break
+            try:
+                while completed < len(categories):
+                    item = results.get()
+
+                    if isinstance(item, CategoryResult):
+                        completed += 1
+                        if item.error is not None:
+                            failed_categories.append(item.category)
 
-        return tracks
+                        self.write_category_result(item, completed, len(categories))
+
+                    elif isinstance(item, PlaylistCheckpoint):
+                        # The tracks for a playlist come before its checkpoint, so the checkpoint
+                        # can be saved along with the next chunk of tracks
+                        pending_checkpoints.append(item)
+
+                    else:
+                        fetched += len(item)
+                        pending_tracks.extend(item)
+
+                    if len(pending_tracks) >= self.save_batch_size:
+                        chunk_succeeded, chunk_failed = self.save_chunk(pending_tracks, pending_checkpoints, stats)
+                        succeeded += chunk_succeeded
+                        failed += chunk_failed
+                        pending_tracks, pending_checkpoints = [], []
+
+                chunk_succeeded, chunk_failed = self.save_chunk(pending_tracks, pending_checkpoints, stats)
+                succeeded += chunk_succeeded
+                failed += chunk_failed
+
+            except BaseException:
+                # Let the workers stop instead of waiting forever for room on the queue
+                cancelled.set()
+                raise
+
+        self.write_stage_throughput(stats, batcher)
+
+        return fetched, succeeded, failed, failed_categories
 
     @update_logging_data
     def handle(self, *args, **options):
@@ -155,9 +563,9 @@ class Command(MoodyBaseCommand):
             extra={'fingerprint': auto_fingerprint('start_create_songs_from_spotify', **options)}
         )
 
-        tracks = self.get_tracks_from_spotify()
+        fetched, succeeded, failed, failed_categories = self.ingest_tracks_from_spotify()
 
-        if not tracks:
+        if not fetched and failed_categories:
             # If we didn't get any tracks back from Spotify, raise an exception
             # This will get caught by the periodic task and retry the script again
             self.write_to_log_and_output(
@@ -170,21 +578,19 @@ class Command(MoodyBaseCommand):
             raise CommandError('Failed to fetch any songs from Spotify')
 
         self.write_to_log_and_output(
-            'Got {} tracks from Spotify'.format(len(tracks)),
+            'Got {} tracks from Spotify'.format(fetched),
             extra={
                 'fingerprint': auto_fingerprint('fetched_tracks_from_spotify', **options),
-                'fetched_tracks': len(tracks)
+                'fetched_tracks': fetched
             }
         )
 
-        succeeded, failed = self.save_songs_to_database(tracks)
-
         self.write_to_log_and_output(
             'Finished run to create songs from Spotify',
             extra={
                 'fingerprint': auto_fingerprint('finish_create_songs_from_spotify', **options),
                 'saved_tracks': succeeded,
-                'failed_tracks': failed
+                'failed_tracks': failed,
             }
         )
 
@@ -0,0 +1,53 @@
+import logging
+
+from django.conf import settings
+
+from base.management.commands import MoodyBaseCommand
+from tunes.feature_index import get_song_feature_index
+
+
+class Command(MoodyBaseCommand):
+    help = 'Report the memory used by the song feature index, and the memory it would use for a larger song catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--projected-songs',
+            type=int,
+            nargs='*',
+            default=[1000000, 10000000],
+            help='Song catalog sizes to project the memory usage of the song feature index for'
+        )
+
+    def format_bytes(self, num_bytes):
+        return '{:.2f} MB'.format(num_bytes / (1024 * 1024))
+
+    def handle(self, *args, **options):
+        song_feature_index = get_song_feature_index()
+        memory_usage = song_feature_index.get_memory_usage()
+        bytes_per_song = song_feature_index.get_bytes_per_song()
+        memory_budget = settings.SONG_FEATURE_INDEX_MEMORY_BUDGET
+
+        self.stdout.write('Indexed songs: {}'.format(len(song_feature_index)))
+        self.stdout.write('Indexed genres: {}'.format(len(song_feature_index.genres)))
+        self.stdout.write('Bytes per song: {}'.format(bytes_per_song))
+
+        for name, num_bytes in memory_usage.items():
+            self.stdout.write('Memory used by {}: {}'.format(name, self.format_bytes(num_bytes)))
+
+        self.stdout.write('Memory budget: {}'.format(self.format_bytes(memory_budget)))
+
+        for projected_songs in options['projected_songs']:
+            self.stdout.write('Projected memory for {} songs: {}'.format(
+                projected_songs,
+                self.format_bytes(projected_songs * bytes_per_song)
+            ))
+
+        if memory_usage['total'] > memory_budget:
+            self.write_to_log_and_output(
+                'Song feature index is using {} over its memory budget'.format(
+                    self.format_bytes(memory_usage['total'] - memory_budget)
+                ),
+                output_stream='stderr',
+                log_level=logging.WARNING,
+                extra={'memory_usage': memory_usage, 'memory_budget': memory_budget}
+            )
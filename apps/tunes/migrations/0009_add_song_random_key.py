@@ -0,0 +1,24 @@
+import random
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunes', '0008_remove_db_index_from_song_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='random_key',
+            field=models.FloatField(db_index=True, default=random.random, editable=False),
+        ),
+        # AddField evaluates the callable default once for every existing row,
+        # so give each existing song its own key
+        migrations.RunSQL(
+            'UPDATE tunes_song SET random_key = random()',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-16 23:40
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the table against writes
+    atomic = False
+
+    dependencies = [
+        ('tunes', '0009_add_song_random_key'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='song',
+            index=models.Index(fields=['valence', 'energy', 'danceability'], name='song_features_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='song',
+            index=models.Index(fields=['energy'], name='song_energy_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='song',
+            index=models.Index(fields=['danceability'], name='song_danceability_idx'),
+        ),
+    ]
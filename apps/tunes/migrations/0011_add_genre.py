@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-16 23:50
+
+from django.db import migrations, models
+
+
+def create_genres_from_songs(apps, schema_editor):
+    Genre = apps.get_model('tunes', 'Genre')
+    Song = apps.get_model('tunes', 'Song')
+
+    genres = Song.objects.exclude(genre='').values_list('genre', flat=True).distinct()
+    Genre.objects.bulk_create([Genre(name=genre) for genre in genres])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunes', '0010_add_song_feature_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=20, unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(create_genres_from_songs, migrations.RunPython.noop),
+    ]
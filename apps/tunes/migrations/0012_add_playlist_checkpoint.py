@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-17 00:02
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunes', '0011_add_genre'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('playlist_id', models.CharField(max_length=50, unique=True)),
+                ('category', models.CharField(max_length=20)),
+                ('snapshot_id', models.CharField(blank=True, max_length=100)),
+                ('processed_codes', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=36), blank=True, default=list, size=None)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
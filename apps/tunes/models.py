@@ -1,3 +1,6 @@
+import random
+
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 
 from base.models import BaseModel
@@ -100,6 +103,15 @@ class Song(BaseModel):
     the unique identifier for the song in Spotify's database. `sentiment` and
     `energy` are measures of the song's mood, with lower values being more
     negative/down and higher values being more positive/upbeat.
+
+    `random_key` is a uniformly distributed value used to sample songs for browse
+    playlists without sorting the whole table by `random()`. Songs are walked in
+    `random_key` order from a random starting point, and the keys are reshuffled
+    periodically by `ShuffleSongRandomKeysTask`.
+
+    Browse playlists filter songs by a box around the emotion attributes, or by the range of a
+    single attribute for a strategy. The composite feature index serves the box (and the valence
+    strategy, from its leading column) and the energy and danceability indexes serve their strategies.
     """
     artist = models.CharField(max_length=200)
     name = models.CharField(max_length=200)
@@ -108,6 +120,14 @@ class Song(BaseModel):
     valence = models.FloatField(validators=[validate_decimal_value])
     energy = models.FloatField(validators=[validate_decimal_value])
     danceability = models.FloatField(validators=[validate_decimal_value], default=0)
+    random_key = models.FloatField(default=random.random, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['valence', 'energy', 'danceability'], name='song_features_idx'),
+            models.Index(fields=['energy'], name='song_energy_idx'),
+            models.Index(fields=['danceability'], name='song_danceability_idx'),
+        ]
 
     def __str__(self):
         return '{}: {}'.format(self.artist, self.name)
@@ -119,3 +139,30 @@ class Song(BaseModel):
         self.full_clean()
 
         super().save(*args, **kwargs)
+
+
+class Genre(BaseModel):
+    """
+    Represents a genre of `Song` records. Genres are added when a song with a new genre is saved,
+    so the genres offered to users can be listed without scanning the song table.
+    """
+    name = models.CharField(max_length=20, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class PlaylistCheckpoint(BaseModel):
+    """
+    Ingestion state for a Spotify playlist we collect songs from. `processed_codes` holds the codes of the tracks
+    in the playlist we have already tried to save as songs, so later runs only request audio features for new
+    tracks. `snapshot_id` is the Spotify snapshot of the playlist as of the last run that processed every track
+    in it. Playlists that still have the same snapshot have nothing new for us and are skipped.
+    """
+    playlist_id = models.CharField(max_length=50, unique=True)
+    category = models.CharField(max_length=20)
+    snapshot_id = models.CharField(max_length=100, blank=True)
+    processed_codes = ArrayField(models.CharField(max_length=36), default=list, blank=True)
+
+    def __str__(self):
+        return '{}: {}'.format(self.category, self.playlist_id)
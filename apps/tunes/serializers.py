@@ -1,5 +1,6 @@
 import re
 
+from django.conf import settings
 from rest_framework import serializers
 
 from accounts.models import UserSongVote
@@ -39,6 +40,10 @@ class VoteInfoSerializer(serializers.Serializer):
     contexts = serializers.ListField()
 
 
+class BulkVoteInfoSerializer(serializers.Serializer):
+    contexts = serializers.DictField(child=serializers.ListField())
+
+
 class BrowseSongsRequestSerializer(serializers.Serializer):
     """Provides validation for /tunes/browse/"""
 
@@ -78,6 +83,18 @@ class BrowseSongsRequestSerializer(serializers.Serializer):
         allow_blank=True,
         help_text='Description for user listening session.'
     )
+    mode = CleanedChoiceField(
+        settings.BROWSE_PLAYLIST_MODES,
+        required=False,
+        help_text='Method of finding songs for playlist. `box` returns random songs within `jitter` of the emotion '
+                  'attributes, `nearest` returns the songs closest to the emotion attributes.'
+    )
+
+    def validate(self, data):
+        if data.get('mode') == 'nearest' and data.get('artist'):
+            raise serializers.ValidationError('Cannot filter by artist for nearest browse playlists')
+
+        return data
 
 
 class VoteSongsRequestSerializer(serializers.Serializer):
@@ -108,6 +125,17 @@ class VoteSongsRequestSerializer(serializers.Serializer):
         return value
 
 
+class BulkVoteSongsRequestSerializer(serializers.Serializer):
+    """Provides validation for POST /tunes/vote/bulk/"""
+
+    votes = serializers.ListField(
+        child=serializers.DictField(),
+        min_length=1,
+        max_length=settings.BULK_VOTE_MAX_VOTES,
+        help_text='Collection of votes to register. Each vote is validated the same way as a POST to /tunes/vote/'
+    )
+
+
 class DeleteVoteRequestSerializer(serializers.Serializer):
     """Provides validation for DELETE /tunes/vote/"""
 
@@ -145,6 +173,16 @@ class PlaylistSongsRequestSerializer(serializers.Serializer):
         required=False,
         help_text='Filter emotion playlist for songs by given artist.'
     )
+    pagination = CleanedChoiceField(
+        settings.PLAYLIST_PAGINATION_MODES,
+        required=False,
+        help_text='Method of paginating the playlist. `page` uses page numbers, `cursor` uses an opaque `cursor` '
+                  'parameter that stays fast for deep pages.'
+    )
+    include_count = serializers.BooleanField(
+        required=False,
+        help_text='Include the total number of songs in the playlist for `cursor` pagination.'
+    )
 
 
 class VoteInfoRequestSerializer(serializers.Serializer):
@@ -157,5 +195,20 @@ class VoteInfoRequestSerializer(serializers.Serializer):
     song_code = serializers.CharField(help_text='Spotify song URI that the user has voted on.')
 
 
+class BulkVoteInfoRequestSerializer(serializers.Serializer):
+    """Provides validation for /tunes/vote/info/bulk/"""
+
+    emotion = CleanedChoiceField(
+        Emotion.EMOTION_NAME_CHOICES,
+        help_text='Emotion of votes for songs. Must be one of Emotion.EMOTION_NAME_CHOICES'
+    )
+    song_codes = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        max_length=settings.BULK_VOTE_INFO_MAX_SONGS,
+        help_text='Spotify song URIs that the user has voted on. Pass the parameter once for each song.'
+    )
+
+
 class EmptyResponseSerializer(serializers.Serializer):
     pass
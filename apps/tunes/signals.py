@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+from libs.utils import get_version_counter_seed, increment_cache_counter
+from tunes.emotion_registry import invalidate_emotion_registry
+from tunes.models import Emotion, Genre, Song
+
+
+def update_song_catalog_version(sender, instance, *args, **kwargs):
+    increment_cache_counter(settings.SONG_CATALOG_VERSION_CACHE_KEY, initial=get_version_counter_seed())
+
+
+def add_song_genre(sender, instance, *args, **kwargs):
+    if instance.genre:
+        Genre.objects.get_or_create(name=instance.genre)
+
+
+def clear_cached_genres(sender, instance, *args, **kwargs):
+    cache.delete(settings.GENRE_CHOICES_CACHE_KEY)
+    increment_cache_counter(settings.GENRE_VERSION_CACHE_KEY, initial=get_version_counter_seed())
+
+
+def update_emotion_version(sender, instance, *args, **kwargs):
+    # Registries in other processes pick up the change from the version counter,
+    # but the registry in this process should see the change right away
+    increment_cache_counter(settings.EMOTION_VERSION_CACHE_KEY, initial=get_version_counter_seed())
+    invalidate_emotion_registry()
+
+
+post_save.connect(
+    update_song_catalog_version,
+    sender=Song,
+    dispatch_uid=settings.UPDATE_SONG_CATALOG_VERSION_SIGNAL_UID
+)
+
+post_save.connect(
+    add_song_genre,
+    sender=Song,
+    dispatch_uid=settings.ADD_SONG_GENRE_SIGNAL_UID
+)
+
+post_save.connect(
+    clear_cached_genres,
+    sender=Genre,
+    dispatch_uid=settings.UPDATE_GENRE_CHOICES_SIGNAL_UID
+)
+
+post_delete.connect(
+    clear_cached_genres,
+    sender=Genre,
+    dispatch_uid=settings.DELETE_GENRE_CHOICES_SIGNAL_UID
+)
+
+post_save.connect(
+    update_emotion_version,
+    sender=Emotion,
+    dispatch_uid=settings.UPDATE_EMOTION_VERSION_SIGNAL_UID
+)
+
+post_delete.connect(
+    update_emotion_version,
+    sender=Emotion,
+    dispatch_uid=settings.DELETE_EMOTION_VERSION_SIGNAL_UID
+)
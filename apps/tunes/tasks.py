@@ -2,9 +2,14 @@ import os
 from logging import getLogger
 
 from celery.schedules import crontab
+from django.conf import settings
 from django.core.management import CommandError, call_command
+from django.db.models import FloatField, Func, Max
 
 from base.tasks import MoodyPeriodicTask
+from libs.moody_logging import auto_fingerprint, update_logging_data
+from tunes.models import Song
+from tunes.utils import BrowseCandidatePoolManager
 
 
 logger = getLogger(__name__)
@@ -24,3 +29,68 @@ class CreateSongsFromSpotifyTask(MoodyPeriodicTask):
         # Everything that we write to stdout gets logged anyway
         with open(os.devnull, 'w') as dev_null:
             return call_command('tunes_create_songs_from_spotify', stdout=dev_null, stderr=dev_null)
+
+
+class ShuffleSongRandomKeysTask(MoodyPeriodicTask):
+    run_every = crontab(minute=0, hour=5)
+
+    @update_logging_data
+    def run(self, *args, **kwargs):
+        """
+        Periodic task to assign new random keys to songs. Browse playlists walk songs in `random_key`
+        order, so reshuffling the keys keeps the same songs from being returned together.
+
+        Songs are updated in batches of primary keys to avoid holding locks on the whole table at once.
+        """
+        batch_size = settings.SONG_RANDOM_KEY_SHUFFLE_BATCH_SIZE
+        max_song_id = Song.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+        logger.info(
+            'Starting run to shuffle random keys for songs',
+            extra={
+                'fingerprint': auto_fingerprint('start_shuffle_song_random_keys', **kwargs),
+                'max_song_id': max_song_id,
+                'batch_size': batch_size,
+            }
+        )
+
+        shuffled_songs = 0
+        for batch_start in range(0, max_song_id, batch_size):
+            shuffled_songs += Song.objects.filter(
+                id__gt=batch_start,
+                id__lte=batch_start + batch_size
+            ).update(
+                random_key=Func(function='RANDOM', output_field=FloatField())
+            )
+
+        logger.info(
+            'Finished run to shuffle random keys for songs',
+            extra={
+                'fingerprint': auto_fingerprint('finish_shuffle_song_random_keys', **kwargs),
+                'shuffled_songs': shuffled_songs,
+            }
+        )
+
+
+class BuildBrowseCandidatePoolsTask(MoodyPeriodicTask):
+    run_every = crontab(minute='*/15')
+
+    @update_logging_data
+    def run(self, *args, **kwargs):
+        """
+        Periodic task to rebuild the pools of browse playlist candidates shared by users with attributes
+        close to the emotion defaults, see `BrowseCandidatePoolManager`.
+        """
+        if not settings.BROWSE_USE_CANDIDATE_POOLS:
+            return
+
+        pool_count = BrowseCandidatePoolManager().build_pools()
+
+        logger.info(
+            'Built {} browse candidate pools'.format(pool_count),
+            extra={
+                'fingerprint': auto_fingerprint('built_browse_candidate_pools', **kwargs),
+                'pool_count': pool_count,
+                'pool_size': settings.BROWSE_CANDIDATE_POOL_SIZE,
+            }
+        )
@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from libs.utils import increment_cache_counter
+from tunes.emotion_registry import EmotionRegistry
+from tunes.models import Emotion
+
+
+class TestEmotionRegistry(TestCase):
+    def setUp(self):
+        self.emotion_registry = EmotionRegistry()
+        self.emotion_registry.refresh()
+
+    def test_refresh_loads_all_emotions(self):
+        self.assertEqual(len(self.emotion_registry), Emotion.objects.count())
+
+    def test_get_by_name_returns_emotion_without_queries(self):
+        expected_emotion = Emotion.objects.get(name=Emotion.HAPPY)
+
+        with self.assertNumQueries(0):
+            emotion = self.emotion_registry.get(name=Emotion.HAPPY)
+
+        self.assertEqual(emotion.pk, expected_emotion.pk)
+        self.assertEqual(emotion.energy, expected_emotion.energy)
+        self.assertEqual(emotion.valence, expected_emotion.valence)
+        self.assertEqual(emotion.danceability, expected_emotion.danceability)
+        self.assertEqual(emotion.full_name, expected_emotion.full_name)
+
+    def test_get_by_pk_returns_emotion_without_queries(self):
+        expected_emotion = Emotion.objects.get(name=Emotion.CALM)
+
+        with self.assertNumQueries(0):
+            emotion = self.emotion_registry.get(pk=expected_emotion.pk)
+
+        self.assertEqual(emotion.name, Emotion.CALM)
+
+    def test_get_returns_copy_of_emotion(self):
+        emotion = self.emotion_registry.get(name=Emotion.HAPPY)
+        emotion.energy = 0
+
+        self.assertNotEqual(self.emotion_registry.get(name=Emotion.HAPPY).energy, 0)
+
+    def test_get_for_unknown_emotion_raises_does_not_exist(self):
+        with self.assertRaises(Emotion.DoesNotExist):
+            self.emotion_registry.get(name='foo')
+
+    def test_get_without_name_or_pk_raises_exception(self):
+        with self.assertRaises(ValueError):
+            self.emotion_registry.get()
+
+    def test_get_for_emotion_missing_from_registry_refreshes_registry(self):
+        self.emotion_registry.emotions_by_name.pop(Emotion.HAPPY)
+
+        with self.assertNumQueries(1):
+            emotion = self.emotion_registry.get(name=Emotion.HAPPY)
+
+        self.assertEqual(emotion.name, Emotion.HAPPY)
+
+    def test_all_returns_emotions_ordered_by_pk(self):
+        expected_pks = list(Emotion.objects.order_by('pk').values_list('pk', flat=True))
+
+        self.assertEqual([emotion.pk for emotion in self.emotion_registry.all()], expected_pks)
+
+    def test_refresh_within_version_check_interval_does_not_query(self):
+        with self.assertNumQueries(0):
+            self.emotion_registry.refresh()
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_refresh_after_version_change_reloads_emotions(self):
+        increment_cache_counter(settings.EMOTION_VERSION_CACHE_KEY)
+        self.emotion_registry.last_version_check = 0
+
+        with self.assertNumQueries(1):
+            self.emotion_registry.refresh()
+
+        self.assertEqual(self.emotion_registry.version, cache.get(settings.EMOTION_VERSION_CACHE_KEY))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_saving_emotion_increments_emotion_version(self):
+        increment_cache_counter(settings.EMOTION_VERSION_CACHE_KEY)
+        version = cache.get(settings.EMOTION_VERSION_CACHE_KEY)
+
+        emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        emotion.energy = .55
+        emotion.save()
+
+        self.assertEqual(cache.get(settings.EMOTION_VERSION_CACHE_KEY), version + 1)
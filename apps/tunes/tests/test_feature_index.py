@@ -0,0 +1,253 @@
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from libs.tests.helpers import MoodyUtil
+from libs.utils import increment_cache_counter
+from tunes.feature_index import SongFeatureIndex
+from tunes.models import Song
+
+
+class TestSongFeatureIndex(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.song = MoodyUtil.create_song(energy=.5, valence=.5, danceability=.5, genre='hiphop')
+        cls.other_song = MoodyUtil.create_song(energy=.9, valence=.1, danceability=.2, genre='rock')
+
+    def setUp(self):
+        self.song_feature_index = SongFeatureIndex()
+        self.song_feature_index.refresh()
+
+    def test_refresh_loads_all_songs(self):
+        self.assertEqual(len(self.song_feature_index), 2)
+        self.assertEqual(self.song_feature_index.ids.tolist(), [self.song.pk, self.other_song.pk])
+        self.assertEqual(self.song_feature_index.energy.tolist(), [.5, .9])
+        self.assertEqual(set(self.song_feature_index.genres), {'hiphop', 'rock'})
+
+    def test_get_candidate_song_ids_filters_on_ranges(self):
+        ranges = {
+            'energy': (.4, .6),
+            'valence': (.4, .6),
+            'danceability': (.4, .6),
+        }
+
+        candidate_ids = self.song_feature_index.get_candidate_song_ids(ranges)
+
+        self.assertEqual(candidate_ids.tolist(), [self.song.pk])
+
+    def test_get_candidate_song_ids_includes_exact_boundaries(self):
+        candidate_ids = self.song_feature_index.get_candidate_song_ids({'energy': (.5, .5)})
+
+        self.assertEqual(candidate_ids.tolist(), [self.song.pk])
+
+    def test_get_candidate_song_ids_filters_on_genre(self):
+        candidate_ids = self.song_feature_index.get_candidate_song_ids({'energy': (0, 1)}, genre='rock')
+
+        self.assertEqual(candidate_ids.tolist(), [self.other_song.pk])
+
+    def test_get_candidate_song_ids_for_unknown_genre_returns_empty_array(self):
+        candidate_ids = self.song_feature_index.get_candidate_song_ids({'energy': (0, 1)}, genre='polka')
+
+        self.assertEqual(len(candidate_ids), 0)
+
+    def test_get_candidate_song_ids_with_invalid_attribute_raises_exception(self):
+        with self.assertRaises(ValueError):
+            self.song_feature_index.get_candidate_song_ids({'foo': (0, 1)})
+
+    def test_refresh_without_version_change_does_not_query_database(self):
+        self.song_feature_index.last_version_check = 0
+
+        with self.assertNumQueries(0):
+            self.song_feature_index.refresh()
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_refresh_after_song_created_appends_new_song(self):
+        new_song = MoodyUtil.create_song(energy=.52, valence=.52, danceability=.52)
+        self.song_feature_index.last_version_check = 0
+
+        self.song_feature_index.refresh()
+
+        self.assertEqual(len(self.song_feature_index), 3)
+        self.assertEqual(self.song_feature_index.ids[-1], new_song.pk)
+        self.assertEqual(self.song_feature_index.version, cache.get(settings.SONG_CATALOG_VERSION_CACHE_KEY))
+
+    def test_refresh_updates_existing_songs_in_place(self):
+        Song.objects.filter(pk=self.song.pk).update(energy=.75, genre='rock')
+
+        self.song_feature_index.refresh(force=True)
+
+        self.assertEqual(len(self.song_feature_index), 2)
+        self.assertEqual(self.song_feature_index.energy.tolist(), [.75, .9])
+        self.assertEqual(
+            self.song_feature_index.get_candidate_song_ids({'energy': (0, 1)}, genre='rock').tolist(),
+            [self.song.pk, self.other_song.pk]
+        )
+
+    def test_refresh_inserts_song_committed_after_higher_id_in_sorted_position(self):
+        index = SongFeatureIndex()
+        index._apply_rows([(1, .1, .1, .1, 'rock'), (3, .3, .3, .3, 'rock')])
+
+        # Song 2 was created before song 3, but its transaction committed after song 3 was indexed
+        index._apply_rows([(2, .2, .2, .2, 'hiphop'), (3, .35, .35, .35, 'rock')])
+
+        self.assertEqual(index.ids.tolist(), [1, 2, 3])
+        self.assertEqual(index.energy.tolist(), [.1, .2, .35])
+        self.assertEqual(index.get_candidate_song_ids({'energy': (0, 1)}, genre='hiphop').tolist(), [2])
+
+    def test_refresh_swaps_in_new_snapshot_without_changing_previous_snapshot(self):
+        snapshot = self.song_feature_index.snapshot
+        Song.objects.filter(pk=self.song.pk).update(energy=.75)
+        new_song = MoodyUtil.create_song(energy=.52, valence=.52, danceability=.52)
+
+        self.song_feature_index.refresh(force=True)
+
+        # Queries holding the old snapshot keep reading ids and attributes from the same refresh
+        self.assertEqual(snapshot.ids.tolist(), [self.song.pk, self.other_song.pk])
+        self.assertEqual(snapshot.energy.tolist(), [.5, .9])
+        self.assertEqual(self.song_feature_index.ids.tolist(), [self.song.pk, self.other_song.pk, new_song.pk])
+        self.assertEqual(self.song_feature_index.energy.tolist(), [.75, .9, .52])
+
+    def test_snapshot_arrays_are_read_only(self):
+        with self.assertRaises(ValueError):
+            self.song_feature_index.snapshot.energy[0] = 1
+
+    def test_get_memory_usage_reports_bytes_for_each_array(self):
+        memory_usage = self.song_feature_index.get_memory_usage()
+
+        self.assertEqual(memory_usage['total'], 2 * self.song_feature_index.get_bytes_per_song())
+        self.assertEqual(memory_usage['ids'], 2 * self.song_feature_index.ids.itemsize)
+
+    @override_settings(SONG_FEATURE_INDEX_MEMORY_BUDGET=1)
+    @mock.patch('tunes.feature_index.logger')
+    def test_refresh_over_memory_budget_logs_warning(self, mock_logger):
+        self.song_feature_index.refresh(force=True)
+
+        mock_logger.warning.assert_called_once()
+
+
+class TestSongFeatureIndexNearestSongs(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.closest_song = MoodyUtil.create_song(energy=.5, valence=.5, danceability=.5, genre='hiphop')
+        cls.next_closest_song = MoodyUtil.create_song(energy=.6, valence=.5, danceability=.5, genre='rock')
+        cls.furthest_song = MoodyUtil.create_song(energy=.5, valence=.5, danceability=.9, genre='hiphop')
+        cls.point = {'energy': .5, 'valence': .5, 'danceability': .5}
+
+    def setUp(self):
+        self.song_feature_index = SongFeatureIndex()
+        self.song_feature_index.refresh()
+
+    def test_get_nearest_song_ids_returns_songs_ordered_by_distance(self):
+        song_ids = self.song_feature_index.get_nearest_song_ids(self.point, 3)
+
+        self.assertEqual(song_ids.tolist(), [self.closest_song.pk, self.next_closest_song.pk, self.furthest_song.pk])
+
+    def test_get_nearest_song_ids_respects_limit(self):
+        song_ids = self.song_feature_index.get_nearest_song_ids(self.point, 1)
+
+        self.assertEqual(song_ids.tolist(), [self.closest_song.pk])
+
+    def test_get_nearest_song_ids_leaves_out_excluded_songs(self):
+        song_ids = self.song_feature_index.get_nearest_song_ids(
+            self.point,
+            1,
+            exclude_song_ids=[self.closest_song.pk]
+        )
+
+        self.assertEqual(song_ids.tolist(), [self.next_closest_song.pk])
+
+    def test_get_nearest_song_ids_filters_on_genre(self):
+        song_ids = self.song_feature_index.get_nearest_song_ids(self.point, 3, genre='hiphop')
+
+        self.assertEqual(song_ids.tolist(), [self.closest_song.pk, self.furthest_song.pk])
+
+    def test_get_nearest_song_ids_queries_tree_of_songs_in_genre(self):
+        tree, positions = self.song_feature_index.snapshot.get_tree(
+            SongFeatureIndex.ATTRIBUTES,
+            settings.BROWSE_NEAREST_FEATURE_WEIGHTS,
+            genre='hiphop'
+        )
+
+        self.assertEqual(tree.n, 2)
+        self.assertEqual(
+            self.song_feature_index.ids[positions].tolist(),
+            [self.closest_song.pk, self.furthest_song.pk]
+        )
+
+    @override_settings(SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE=2)
+    def test_get_nearest_song_ids_past_max_query_size_returns_none(self):
+        song_ids = self.song_feature_index.get_nearest_song_ids(
+            self.point,
+            1,
+            exclude_song_ids=[self.closest_song.pk, self.next_closest_song.pk]
+        )
+
+        self.assertIsNone(song_ids)
+
+    @override_settings(SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE=2)
+    def test_get_nearest_song_ids_at_max_query_size_with_enough_songs_returns_songs(self):
+        song_ids = self.song_feature_index.get_nearest_song_ids(
+            self.point,
+            1,
+            exclude_song_ids=[self.closest_song.pk]
+        )
+
+        self.assertEqual(song_ids.tolist(), [self.next_closest_song.pk])
+
+    def test_get_nearest_song_ids_for_unknown_genre_returns_empty_array(self):
+        song_ids = self.song_feature_index.get_nearest_song_ids(self.point, 3, genre='polka')
+
+        self.assertEqual(len(song_ids), 0)
+
+    def test_get_nearest_song_ids_uses_weighted_distance(self):
+        # Energy is weighted heavily enough that a small difference in energy is further than a large
+        # difference in danceability
+        weights = {'energy': 100, 'valence': 1, 'danceability': 1}
+        point = {'energy': .5, 'valence': .5, 'danceability': .6}
+
+        song_ids = self.song_feature_index.get_nearest_song_ids(point, 2, weights=weights)
+
+        self.assertEqual(song_ids.tolist(), [self.closest_song.pk, self.furthest_song.pk])
+
+    def test_get_nearest_song_ids_breaks_ties_randomly(self):
+        tied_song = MoodyUtil.create_song(energy=.5, valence=.5, danceability=.5)
+        self.song_feature_index.refresh(force=True)
+
+        with mock.patch('tunes.feature_index.np.random.random') as mock_random:
+            mock_random.side_effect = lambda size: np.linspace(1, 0, size)
+            song_ids = self.song_feature_index.get_nearest_song_ids(self.point, 2)
+
+        self.assertCountEqual(song_ids.tolist(), [self.closest_song.pk, tied_song.pk])
+
+        with mock.patch('tunes.feature_index.np.random.random') as mock_random:
+            mock_random.side_effect = lambda size: np.linspace(0, 1, size)
+            reversed_song_ids = self.song_feature_index.get_nearest_song_ids(self.point, 2)
+
+        self.assertEqual(reversed_song_ids.tolist(), song_ids.tolist()[::-1])
+
+    def test_get_nearest_song_ids_includes_songs_added_on_refresh(self):
+        new_song = MoodyUtil.create_song(energy=.51, valence=.5, danceability=.5)
+        self.song_feature_index.get_nearest_song_ids(self.point, 1)
+
+        self.song_feature_index.refresh(force=True)
+        song_ids = self.song_feature_index.get_nearest_song_ids(self.point, 2)
+
+        self.assertEqual(song_ids.tolist(), [self.closest_song.pk, new_song.pk])
+
+    def test_get_nearest_song_ids_with_missing_attribute_raises_exception(self):
+        with self.assertRaises(ValueError):
+            self.song_feature_index.get_nearest_song_ids({'energy': .5}, 1)
+
+
+class TestUpdateSongCatalogVersionSignal(TestCase):
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_saving_song_increments_song_catalog_version(self):
+        increment_cache_counter(settings.SONG_CATALOG_VERSION_CACHE_KEY)
+        version = cache.get(settings.SONG_CATALOG_VERSION_CACHE_KEY)
+
+        MoodyUtil.create_song()
+
+        self.assertEqual(cache.get(settings.SONG_CATALOG_VERSION_CACHE_KEY), version + 1)
@@ -1,13 +1,21 @@
 import copy
+from io import StringIO
 from unittest import mock
 
+from django.conf import settings
 from django.core.management import CommandError, call_command
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from spotify_client.exceptions import SpotifyException
 
-from libs.tests.helpers import generate_random_unicode_string
-from tunes.management.commands.tunes_create_songs_from_spotify import Command as SpotifyCommand
-from tunes.models import Song
+from accounts.models import UserSongVote
+from libs.tests.helpers import MoodyUtil, generate_random_unicode_string
+from libs.utils import RateLimiter
+from spotify.utils import RateLimitedSpotifyClient
+from tunes.feature_index import SongFeatureIndex
+from tunes.management.commands.tunes_create_songs_from_spotify import Command as SpotifyCommand, PipelineStats
+from tunes.models import Genre, PlaylistCheckpoint, Song
 
 
 class TestCreateSongsFromSpotifyCommand(TestCase):
@@ -24,6 +32,11 @@ class TestCreateSongsFromSpotifyCommand(TestCase):
             'genre': 'Chill-Hop'
         }
 
+    def setUp(self):
+        patcher = mock.patch('spotify.utils.RateLimitedSpotifyClient.get_playlist_snapshot_id', return_value=None)
+        self.mock_get_playlist_snapshot_id = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_save_songs_to_database_happy_path(self):
         success, fail = self.command.save_songs_to_database([self.track_data])
         self.assertEqual(success, 1)
@@ -78,6 +91,76 @@ class TestCreateSongsFromSpotifyCommand(TestCase):
         self.assertEqual(success, 0)
         self.assertEqual(fail, 1)
 
+    def test_save_songs_to_database_writes_result_for_each_track_in_order(self):
+        Song.objects.create(**dict(self.track_data, code='existing-code', name='Kerala'))
+        stdout = StringIO()
+        stderr = StringIO()
+        command = SpotifyCommand(stdout=stdout, stderr=stderr)
+
+        tracks = [
+            self.track_data,
+            dict(self.track_data, code='other-code'),
+            dict(self.track_data, code='existing-code', name='Cirrus'),
+            dict(self.track_data, code='song-code', name='Cirrus'),
+            {'code': 'bad-code', 'name': 'Kiara', 'artist': 'Bonobo'},
+            dict(self.track_data, code='new-code', name='Flashlight'),
+        ]
+
+        success, fail = command.save_songs_to_database(tracks)
+
+        self.assertEqual((success, fail), (2, 4))
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'Created song with code song-code',
+            'Song Sapphire by Bonobo already exists in our database',
+            'Song with code existing-code already exists',
+            'Song with code song-code already exists',
+            'Created song with code new-code',
+        ])
+        self.assertEqual(stderr.getvalue().splitlines(), [
+            'ERROR: Could not create song with data: {}'.format(tracks[4]),
+        ])
+        self.assertEqual(
+            set(Song.objects.values_list('code', flat=True)),
+            {'existing-code', 'song-code', 'new-code'}
+        )
+
+    def test_save_songs_to_database_counts_songs_skipped_by_insert_as_failed(self):
+        stdout = StringIO()
+        command = SpotifyCommand(stdout=stdout)
+        other_track = dict(self.track_data, code='other-code', name='Kerala', genre='Electronic')
+
+        # Simulate another process inserting the song after we looked up existing songs
+        def bulk_create(songs, **kwargs):
+            Song.objects.create(**self.track_data)
+            return original_bulk_create(songs, **kwargs)
+
+        original_bulk_create = Song.objects.bulk_create
+
+        with mock.patch.object(Song.objects, 'bulk_create', side_effect=bulk_create):
+            success, fail = command.save_songs_to_database([dict(self.track_data, genre='Jazz'), other_track])
+
+        self.assertEqual((success, fail), (1, 1))
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'Song with code song-code already exists',
+            'Created song with code other-code',
+        ])
+        self.assertFalse(Genre.objects.filter(name='Jazz').exists())
+        self.assertTrue(Genre.objects.filter(name='Electronic').exists())
+
+    def test_save_songs_to_database_adds_genres_for_new_songs(self):
+        self.command.save_songs_to_database([self.track_data])
+
+        self.assertTrue(Genre.objects.filter(name=self.track_data['genre']).exists())
+
+    def test_save_songs_to_database_does_not_query_for_each_track(self):
+        tracks = [dict(self.track_data, code='code-{}'.format(i), name='Song {}'.format(i)) for i in range(50)]
+
+        with CaptureQueriesContext(connection) as queries:
+            success, fail = self.command.save_songs_to_database(tracks)
+
+        self.assertEqual(success, 50)
+        self.assertLess(len(queries), 10)
+
     @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
     def test_script_raises_command_error_if_no_tracks_retrieved_spotify_exception(self, mock_spotify_request):
         # We'll raise an exception on the first request to ensure we don't get any tracks back
@@ -97,10 +180,11 @@ class TestCreateSongsFromSpotifyCommand(TestCase):
     @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
     @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
     @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
-    def test_spotify_exception_raised_with_some_tracks(self, mock_features, _, mock_playlists):
+    def test_spotify_exception_raised_with_some_tracks(self, mock_features, mock_songs, mock_playlists):
         # If one category returns some tracks and the next one raises an exception, we should
         # still process the songs we got
         mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.return_value = [{'code': self.track_data['code']}]
 
         mock_features.side_effect = [
             [self.track_data],
@@ -114,10 +198,11 @@ class TestCreateSongsFromSpotifyCommand(TestCase):
     @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
     @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
     @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
-    def test_exception_raised_with_some_tracks(self, mock_features, _, mock_playlists):
+    def test_exception_raised_with_some_tracks(self, mock_features, mock_songs, mock_playlists):
         # If one category returns some tracks and the next one raises an exception, we should
         # still process the songs we got
         mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.return_value = [{'code': self.track_data['code']}]
 
         mock_features.side_effect = [
             [self.track_data],
@@ -127,3 +212,301 @@ class TestCreateSongsFromSpotifyCommand(TestCase):
         call_command('tunes_create_songs_from_spotify')
 
         self.assertEqual(Song.objects.count(), 1)
+
+    @override_settings(SPOTIFY=dict(settings.SPOTIFY, categories=['hiphop', 'rock']))
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_failure_in_one_category_does_not_stop_other_categories(self, mock_features, mock_songs, mock_playlists):
+        def get_playlists(category, num_playlists):
+            if category == 'hiphop':
+                raise SpotifyException('Test Spotify Exception')
+
+            return [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+
+        mock_playlists.side_effect = get_playlists
+        mock_songs.return_value = [{'code': self.track_data['code']}]
+        mock_features.return_value = [dict(self.track_data)]
+
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command('tunes_create_songs_from_spotify', stdout=stdout, stderr=stderr)
+
+        self.assertEqual(Song.objects.get().genre, 'rock')
+        self.assertIn('Error connecting to Spotify for category hiphop', stderr.getvalue())
+        self.assertIn('Finished processing 1 tracks for category: rock', stdout.getvalue())
+        self.assertIn('of 2 categories', stdout.getvalue())
+
+    @override_settings(SPOTIFY=dict(settings.SPOTIFY, max_songs_from_category=2))
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    def test_fetch_tracks_stops_at_max_songs_from_category(self, mock_songs, mock_playlists):
+        mock_playlists.return_value = [
+            {'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'},
+            {'user': 'two-tone-killer', 'name': 'Beetz.local', 'uri': 'other-code'},
+        ]
+        mock_songs.return_value = [{'code': 'first-code'}, {'code': 'second-code'}]
+        spotify = RateLimitedSpotifyClient(RateLimiter(rate=100))
+
+        chunks = list(self.command.fetch_tracks(spotify, 'hiphop', {}, PipelineStats()))
+
+        self.assertEqual(mock_songs.call_count, 1)
+        self.assertEqual(chunks[0], [{'code': 'first-code'}, {'code': 'second-code'}])
+        self.assertIsInstance(chunks[1], PlaylistCheckpoint)
+        self.assertEqual(len(chunks), 2)
+
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    def test_fetch_tracks_yields_fixed_size_chunks(self, mock_playlists, mock_songs):
+        mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.return_value = [{'code': 'code-{}'.format(i)} for i in range(5)]
+        spotify = RateLimitedSpotifyClient(RateLimiter(rate=100))
+
+        with mock.patch.object(SpotifyCommand, 'chunk_size', 2):
+            chunks = list(self.command.fetch_tracks(spotify, 'hiphop', {}, PipelineStats()))
+
+        self.assertEqual([len(chunk) for chunk in chunks[:-1]], [2, 2, 1])
+        self.assertIsInstance(chunks[-1], PlaylistCheckpoint)
+
+    @override_settings(SPOTIFY=dict(settings.SPOTIFY, categories=['hiphop']))
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_songs_are_saved_before_later_failure(self, mock_features, mock_songs, mock_playlists):
+        mock_playlists.return_value = [
+            {'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'},
+            {'user': 'two-tone-killer', 'name': 'Beetz.local', 'uri': 'other-code'},
+        ]
+        mock_songs.return_value = [{'code': self.track_data['code']}]
+        mock_features.side_effect = [[dict(self.track_data)], SpotifyException('Test Spotify Exception')]
+
+        with mock.patch.object(SpotifyCommand, 'save_batch_size', 1):
+            call_command('tunes_create_songs_from_spotify', stdout=StringIO(), stderr=StringIO())
+
+        self.assertTrue(Song.objects.filter(code=self.track_data['code']).exists())
+        self.assertTrue(PlaylistCheckpoint.objects.filter(playlist_id='some-code').exists())
+        self.assertFalse(PlaylistCheckpoint.objects.filter(playlist_id='other-code').exists())
+
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_command_reports_throughput_for_each_stage(self, mock_features, mock_songs, mock_playlists):
+        mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.return_value = [{'code': self.track_data['code']}]
+        mock_features.return_value = [dict(self.track_data)]
+        stdout = StringIO()
+
+        call_command('tunes_create_songs_from_spotify', stdout=stdout, stderr=StringIO())
+
+        for stage in ('fetch', 'features', 'genre', 'save'):
+            self.assertIn('Stage {}:'.format(stage), stdout.getvalue())
+
+    @override_settings(SPOTIFY=dict(settings.SPOTIFY, categories=['hiphop', 'rock']))
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_audio_features_for_every_category_are_requested_together(self, mock_features, mock_songs, mock_playlists):
+        def get_playlists(category, *args, **kwargs):
+            return [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'code-{}'.format(category)}]
+
+        def get_songs(playlist, *args, **kwargs):
+            return [{'code': 'song-{}'.format(playlist['uri']), 'name': playlist['uri'], 'artist': 'Bonobo'}]
+
+        def get_features(tracks):
+            for track in tracks:
+                track.update({'energy': .75, 'valence': .5})
+
+            return tracks
+
+        mock_playlists.side_effect = get_playlists
+        mock_songs.side_effect = get_songs
+        mock_features.side_effect = get_features
+        stdout = StringIO()
+
+        call_command('tunes_create_songs_from_spotify', stdout=stdout, stderr=StringIO())
+
+        mock_features.assert_called_once()
+        self.assertEqual(len(mock_features.call_args[0][0]), 2)
+        self.assertEqual(Song.objects.filter(code__in=['song-code-hiphop', 'song-code-rock']).count(), 2)
+        self.assertIn('Requested audio features in 1 request(s)', stdout.getvalue())
+
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_unchanged_playlist_is_skipped(self, mock_features, mock_songs, mock_playlists):
+        PlaylistCheckpoint.objects.create(playlist_id='some-code', category='hiphop', snapshot_id='snapshot')
+        self.mock_get_playlist_snapshot_id.return_value = 'snapshot'
+        mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+
+        call_command('tunes_create_songs_from_spotify', stdout=StringIO())
+
+        mock_songs.assert_not_called()
+        mock_features.assert_not_called()
+
+    @override_settings(SPOTIFY=dict(settings.SPOTIFY, max_songs_from_category=1))
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    def test_fetch_tracks_skips_tracks_for_existing_songs(self, mock_playlists, mock_songs):
+        Song.objects.create(**self.track_data)
+        mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.return_value = [{'code': self.track_data['code']}, {'code': 'new-code'}]
+        spotify = RateLimitedSpotifyClient(RateLimiter(rate=100))
+
+        chunks = list(self.command.fetch_tracks(spotify, 'hiphop', {}, PipelineStats()))
+
+        # The existing song does not use up the budget for the category
+        self.assertEqual(chunks[0], [{'code': 'new-code'}])
+        self.assertEqual(chunks[1].processed_codes, ['new-code', self.track_data['code']])
+        self.assertEqual(len(chunks), 2)
+
+    @override_settings(SPOTIFY=dict(settings.SPOTIFY, categories=['hiphop']))
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_only_unprocessed_tracks_are_requested_for_features(self, mock_features, mock_songs, mock_playlists):
+        PlaylistCheckpoint.objects.create(
+            playlist_id='some-code',
+            category='hiphop',
+            snapshot_id='old-snapshot',
+            processed_codes=['old-code']
+        )
+        self.mock_get_playlist_snapshot_id.return_value = 'new-snapshot'
+        mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.return_value = [{'code': 'old-code'}, dict(self.track_data)]
+        mock_features.side_effect = lambda tracks: tracks
+
+        call_command('tunes_create_songs_from_spotify', stdout=StringIO())
+
+        mock_features.assert_called_once_with([dict(self.track_data, genre='hiphop')])
+
+        checkpoint = PlaylistCheckpoint.objects.get(playlist_id='some-code')
+        self.assertEqual(checkpoint.snapshot_id, 'new-snapshot')
+        self.assertEqual(checkpoint.processed_codes, ['old-code', self.track_data['code']])
+
+    @override_settings(SPOTIFY=dict(settings.SPOTIFY, categories=['hiphop'], max_songs_from_category=1))
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    @mock.patch('spotify_client.SpotifyClient.get_audio_features_for_tracks')
+    def test_partly_processed_playlist_is_resumed_on_next_run(self, mock_features, mock_songs, mock_playlists):
+        self.mock_get_playlist_snapshot_id.return_value = 'snapshot'
+        mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.side_effect = lambda playlist, num_songs: [
+            dict(self.track_data),
+            dict(self.track_data, code='other-code', name='Kong'),
+        ]
+        mock_features.side_effect = lambda tracks: tracks
+
+        call_command('tunes_create_songs_from_spotify', stdout=StringIO())
+
+        # Only one of the tracks fit in the budget, so the snapshot is not recorded yet
+        checkpoint = PlaylistCheckpoint.objects.get(playlist_id='some-code')
+        self.assertEqual(checkpoint.snapshot_id, '')
+        self.assertEqual(checkpoint.processed_codes, [self.track_data['code']])
+
+        call_command('tunes_create_songs_from_spotify', stdout=StringIO())
+
+        checkpoint.refresh_from_db()
+        self.assertEqual(checkpoint.snapshot_id, 'snapshot')
+        self.assertEqual(set(Song.objects.values_list('code', flat=True)), {self.track_data['code'], 'other-code'})
+
+    @mock.patch('spotify_client.SpotifyClient.get_playlists_for_category')
+    @mock.patch('spotify_client.SpotifyClient.get_songs_from_playlist')
+    def test_run_without_new_tracks_does_not_raise_command_error(self, mock_songs, mock_playlists):
+        mock_playlists.return_value = [{'user': 'two-tone-killer', 'name': 'Beetz.remote', 'uri': 'some-code'}]
+        mock_songs.return_value = []
+
+        result = call_command('tunes_create_songs_from_spotify', stdout=StringIO())
+
+        self.assertEqual(result, 'Created Songs: 0')
+
+
+class TestBenchmarkBrowsePlaylistCommand(TestCase):
+    def test_command_reports_timings_for_each_sampling_method(self):
+        out = StringIO()
+
+        call_command('tunes_benchmark_browse_playlist', sizes=[20, 40], iterations=1, stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('Benchmarking browse playlists with 20 generated songs', output)
+        self.assertIn('Benchmarking browse playlists with 40 generated songs', output)
+        self.assertIn('sampling method=random_key', output)
+        self.assertIn('feature index sampling', output)
+        self.assertIn('browse filter strategy=all (without song indexes)', output)
+        self.assertIn('browse filter strategy=energy (with song indexes)', output)
+
+    def test_command_does_not_persist_generated_songs(self):
+        call_command('tunes_benchmark_browse_playlist', sizes=[20], iterations=1, stdout=StringIO())
+
+        self.assertFalse(Song.objects.exists())
+
+
+class TestBenchmarkCachedPlaylistCommand(TestCase):
+    def test_command_reports_entry_sizes_and_hydration_timings(self):
+        out = StringIO()
+
+        call_command('tunes_benchmark_cached_playlist', sizes=[5], iterations=1, stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('Benchmarking cached playlists with 5 songs', output)
+        self.assertIn('legacy entry size', output)
+        self.assertIn('compact entry size', output)
+        self.assertIn('compact hydration', output)
+        self.assertFalse(Song.objects.exists())
+
+
+class TestBenchmarkPlaylistPaginationCommand(TestCase):
+    def test_command_reports_timings_for_each_pagination_method(self):
+        out = StringIO()
+
+        call_command('tunes_benchmark_playlist_pagination', sizes=[30], iterations=1, stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('Benchmarking emotion playlist pagination with 30 votes', output)
+        self.assertIn('page number pagination page=4', output)
+        self.assertIn('cursor pagination page=4', output)
+        self.assertFalse(UserSongVote.objects.exists())
+
+
+class TestBenchmarkPlaylistQueryCommand(TestCase):
+    def test_command_reports_plan_for_each_implementation(self):
+        out = StringIO()
+
+        call_command('tunes_benchmark_playlist_query', sizes=[10], iterations=1, stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('Benchmarking emotion playlist query with 10 songs and 20 votes', output)
+        self.assertIn('song join', output)
+        self.assertIn('song_scans=1', output)
+        self.assertFalse(UserSongVote.objects.exists())
+
+
+class TestSongFeatureIndexReportCommand(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        MoodyUtil.create_song()
+
+    @mock.patch('tunes.management.commands.tunes_song_feature_index_report.get_song_feature_index')
+    def test_command_reports_memory_usage(self, mock_get_song_feature_index):
+        song_feature_index = SongFeatureIndex()
+        song_feature_index.refresh()
+        mock_get_song_feature_index.return_value = song_feature_index
+        out = StringIO()
+
+        call_command('tunes_song_feature_index_report', projected_songs=[1000], stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('Indexed songs: 1', output)
+        self.assertIn('Bytes per song: {}'.format(song_feature_index.get_bytes_per_song()), output)
+        self.assertIn('Projected memory for 1000 songs', output)
+
+    @override_settings(SONG_FEATURE_INDEX_MEMORY_BUDGET=1)
+    @mock.patch('tunes.management.commands.tunes_song_feature_index_report.get_song_feature_index')
+    def test_command_over_memory_budget_writes_warning(self, mock_get_song_feature_index):
+        song_feature_index = SongFeatureIndex()
+        song_feature_index.refresh()
+        mock_get_song_feature_index.return_value = song_feature_index
+        err = StringIO()
+
+        call_command('tunes_song_feature_index_report', stdout=StringIO(), stderr=err)
+
+        self.assertIn('over its memory budget', err.getvalue())
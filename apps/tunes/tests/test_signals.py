@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from libs.tests.helpers import MoodyUtil
+from tunes.models import Genre
+
+
+class TestAddSongGenreSignal(TestCase):
+    def test_saving_song_with_new_genre_creates_genre(self):
+        MoodyUtil.create_song(genre='hiphop')
+
+        self.assertTrue(Genre.objects.filter(name='hiphop').exists())
+
+    def test_saving_song_with_existing_genre_does_not_create_genre(self):
+        MoodyUtil.create_song(genre='hiphop')
+        MoodyUtil.create_song(genre='hiphop')
+
+        self.assertEqual(Genre.objects.filter(name='hiphop').count(), 1)
+
+    def test_saving_song_without_genre_does_not_create_genre(self):
+        MoodyUtil.create_song(genre='')
+
+        self.assertFalse(Genre.objects.exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestClearCachedGenresSignal(TestCase):
+    def setUp(self):
+        cache.set(settings.GENRE_CHOICES_CACHE_KEY, ['rock'])
+
+    def test_creating_genre_clears_cached_genres(self):
+        Genre.objects.create(name='hiphop')
+
+        self.assertIsNone(cache.get(settings.GENRE_CHOICES_CACHE_KEY))
+
+    def test_deleting_genre_clears_cached_genres(self):
+        genre = Genre.objects.create(name='hiphop')
+        cache.set(settings.GENRE_CHOICES_CACHE_KEY, ['hiphop', 'rock'])
+
+        genre.delete()
+
+        self.assertIsNone(cache.get(settings.GENRE_CHOICES_CACHE_KEY))
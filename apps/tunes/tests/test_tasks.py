@@ -1,8 +1,10 @@
 from unittest import mock
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from tunes.tasks import CreateSongsFromSpotifyTask
+from libs.tests.helpers import MoodyUtil
+from tunes.models import Song
+from tunes.tasks import BuildBrowseCandidatePoolsTask, CreateSongsFromSpotifyTask, ShuffleSongRandomKeysTask
 
 
 class TestCreateSongsFromSpotifyTask(TestCase):
@@ -31,3 +33,41 @@ class TestCreateSongsFromSpotifyTask(TestCase):
         CreateSongsFromSpotifyTask().run()
 
         mock_retry.assert_called_once()
+
+
+class TestShuffleSongRandomKeysTask(TestCase):
+    @override_settings(SONG_RANDOM_KEY_SHUFFLE_BATCH_SIZE=2)
+    def test_task_assigns_new_random_keys_to_all_songs(self):
+        for _ in range(5):
+            MoodyUtil.create_song()
+
+        Song.objects.update(random_key=2)
+
+        ShuffleSongRandomKeysTask().run()
+
+        self.assertFalse(Song.objects.filter(random_key=2).exists())
+        self.assertFalse(Song.objects.filter(random_key__lt=0).exists())
+        self.assertFalse(Song.objects.filter(random_key__gte=1).exists())
+
+    def test_task_does_nothing_if_no_songs_exist(self):
+        ShuffleSongRandomKeysTask().run()
+
+        self.assertFalse(Song.objects.exists())
+
+
+class TestBuildBrowseCandidatePoolsTask(TestCase):
+    @override_settings(BROWSE_USE_CANDIDATE_POOLS=True)
+    @mock.patch('tunes.tasks.BrowseCandidatePoolManager.build_pools')
+    def test_task_builds_candidate_pools(self, mock_build_pools):
+        mock_build_pools.return_value = 12
+
+        BuildBrowseCandidatePoolsTask().run()
+
+        mock_build_pools.assert_called_once_with()
+
+    @override_settings(BROWSE_USE_CANDIDATE_POOLS=False)
+    @mock.patch('tunes.tasks.BrowseCandidatePoolManager.build_pools')
+    def test_task_does_nothing_if_candidate_pools_are_disabled(self, mock_build_pools):
+        BuildBrowseCandidatePoolsTask().run()
+
+        mock_build_pools.assert_not_called()
@@ -2,13 +2,30 @@ import random
 import string
 from unittest import mock
 
+import numpy as np
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from accounts.models import UserSongVote
+from accounts.utils import get_vote_version, update_vote_version
 from libs.tests.helpers import MoodyUtil
+from tunes.feature_index import SongFeatureIndex
 from tunes.models import Emotion, Song
-from tunes.utils import CachedPlaylistManager, filter_duplicate_votes_on_song_from_playlist, generate_browse_playlist
+from tunes.utils import (
+    BrowseCandidatePoolManager,
+    CachedPlaylistManager,
+    VotedSongIdsManager,
+    filter_duplicate_votes_on_song_from_playlist,
+    generate_browse_playlist,
+    generate_nearest_browse_playlist,
+    get_genres,
+    order_votes_by_newest,
+    sample_songs,
+    sample_songs_from_feature_index,
+)
 
 
 class TestGenerateBrowsePlaylist(TestCase):
@@ -208,6 +225,343 @@ class TestGenerateBrowsePlaylist(TestCase):
         self.assertEqual(len(playlist), limit)
         self.assertIn(top_artist_song, playlist)
 
+    def test_genre_passed_only_returns_songs_from_genre(self):
+        song = MoodyUtil.create_song(genre='hiphop')
+        MoodyUtil.create_song(genre='rock')
+
+        playlist = generate_browse_playlist(song.energy, song.valence, song.danceability, genre='hiphop')
+
+        self.assertListEqual(list(playlist), [song])
+
+    @override_settings(BROWSE_USE_SONG_FEATURE_INDEX=True)
+    @mock.patch('tunes.utils.sample_songs_from_feature_index')
+    def test_feature_index_setting_samples_songs_from_feature_index(self, mock_sample_songs_from_feature_index):
+        energy = valence = danceability = .5
+        jitter = .1
+
+        generate_browse_playlist(energy, valence, danceability, jitter=jitter, limit=5, genre='hiphop')
+
+        _, ranges, limit = mock_sample_songs_from_feature_index.call_args[0]
+        self.assertDictEqual(ranges, {
+            'energy': (energy - jitter, energy + jitter),
+            'valence': (valence - jitter, valence + jitter),
+            'danceability': (danceability - jitter, danceability + jitter),
+        })
+        self.assertEqual(limit, 5)
+        self.assertEqual(mock_sample_songs_from_feature_index.call_args[1]['genre'], 'hiphop')
+
+    @override_settings(BROWSE_USE_SONG_FEATURE_INDEX=True)
+    @mock.patch('tunes.utils.sample_songs_from_feature_index')
+    def test_feature_index_setting_with_artist_does_not_use_feature_index(self, mock_sample_songs_from_feature_index):
+        generate_browse_playlist(.5, .5, .5, limit=5, artist='Madlib')
+
+        mock_sample_songs_from_feature_index.assert_not_called()
+
+
+class TestGenerateBrowsePlaylistQueries(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.top_artists = ['Madlib', 'MF DOOM']
+        cls.song_params = {'energy': .5, 'valence': .75, 'danceability': .65}
+
+        cls.top_artist_songs = [
+            MoodyUtil.create_song(artist=artist, **cls.song_params) for artist in cls.top_artists
+        ]
+
+        for _ in range(10):
+            MoodyUtil.create_song(artist='Bum', **cls.song_params)
+
+    def generate_top_artists_playlist(self, top_artists, limit=None):
+        return list(generate_browse_playlist(
+            self.song_params['energy'],
+            self.song_params['valence'],
+            self.song_params['danceability'],
+            jitter=0,
+            top_artists=top_artists,
+            limit=limit
+        ))
+
+    def test_top_artists_playlist_with_backfill_is_generated_in_one_query(self):
+        with self.assertNumQueries(1):
+            playlist = self.generate_top_artists_playlist(self.top_artists, limit=5)
+
+        self.assertEqual(len(playlist), 5)
+        self.assertCountEqual(playlist[:2], self.top_artist_songs)
+
+    def test_top_artists_playlist_with_enough_top_artist_songs_does_not_backfill(self):
+        with self.assertNumQueries(1):
+            playlist = self.generate_top_artists_playlist(self.top_artists, limit=2)
+
+        self.assertCountEqual(playlist, self.top_artist_songs)
+
+    def test_top_artists_playlist_does_not_sort_every_song_randomly(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.generate_top_artists_playlist(self.top_artists, limit=5)
+
+        self.assertNotIn('RANDOM()', queries[0]['sql'].upper())
+
+    def test_top_artists_playlist_leaves_out_excluded_songs(self):
+        excluded_song = self.top_artist_songs[0]
+
+        with self.assertNumQueries(1):
+            playlist = list(generate_browse_playlist(
+                self.song_params['energy'],
+                self.song_params['valence'],
+                self.song_params['danceability'],
+                jitter=0,
+                top_artists=self.top_artists,
+                limit=5,
+                exclude_song_ids=np.array([excluded_song.pk])
+            ))
+
+        self.assertEqual(len(playlist), 5)
+        self.assertEqual(playlist[0], self.top_artist_songs[1])
+        self.assertNotIn(excluded_song, playlist)
+
+    def test_top_artists_playlist_without_limit_is_generated_in_one_query(self):
+        with self.assertNumQueries(1):
+            playlist = self.generate_top_artists_playlist(self.top_artists)
+
+        self.assertCountEqual(playlist, self.top_artist_songs)
+
+    def test_top_artists_playlist_without_matches_is_generated_in_one_query(self):
+        with self.assertNumQueries(1):
+            playlist = self.generate_top_artists_playlist(['Surf Curse'], limit=5)
+
+        self.assertEqual(len(playlist), 5)
+
+    def test_top_artists_playlist_without_matches_or_limit_is_generated_in_one_query(self):
+        with self.assertNumQueries(1):
+            playlist = self.generate_top_artists_playlist(['Surf Curse'])
+
+        self.assertEqual(len(playlist), 12)
+
+    def explain_without_seqscan(self, playlist):
+        # The test tables are too small for the planner to pick an index on its own
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        return playlist.explain()
+
+    def test_playlist_for_all_attributes_can_use_index(self):
+        playlist = generate_browse_playlist(**self.song_params, jitter=.05)
+
+        self.assertNotIn('Seq Scan', self.explain_without_seqscan(playlist))
+
+    def test_playlist_for_strategy_can_use_index_for_strategy_attribute(self):
+        expected_indexes = {
+            'energy': 'song_energy_idx',
+            'valence': 'song_features_idx',
+            'danceability': 'song_danceability_idx',
+        }
+
+        for strategy, index_name in expected_indexes.items():
+            playlist = generate_browse_playlist(**self.song_params, strategy=strategy, jitter=.05)
+
+            self.assertIn(index_name, self.explain_without_seqscan(playlist))
+
+
+class TestGenerateNearestBrowsePlaylist(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.closest_song = MoodyUtil.create_song(energy=.5, valence=.5, danceability=.5)
+        cls.next_closest_song = MoodyUtil.create_song(energy=.5, valence=.6, danceability=.5)
+
+    def setUp(self):
+        self.song_feature_index = SongFeatureIndex()
+        self.song_feature_index.refresh()
+
+        patcher = mock.patch('tunes.utils.get_song_feature_index', return_value=self.song_feature_index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_returns_songs_ordered_by_distance(self):
+        playlist = generate_nearest_browse_playlist(.5, .5, .5, 2)
+
+        self.assertListEqual(playlist, [self.closest_song, self.next_closest_song])
+
+    def test_excluded_songs_are_not_returned(self):
+        playlist = generate_nearest_browse_playlist(.5, .5, .5, 1, exclude_song_ids=[self.closest_song.pk])
+
+        self.assertListEqual(playlist, [self.next_closest_song])
+
+    def test_songs_are_fetched_from_songs_queryset(self):
+        songs = Song.objects.exclude(pk=self.next_closest_song.pk)
+
+        playlist = generate_nearest_browse_playlist(.5, .5, .5, 2, songs=songs)
+
+        self.assertListEqual(playlist, [self.closest_song])
+
+    @override_settings(SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE=1)
+    def test_songs_are_sampled_from_database_past_max_query_size(self):
+        song_in_jitter_box = MoodyUtil.create_song(energy=.52, valence=.52, danceability=.52)
+        self.song_feature_index.refresh(force=True)
+
+        with mock.patch('tunes.utils.sample_songs', wraps=sample_songs) as mock_sample_songs:
+            playlist = generate_nearest_browse_playlist(
+                .5,
+                .5,
+                .5,
+                1,
+                exclude_song_ids=np.array([self.closest_song.pk])
+            )
+
+        # The next closest song is outside of the default jitter around the attributes
+        mock_sample_songs.assert_called_once()
+        self.assertListEqual(playlist, [song_in_jitter_box])
+
+
+class TestSampleSongsFromFeatureIndex(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.songs = [MoodyUtil.create_song(energy=.5, valence=.5, danceability=.5) for _ in range(10)]
+        cls.other_song = MoodyUtil.create_song(energy=.9, valence=.9, danceability=.9)
+        cls.ranges = {'energy': (.4, .6), 'valence': (.4, .6), 'danceability': (.4, .6)}
+
+    def setUp(self):
+        self.song_feature_index = SongFeatureIndex()
+        self.song_feature_index.refresh()
+
+    def test_returns_songs_matching_ranges_up_to_limit(self):
+        playlist = sample_songs_from_feature_index(
+            Song.objects.all(),
+            self.ranges,
+            5,
+            song_feature_index=self.song_feature_index
+        )
+
+        self.assertEqual(len(playlist), 5)
+        self.assertEqual(len(set(playlist)), 5)
+        self.assertNotIn(self.other_song, playlist)
+
+    @override_settings(SONG_FEATURE_INDEX_FETCH_BATCH_SIZE=1)
+    def test_applies_filters_on_songs_queryset(self):
+        excluded_song_ids = [song.pk for song in self.songs[:8]]
+
+        playlist = sample_songs_from_feature_index(
+            Song.objects.exclude(pk__in=excluded_song_ids),
+            self.ranges,
+            5,
+            song_feature_index=self.song_feature_index
+        )
+
+        self.assertCountEqual(playlist, self.songs[8:])
+
+    def test_leaves_out_excluded_songs(self):
+        exclude_song_ids = np.array(sorted(song.pk for song in self.songs[:8]), dtype=np.int32)
+
+        playlist = sample_songs_from_feature_index(
+            Song.objects.all(),
+            self.ranges,
+            5,
+            song_feature_index=self.song_feature_index,
+            exclude_song_ids=exclude_song_ids
+        )
+
+        self.assertCountEqual(playlist, self.songs[8:])
+
+    @mock.patch('tunes.utils.get_song_feature_index')
+    def test_uses_song_feature_index_for_process_by_default(self, mock_get_song_feature_index):
+        mock_get_song_feature_index.return_value = self.song_feature_index
+
+        playlist = sample_songs_from_feature_index(Song.objects.all(), self.ranges, 5)
+
+        mock_get_song_feature_index.assert_called_once_with()
+        self.assertEqual(len(playlist), 5)
+
+
+class TestSampleSongs(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for _ in range(10):
+            MoodyUtil.create_song()
+
+    def test_random_method_returns_songs_up_to_limit(self):
+        playlist = sample_songs(Song.objects.all(), 5, method='random')
+
+        self.assertEqual(len(playlist), 5)
+
+    def test_random_key_method_returns_songs_up_to_limit(self):
+        playlist = sample_songs(Song.objects.all(), 5, method='random_key')
+
+        self.assertEqual(len(playlist), 5)
+        self.assertEqual(len(set(song.pk for song in playlist)), 5)
+
+    @mock.patch('tunes.utils.random.random')
+    def test_random_key_method_wraps_around_key_space(self, mock_random):
+        mock_random.return_value = .5
+        Song.objects.filter(pk__in=Song.objects.all().values('pk')[:3]).update(random_key=.75)
+        Song.objects.exclude(random_key=.75).update(random_key=.25)
+
+        playlist = sample_songs(Song.objects.all(), 5, method='random_key')
+        random_keys = [song.random_key for song in playlist]
+
+        self.assertListEqual(random_keys, [.75, .75, .75, .25, .25])
+
+    def test_random_key_method_returns_all_songs_if_fewer_than_limit(self):
+        playlist = sample_songs(Song.objects.all(), 25, method='random_key')
+
+        self.assertEqual(len(playlist), Song.objects.count())
+
+    def test_tablesample_method_returns_songs_up_to_limit(self):
+        playlist = sample_songs(Song.objects.all(), 5, method='tablesample')
+
+        self.assertEqual(len(playlist), 5)
+
+    def test_no_limit_returns_all_songs(self):
+        playlist = sample_songs(Song.objects.all(), method='random_key')
+
+        self.assertEqual(len(playlist), Song.objects.count())
+
+    @override_settings(BROWSE_PLAYLIST_SAMPLING_METHOD='random')
+    def test_uses_sampling_method_from_settings(self):
+        playlist = sample_songs(Song.objects.all(), 5)
+
+        self.assertIn('RANDOM()', str(playlist.query))
+
+    def test_invalid_method_raises_exception(self):
+        with self.assertRaises(ValueError):
+            sample_songs(Song.objects.all(), 5, method='invalid')
+
+    def test_each_method_leaves_out_excluded_songs_in_query(self):
+        song_ids = sorted(Song.objects.values_list('pk', flat=True))
+        exclude_song_ids = np.array(song_ids[:7], dtype=np.int32)
+
+        for method in settings.BROWSE_PLAYLIST_SAMPLING_METHODS:
+            with CaptureQueriesContext(connection) as queries:
+                playlist = sample_songs(Song.objects.all(), 5, method=method, exclude_song_ids=exclude_song_ids)
+
+            self.assertCountEqual([song.pk for song in playlist], song_ids[7:])
+
+            # Excluded songs are left out by the database, so we never ask for more songs than the limit
+            for query in queries:
+                self.assertIn('NOT', query['sql'])
+                self.assertRegex(query['sql'], r'LIMIT [1-5]$')
+
+    def test_random_key_method_with_excluded_songs_fetches_songs_in_one_query(self):
+        songs = list(Song.objects.order_by('random_key'))
+        exclude_song_ids = np.array(sorted(song.pk for song in songs[:8]), dtype=np.int32)
+
+        with mock.patch('tunes.utils.random.random', return_value=0):
+            with self.assertNumQueries(1):
+                sample_songs(Song.objects.all(), 2, method='random_key', exclude_song_ids=exclude_song_ids)
+
+    def test_random_key_method_walks_past_excluded_songs(self):
+        songs = list(Song.objects.order_by('random_key'))
+        exclude_song_ids = np.array(sorted(song.pk for song in songs[:8]), dtype=np.int32)
+
+        with mock.patch('tunes.utils.random.random', return_value=0):
+            playlist = sample_songs(Song.objects.all(), 2, method='random_key', exclude_song_ids=exclude_song_ids)
+
+        self.assertListEqual(playlist, songs[8:])
+
+    def test_no_limit_leaves_out_excluded_songs(self):
+        song_ids = sorted(Song.objects.values_list('pk', flat=True))
+
+        playlist = sample_songs(Song.objects.all(), exclude_song_ids=np.array(song_ids[:3], dtype=np.int32))
+
+        self.assertCountEqual([song.pk for song in playlist], song_ids[3:])
+
 
 class TestCachedPlaylistManager(TestCase):
     @classmethod
@@ -221,26 +575,76 @@ class TestCachedPlaylistManager(TestCase):
 
     @mock.patch('tunes.utils.cache')
     def test_cache_browse_playlist_calls_cache_with_expected_arguments(self, mock_cache):
-        MoodyUtil.create_song()
+        song = MoodyUtil.create_song()
+        other_song = MoodyUtil.create_song()
         data = {
             'emotion': 'HPY',
             'context': 'WORK',
             'description': '',
-            'playlist': Song.objects.all()
+            'playlist': Song.objects.filter(pk__in=[song.pk, other_song.pk]).order_by('-pk')
         }
         cache_key = 'browse:cached-playlist:{}'.format(self.user.username)
+        expected_cache_data = {
+            'version': CachedPlaylistManager.CACHE_FORMAT_VERSION,
+            'emotion': 'HPY',
+            'context': 'WORK',
+            'description': '',
+            'song_ids': np.array([other_song.pk, song.pk], dtype=np.int32).tobytes(),
+        }
+
         self.manager.cache_browse_playlist(**data)
 
-        mock_cache.set.assert_called_once_with(cache_key, data, settings.BROWSE_PLAYLIST_CACHE_TIMEOUT)
+        mock_cache.set.assert_called_once_with(cache_key, expected_cache_data, settings.BROWSE_PLAYLIST_CACHE_TIMEOUT)
 
-    @mock.patch('tunes.utils.cache')
-    def test_retrieve_cached_playlist_returns_cached_playlist(self, mock_cache):
+    def test_cache_browse_playlist_caches_songs_returned_from_playlist(self):
+        MoodyUtil.create_song()
         MoodyUtil.create_song()
-        playlist = Song.objects.all()
-        mock_cache.get.return_value = playlist
+        playlist = Song.objects.order_by('?')
+
+        cache_data = self.manager.build_cache_data(playlist, 'HPY', '', '')
+
+        self.assertEqual(
+            np.frombuffer(cache_data['song_ids'], dtype=np.int32).tolist(),
+            [song.pk for song in playlist]
+        )
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_retrieve_cached_playlist_returns_cached_playlist(self):
+        song = MoodyUtil.create_song()
+        other_song = MoodyUtil.create_song()
+        self.manager.cache_browse_playlist(
+            Song.objects.filter(pk__in=[song.pk, other_song.pk]).order_by('-pk'),
+            'HPY',
+            'WORK',
+            'Working on stuff'
+        )
 
         returned_playlist = self.manager.retrieve_cached_browse_playlist()
-        self.assertEqual(playlist, returned_playlist)
+
+        self.assertDictEqual(
+            returned_playlist,
+            {
+                'emotion': 'HPY',
+                'context': 'WORK',
+                'description': 'Working on stuff',
+                'song_ids': [other_song.pk, song.pk],
+            }
+        )
+
+    @mock.patch('tunes.utils.cache')
+    def test_retrieve_cached_playlist_reads_legacy_cached_playlist(self, mock_cache):
+        song = MoodyUtil.create_song()
+        mock_cache.get.return_value = {
+            'emotion': 'HPY',
+            'context': 'WORK',
+            'description': '',
+            'playlist': [song]
+        }
+
+        returned_playlist = self.manager.retrieve_cached_browse_playlist()
+
+        self.assertEqual(returned_playlist['song_ids'], [song.pk])
+        self.assertEqual(returned_playlist['context'], 'WORK')
 
     @mock.patch('tunes.utils.cache')
     def test_retrieve_cached_playlist_returns_None_if_no_playlist_cached(self, mock_cache):
@@ -249,6 +653,252 @@ class TestCachedPlaylistManager(TestCase):
         returned_playlist = self.manager.retrieve_cached_browse_playlist()
         self.assertIsNone(returned_playlist)
 
+    def test_get_playlist_songs_returns_songs_in_playlist_order_with_one_query(self):
+        song = MoodyUtil.create_song()
+        other_song = MoodyUtil.create_song()
+
+        with self.assertNumQueries(1):
+            songs = self.manager.get_playlist_songs([other_song.pk, song.pk])
+
+        self.assertEqual(songs, [other_song, song])
+
+    def test_get_playlist_songs_skips_deleted_songs(self):
+        song = MoodyUtil.create_song()
+
+        songs = self.manager.get_playlist_songs([song.pk, song.pk + 1000])
+
+        self.assertEqual(songs, [song])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestBrowseCandidatePoolManager(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        cls.song_params = {
+            'energy': cls.emotion.energy,
+            'valence': cls.emotion.valence,
+            'danceability': cls.emotion.danceability,
+        }
+        cls.rock_songs = [MoodyUtil.create_song(genre='rock', **cls.song_params) for _ in range(3)]
+        cls.pop_songs = [MoodyUtil.create_song(genre='pop', **cls.song_params) for _ in range(3)]
+        cls.outlier_song = MoodyUtil.create_song(genre='rock', energy=.05, valence=.05, danceability=.05)
+
+    def setUp(self):
+        cache.clear()
+        self.manager = BrowseCandidatePoolManager()
+
+    def test_make_cache_key_returns_expected_cache_key(self):
+        self.assertEqual(
+            self.manager._make_cache_key(Emotion.HAPPY, 'energy'),
+            'browse:candidate-pool:{}:energy:*'.format(Emotion.HAPPY)
+        )
+        self.assertEqual(
+            self.manager._make_cache_key(Emotion.HAPPY, 'energy', 'rock'),
+            'browse:candidate-pool:{}:energy:rock'.format(Emotion.HAPPY)
+        )
+
+    def test_is_near_emotion_for_attributes_within_threshold(self):
+        threshold = settings.BROWSE_CANDIDATE_POOL_DRIFT_THRESHOLD
+
+        self.assertTrue(BrowseCandidatePoolManager.is_near_emotion(
+            self.emotion,
+            self.emotion.energy + threshold / 2,
+            self.emotion.valence - threshold / 2,
+            self.emotion.danceability
+        ))
+        self.assertFalse(BrowseCandidatePoolManager.is_near_emotion(
+            self.emotion,
+            self.emotion.energy,
+            self.emotion.valence + threshold * 2,
+            self.emotion.danceability
+        ))
+
+    def test_build_pool_returns_song_ids_in_browse_range(self):
+        song_ids = self.manager.build_pool(self.emotion, 'energy')
+
+        self.assertCountEqual(song_ids.tolist(), [song.pk for song in self.rock_songs + self.pop_songs])
+
+    def test_build_pool_filters_by_genre(self):
+        song_ids = self.manager.build_pool(self.emotion, 'energy', genre='rock')
+
+        self.assertCountEqual(song_ids.tolist(), [song.pk for song in self.rock_songs])
+
+    @override_settings(BROWSE_CANDIDATE_POOL_SIZE=2)
+    def test_build_pool_limits_pool_size(self):
+        song_ids = self.manager.build_pool(self.emotion, 'energy')
+
+        self.assertEqual(len(song_ids), 2)
+
+    def test_build_pools_caches_pool_for_every_emotion_strategy_and_genre(self):
+        pool_count = self.manager.build_pools()
+
+        expected_pool_count = Emotion.objects.count() * len(settings.BROWSE_PLAYLIST_STRATEGIES) * 3
+
+        self.assertEqual(pool_count, expected_pool_count)
+        self.assertIsNotNone(cache.get(self.manager._make_cache_key(Emotion.HAPPY, 'valence', 'pop')))
+
+    def test_get_playlist_returns_songs_from_pool(self):
+        self.manager.build_pools()
+
+        playlist = self.manager.get_playlist(Emotion.HAPPY, 'energy', 2, genre='rock')
+
+        self.assertEqual(len(playlist), 2)
+        self.assertTrue(set(playlist).issubset(self.rock_songs))
+
+    def test_get_playlist_leaves_out_excluded_songs(self):
+        self.manager.build_pools()
+        exclude_song_ids = np.array([song.pk for song in self.rock_songs[:2]], dtype=np.int32)
+
+        playlist = self.manager.get_playlist(
+            Emotion.HAPPY,
+            'energy',
+            1,
+            genre='rock',
+            exclude_song_ids=exclude_song_ids
+        )
+
+        self.assertEqual(playlist, [self.rock_songs[2]])
+
+    def test_get_playlist_returns_none_if_pool_does_not_have_enough_songs(self):
+        self.manager.build_pools()
+
+        self.assertIsNone(self.manager.get_playlist(Emotion.HAPPY, 'energy', 4, genre='rock'))
+
+    def test_get_playlist_returns_none_if_pool_is_not_cached(self):
+        self.assertIsNone(self.manager.get_playlist(Emotion.HAPPY, 'energy', 1))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestVotedSongIdsManager(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MoodyUtil.create_user()
+        cls.emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        cls.work_song = MoodyUtil.create_song()
+        cls.party_song = MoodyUtil.create_song()
+
+        MoodyUtil.create_user_song_vote(cls.user, cls.work_song, cls.emotion, True, context='WORK')
+        MoodyUtil.create_user_song_vote(cls.user, cls.party_song, cls.emotion, False, context='PARTY')
+
+    def setUp(self):
+        cache.clear()
+        self.manager = VotedSongIdsManager(self.user)
+
+    def test_make_cache_key_returns_expected_cache_key(self):
+        self.assertEqual(
+            self.manager._make_cache_key(Emotion.HAPPY, 'WORK'),
+            'browse:voted-song-ids:{}:{}:WORK'.format(self.user.pk, Emotion.HAPPY)
+        )
+        self.assertEqual(
+            self.manager._make_cache_key(Emotion.HAPPY),
+            'browse:voted-song-ids:{}:{}:*'.format(self.user.pk, Emotion.HAPPY)
+        )
+
+    def test_get_voted_song_ids_returns_sorted_ids_for_all_contexts(self):
+        song_ids = self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        self.assertListEqual(song_ids.tolist(), sorted([self.work_song.pk, self.party_song.pk]))
+
+    def test_get_voted_song_ids_for_context_only_returns_votes_for_context(self):
+        song_ids = self.manager.get_voted_song_ids(Emotion.HAPPY, 'WORK')
+
+        self.assertListEqual(song_ids.tolist(), [self.work_song.pk])
+
+    def test_get_voted_song_ids_for_different_emotion_returns_empty_array(self):
+        song_ids = self.manager.get_voted_song_ids(Emotion.MELANCHOLY)
+
+        self.assertEqual(len(song_ids), 0)
+
+    def test_get_voted_song_ids_uses_cached_song_ids(self):
+        self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        with self.assertNumQueries(0):
+            song_ids = self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        self.assertListEqual(song_ids.tolist(), sorted([self.work_song.pk, self.party_song.pk]))
+
+    def test_get_voted_song_ids_loads_song_ids_again_after_vote(self):
+        new_song = MoodyUtil.create_song()
+        self.manager.get_voted_song_ids(Emotion.HAPPY)
+        self.manager.get_voted_song_ids(Emotion.HAPPY, 'PARTY')
+
+        MoodyUtil.create_user_song_vote(self.user, new_song, self.emotion, True, context='WORK')
+
+        self.assertIn(new_song.pk, self.manager.get_voted_song_ids(Emotion.HAPPY).tolist())
+        self.assertNotIn(new_song.pk, self.manager.get_voted_song_ids(Emotion.HAPPY, 'PARTY').tolist())
+
+    def test_song_ids_loaded_before_concurrent_vote_are_not_used(self):
+        new_song = MoodyUtil.create_song()
+        load_voted_song_ids = self.manager._load_voted_song_ids
+
+        def load_then_vote(*args, **kwargs):
+            # Simulate a vote saved by another request after the song ids were loaded from the database
+            song_ids = load_voted_song_ids(*args, **kwargs)
+            MoodyUtil.create_user_song_vote(self.user, new_song, self.emotion, True)
+
+            return song_ids
+
+        with mock.patch.object(self.manager, '_load_voted_song_ids', side_effect=load_then_vote):
+            song_ids = self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        self.assertNotIn(new_song.pk, song_ids.tolist())
+        self.assertIn(new_song.pk, self.manager.get_voted_song_ids(Emotion.HAPPY).tolist())
+
+    def test_get_voted_song_ids_does_not_overwrite_song_ids_cached_for_current_version(self):
+        self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        with mock.patch('tunes.utils.cache.set') as mock_cache_set:
+            self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        mock_cache_set.assert_not_called()
+
+    def test_add_voted_song_ids_adds_songs_to_song_ids_cached_for_previous_version(self):
+        new_song = MoodyUtil.create_song()
+        self.manager.get_voted_song_ids(Emotion.HAPPY)
+        self.manager.get_voted_song_ids(Emotion.HAPPY, 'WORK')
+        self.manager.get_voted_song_ids(Emotion.HAPPY, 'PARTY')
+
+        version = update_vote_version(self.user.pk, self.emotion.pk)
+        self.manager.add_voted_song_ids(Emotion.HAPPY, {'WORK': [new_song.pk]}, version)
+
+        with self.assertNumQueries(0):
+            self.assertListEqual(
+                self.manager.get_voted_song_ids(Emotion.HAPPY).tolist(),
+                sorted([self.work_song.pk, self.party_song.pk, new_song.pk])
+            )
+            self.assertListEqual(
+                self.manager.get_voted_song_ids(Emotion.HAPPY, 'WORK').tolist(),
+                sorted([self.work_song.pk, new_song.pk])
+            )
+
+        # Song ids for other contexts are left for the current version, so they are loaded again
+        self.assertListEqual(self.manager.get_voted_song_ids(Emotion.HAPPY, 'PARTY').tolist(), [self.party_song.pk])
+
+    def test_add_voted_song_ids_skips_song_ids_that_missed_a_vote(self):
+        new_song = MoodyUtil.create_song()
+        missed_song = MoodyUtil.create_song()
+        self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        # Simulate a vote saved by another request, that did not add its song to the cached song ids
+        MoodyUtil.create_user_song_vote(self.user, missed_song, self.emotion, True)
+        MoodyUtil.create_user_song_vote(self.user, new_song, self.emotion, True)
+        version = get_vote_version(self.user.pk, self.emotion.pk)
+        self.manager.add_voted_song_ids(Emotion.HAPPY, {'': [new_song.pk]}, version)
+
+        self.assertListEqual(
+            self.manager.get_voted_song_ids(Emotion.HAPPY).tolist(),
+            sorted([self.work_song.pk, self.party_song.pk, missed_song.pk, new_song.pk])
+        )
+
+    def test_add_voted_song_ids_without_version_does_nothing(self):
+        self.manager.get_voted_song_ids(Emotion.HAPPY)
+
+        with mock.patch('tunes.utils.cache.set_many') as mock_cache_set_many:
+            self.manager.add_voted_song_ids(Emotion.HAPPY, {'': [self.work_song.pk]}, None)
+
+        mock_cache_set_many.assert_not_called()
+
 
 class TestFilterDuplicateVotesOnSongs(TestCase):
     @classmethod
@@ -276,8 +926,102 @@ class TestFilterDuplicateVotesOnSongs(TestCase):
 
         self.assertEqual(filtered_votes.count(), 2)
 
+    def test_filter_keeps_most_recent_vote_for_song(self):
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+        latest_vote = MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True, 'WORK')
+
+        user_votes = UserSongVote.objects.filter(user=self.user, emotion=self.emotion)
+        filtered_votes = filter_duplicate_votes_on_song_from_playlist(user_votes)
+
+        self.assertEqual(list(filtered_votes), [latest_vote])
+
+    def test_filter_only_joins_song_table_to_load_songs(self):
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+
+        user_votes = UserSongVote.objects.filter(user=self.user, emotion=self.emotion)
+        plan = filter_duplicate_votes_on_song_from_playlist(user_votes).explain()
+
+        song_scans = [line for line in plan.splitlines() if ' on {}'.format(Song._meta.db_table) in line]
+
+        self.assertEqual(len(song_scans), 1)
+
     def test_filter_passed_no_votes_returns_empty_queryset(self):
         user_votes = UserSongVote.objects.filter(user=self.user, emotion=self.emotion)
         filtered_votes = filter_duplicate_votes_on_song_from_playlist(user_votes)
 
         self.assertEqual(filtered_votes.count(), 0)
+
+    def test_filter_loads_votes_and_songs_in_one_pass_over_votes(self):
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True, context='WORK')
+
+        user_votes = UserSongVote.objects.filter(user=self.user, emotion=self.emotion)
+        filtered_votes = filter_duplicate_votes_on_song_from_playlist(user_votes)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(filtered_votes)[0].song, self.song)
+
+        plan = filtered_votes.explain()
+        vote_scans = [line for line in plan.splitlines() if ' on {}'.format(UserSongVote._meta.db_table) in line]
+
+        self.assertEqual(len(vote_scans), 1)
+        self.assertIn('Unique', plan)
+
+
+class TestOrderVotesByNewest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MoodyUtil.create_user()
+        cls.emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        cls.song = MoodyUtil.create_song()
+        cls.other_song = MoodyUtil.create_song()
+
+    def setUp(self):
+        self.oldest_vote = MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+        self.other_song_vote = MoodyUtil.create_user_song_vote(self.user, self.other_song, self.emotion, True)
+        self.latest_vote = MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True, 'WORK')
+
+        user_votes = UserSongVote.objects.filter(user=self.user, emotion=self.emotion)
+        self.playlist = order_votes_by_newest(filter_duplicate_votes_on_song_from_playlist(user_votes))
+
+    def test_orders_deduplicated_votes_newest_first(self):
+        with self.assertNumQueries(1):
+            playlist = list(self.playlist)
+
+        self.assertListEqual(playlist, [self.latest_vote, self.other_song_vote])
+
+    def test_filters_apply_after_votes_are_deduplicated(self):
+        # Paging past the latest vote for a song does not bring back an older vote for the song
+        playlist = self.playlist.filter(created__lt=self.latest_vote.created)
+
+        self.assertListEqual(list(playlist), [self.other_song_vote])
+        self.assertEqual(playlist.count(), 1)
+
+    def test_orders_votes_without_scanning_votes_again(self):
+        plan = self.playlist.explain()
+        vote_scans = [line for line in plan.splitlines() if ' on {}'.format(UserSongVote._meta.db_table) in line]
+
+        self.assertEqual(len(vote_scans), 1)
+        self.assertIn('Unique', plan)
+        self.assertNotIn('Semi Join', plan)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestGetGenres(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_returns_genres_ordered_by_name(self):
+        MoodyUtil.create_song(genre='rock')
+        MoodyUtil.create_song(genre='hiphop')
+
+        self.assertEqual(get_genres(), ['hiphop', 'rock'])
+
+    def test_genres_are_cached(self):
+        MoodyUtil.create_song(genre='rock')
+        get_genres()
+
+        with self.assertNumQueries(0):
+            genres = get_genres()
+
+        self.assertEqual(genres, ['rock'])
@@ -2,15 +2,24 @@ import random
 import string
 from unittest import mock
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from accounts.models import UserSongVote
+from accounts.utils import get_vote_version
 from libs.tests.helpers import MoodyUtil
 from libs.utils import average
 from spotify.models import SpotifyUserData
+from tunes.emotion_registry import get_emotion_registry
+from tunes.feature_index import SongFeatureIndex
 from tunes.models import Emotion, Song
+from tunes.utils import CachedPlaylistManager, VotedSongIdsManager
 from tunes.views import BrowseView
 
 
@@ -160,6 +169,63 @@ class TestBrowseView(APITestCase):
 
         self.assertListEqual(called_top_artists, top_artists)
 
+    @override_settings(BROWSE_USE_CANDIDATE_POOLS=True)
+    @mock.patch('tunes.views.generate_browse_playlist')
+    @mock.patch('tunes.views.BrowseCandidatePoolManager.get_playlist')
+    def test_browse_for_user_near_emotion_defaults_uses_candidate_pool(self, mock_get_playlist, mock_generate_playlist):
+        song = MoodyUtil.create_song()
+        mock_get_playlist.return_value = [song]
+
+        params = {'emotion': Emotion.HAPPY}
+        resp = self.client.get(self.url, data=params)
+        resp_data = resp.json()['results']
+
+        mock_generate_playlist.assert_not_called()
+        self.assertEqual(mock_get_playlist.mock_calls[0][1][0], Emotion.HAPPY)
+        self.assertEqual(resp_data[0]['code'], song.code)
+
+    @override_settings(BROWSE_USE_CANDIDATE_POOLS=True)
+    @mock.patch('tunes.views.generate_browse_playlist')
+    @mock.patch('tunes.views.BrowseCandidatePoolManager.get_playlist')
+    def test_browse_for_user_drifted_from_emotion_defaults_uses_live_query(
+            self,
+            mock_get_playlist,
+            mock_generate_playlist
+    ):
+        user_emotion = self.user.get_user_emotion_record(Emotion.HAPPY)
+        user_emotion.energy += settings.BROWSE_CANDIDATE_POOL_DRIFT_THRESHOLD * 2
+        user_emotion.save()
+        mock_generate_playlist.return_value = []
+
+        params = {'emotion': Emotion.HAPPY}
+        self.client.get(self.url, data=params)
+
+        mock_get_playlist.assert_not_called()
+        mock_generate_playlist.assert_called_once()
+
+    @override_settings(BROWSE_USE_CANDIDATE_POOLS=True)
+    @mock.patch('tunes.views.generate_browse_playlist')
+    @mock.patch('tunes.views.BrowseCandidatePoolManager.get_playlist')
+    def test_browse_uses_live_query_if_candidate_pool_is_unavailable(self, mock_get_playlist, mock_generate_playlist):
+        mock_get_playlist.return_value = None
+        mock_generate_playlist.return_value = []
+
+        params = {'emotion': Emotion.HAPPY}
+        self.client.get(self.url, data=params)
+
+        mock_generate_playlist.assert_called_once()
+
+    @override_settings(BROWSE_USE_CANDIDATE_POOLS=True)
+    @mock.patch('tunes.views.generate_browse_playlist')
+    @mock.patch('tunes.views.BrowseCandidatePoolManager.get_playlist')
+    def test_browse_with_custom_jitter_uses_live_query(self, mock_get_playlist, mock_generate_playlist):
+        mock_generate_playlist.return_value = []
+
+        params = {'emotion': Emotion.HAPPY, 'jitter': .2}
+        self.client.get(self.url, data=params)
+
+        mock_get_playlist.assert_not_called()
+
     def test_playlist_excludes_previously_voted_songs(self):
         voted_song = MoodyUtil.create_song()
         not_voted_song = MoodyUtil.create_song()
@@ -183,6 +249,105 @@ class TestBrowseView(APITestCase):
         self.assertEqual(len(resp_data), 1)
         self.assertEqual(resp_data[0]['code'], not_voted_song.code)
 
+    def test_playlist_query_leaves_out_previously_voted_songs(self):
+        voted_song = MoodyUtil.create_song()
+        MoodyUtil.create_song()
+        MoodyUtil.create_user_song_vote(self.user, voted_song, Emotion.objects.get(name=Emotion.HAPPY), True)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, data={'emotion': Emotion.HAPPY, 'jitter': 0})
+
+        song_queries = [query['sql'] for query in queries if 'FROM "{}"'.format(Song._meta.db_table) in query['sql']]
+
+        self.assertTrue(song_queries)
+        for sql in song_queries:
+            self.assertIn('NOT', sql)
+
+    def test_invalid_mode_passed_returns_bad_request(self):
+        params = {'emotion': Emotion.HAPPY, 'mode': 'invalid-mode'}
+        resp = self.client.get(self.url, data=params)
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_nearest_mode_with_artist_returns_bad_request(self):
+        params = {'emotion': Emotion.HAPPY, 'mode': 'nearest', 'artist': 'Madlib'}
+        resp = self.client.get(self.url, data=params)
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch('tunes.utils.get_song_feature_index')
+    def test_nearest_mode_returns_closest_songs_not_voted_on(self, mock_get_song_feature_index):
+        user_emotion = self.user.get_user_emotion_record(Emotion.HAPPY)
+        closest_song = MoodyUtil.create_song(
+            energy=user_emotion.energy,
+            valence=user_emotion.valence,
+            danceability=user_emotion.danceability
+        )
+        next_closest_song = MoodyUtil.create_song(
+            energy=user_emotion.energy + .1,
+            valence=user_emotion.valence,
+            danceability=user_emotion.danceability
+        )
+        MoodyUtil.create_song(
+            energy=user_emotion.energy + .3,
+            valence=user_emotion.valence,
+            danceability=user_emotion.danceability
+        )
+
+        UserSongVote.objects.create(
+            user=self.user,
+            song=closest_song,
+            emotion=Emotion.objects.get(name=Emotion.HAPPY),
+            vote=True
+        )
+
+        song_feature_index = SongFeatureIndex()
+        song_feature_index.refresh()
+        mock_get_song_feature_index.return_value = song_feature_index
+
+        params = {
+            'emotion': Emotion.HAPPY,
+            'mode': 'nearest',
+            'limit': 1
+        }
+
+        resp = self.client.get(self.url, data=params)
+        resp_data = resp.json()['results']
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp_data), 1)
+        self.assertEqual(resp_data[0]['code'], next_closest_song.code)
+
+    @mock.patch('tunes.utils.get_song_feature_index')
+    def test_nearest_mode_leaves_out_every_song_voted_on(self, mock_get_song_feature_index):
+        user_emotion = self.user.get_user_emotion_record(Emotion.HAPPY)
+        emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        voted_songs = [
+            MoodyUtil.create_song(
+                energy=user_emotion.energy + offset,
+                valence=user_emotion.valence,
+                danceability=user_emotion.danceability
+            )
+            for offset in (0, .05)
+        ]
+        song = MoodyUtil.create_song(
+            energy=user_emotion.energy + .1,
+            valence=user_emotion.valence,
+            danceability=user_emotion.danceability
+        )
+
+        for voted_song in voted_songs:
+            UserSongVote.objects.create(user=self.user, song=voted_song, emotion=emotion, vote=True)
+
+        song_feature_index = SongFeatureIndex()
+        song_feature_index.refresh()
+        mock_get_song_feature_index.return_value = song_feature_index
+
+        resp = self.client.get(self.url, data={'emotion': Emotion.HAPPY, 'mode': 'nearest', 'limit': 1})
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['code'] for result in resp.json()['results']], [song.code])
+
     def test_playlist_returns_songs_voted_on_in_a_different_context(self):
         song = MoodyUtil.create_song()
 
@@ -276,14 +441,15 @@ class TestLastPlaylistView(APITestCase):
     def setUp(self):
         self.client.login(username=self.user.username, password=MoodyUtil.DEFAULT_USER_PASSWORD)
 
-    @mock.patch('tunes.utils.cache')
-    def test_passing_use_cached_playlist_parameter_returns_cached_playlist(self, mock_cache):
+    @mock.patch('tunes.utils.CachedPlaylistManager.retrieve_cached_browse_playlist')
+    def test_passing_use_cached_playlist_parameter_returns_cached_playlist(self, mock_retrieve_cached_playlist):
         cached_data = {
             'emotion': Emotion.HAPPY,
             'context': 'WORK',
-            'playlist': Song.objects.all()
+            'description': '',
+            'song_ids': [self.song.pk]
         }
-        mock_cache.get.return_value = cached_data
+        mock_retrieve_cached_playlist.return_value = cached_data
 
         resp = self.client.get(self.url)
         resp_json = resp.json()
@@ -293,6 +459,22 @@ class TestLastPlaylistView(APITestCase):
         self.assertEqual(resp_json['emotion'], cached_data['emotion'])
         self.assertEqual(resp_json['context'], cached_data['context'])
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached_playlist_is_returned_in_playlist_order(self):
+        other_song = MoodyUtil.create_song()
+        CachedPlaylistManager(self.user).cache_browse_playlist(
+            Song.objects.filter(pk__in=[self.song.pk, other_song.pk]).order_by('-pk'),
+            Emotion.HAPPY,
+            'WORK',
+            ''
+        )
+
+        resp = self.client.get(self.url)
+        resp_json = resp.json()
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([song['code'] for song in resp_json['playlist']], [other_song.code, self.song.code])
+
     @mock.patch('tunes.utils.cache')
     def test_passing_use_cached_playlist_parameter_returns_404_if_no_playlist_found(self, mock_cache):
         mock_cache.get.return_value = None
@@ -301,15 +483,16 @@ class TestLastPlaylistView(APITestCase):
 
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
-    @mock.patch('tunes.utils.cache')
-    def test_cached_playlist_filters_songs_user_voted_on_for_emotion(self, mock_cache):
+    @mock.patch('tunes.utils.CachedPlaylistManager.retrieve_cached_browse_playlist')
+    def test_cached_playlist_filters_songs_user_voted_on_for_emotion(self, mock_retrieve_cached_playlist):
         voted_song = MoodyUtil.create_song()
         cached_data = {
             'emotion': Emotion.HAPPY,
             'context': 'WORK',
-            'playlist': Song.objects.filter(code__in=[voted_song.code])
+            'description': '',
+            'song_ids': [voted_song.pk]
         }
-        mock_cache.get.return_value = cached_data
+        mock_retrieve_cached_playlist.return_value = cached_data
 
         MoodyUtil.create_user_song_vote(
             self.user,
@@ -323,15 +506,16 @@ class TestLastPlaylistView(APITestCase):
 
         self.assertFalse(resp_json['playlist'])
 
-    @mock.patch('tunes.utils.cache')
-    def test_cached_playlist_includes_songs_user_voted_on_for_different_emotion(self, mock_cache):
+    @mock.patch('tunes.utils.CachedPlaylistManager.retrieve_cached_browse_playlist')
+    def test_cached_playlist_includes_songs_user_voted_on_for_different_emotion(self, mock_retrieve_cached_playlist):
         voted_song = MoodyUtil.create_song()
         cached_data = {
             'emotion': Emotion.HAPPY,
             'context': 'WORK',
-            'playlist': Song.objects.filter(code__in=[voted_song.code])
+            'description': '',
+            'song_ids': [voted_song.pk]
         }
-        mock_cache.get.return_value = cached_data
+        mock_retrieve_cached_playlist.return_value = cached_data
 
         MoodyUtil.create_user_song_vote(
             self.user,
@@ -345,6 +529,46 @@ class TestLastPlaylistView(APITestCase):
 
         self.assertEqual(voted_song.code, resp_json['playlist'][0]['code'])
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_unchanged_cached_playlist_returns_not_modified(self):
+        cache.clear()
+        CachedPlaylistManager(self.user).cache_browse_playlist(
+            Song.objects.filter(pk=self.song.pk),
+            Emotion.HAPPY,
+            'WORK',
+            ''
+        )
+
+        etag = self.client.get(self.url)['ETag']
+
+        # User lookup only (the session is read from the cache), the voted songs and playlist songs are not loaded
+        with self.assertNumQueries(1):
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_vote_for_cached_playlist_emotion_returns_updated_playlist(self):
+        cache.clear()
+        CachedPlaylistManager(self.user).cache_browse_playlist(
+            Song.objects.filter(pk=self.song.pk),
+            Emotion.HAPPY,
+            'WORK',
+            ''
+        )
+
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(
+            reverse('tunes:vote'),
+            data={'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True},
+            format='json'
+        )
+
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse(resp.json()['playlist'])
+
 
 class TestVoteView(APITestCase):
     @classmethod
@@ -396,6 +620,26 @@ class TestVoteView(APITestCase):
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
         self.assertTrue(vote_created)
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_vote_adds_song_to_cached_voted_song_ids(self):
+        cache.clear()
+        manager = VotedSongIdsManager(self.user)
+        manager.get_voted_song_ids(Emotion.HAPPY)
+        manager.get_voted_song_ids(Emotion.HAPPY, 'WORK')
+
+        data = {
+            'emotion': Emotion.HAPPY,
+            'song_code': self.song.code,
+            'vote': True,
+            'context': 'WORK'
+        }
+        self.client.post(self.url, data=data, format='json')
+
+        # The song is added to the cached song ids, instead of loading the song ids again
+        with self.assertNumQueries(0):
+            self.assertIn(self.song.pk, manager.get_voted_song_ids(Emotion.HAPPY).tolist())
+            self.assertIn(self.song.pk, manager.get_voted_song_ids(Emotion.HAPPY, 'WORK').tolist())
+
     def test_bad_request_if_invalid_data_sent(self):
         # Missing vote value
         data = {
@@ -709,6 +953,140 @@ class TestVoteView(APITestCase):
         self.assertTrue(consistent_vote.vote)
 
 
+class TestBulkVoteView(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('tunes:vote-bulk')
+        cls.user = MoodyUtil.create_user()
+        cls.song = MoodyUtil.create_song()
+        cls.other_song = MoodyUtil.create_song()
+
+    def setUp(self):
+        self.client.login(username=self.user.username, password=MoodyUtil.DEFAULT_USER_PASSWORD)
+
+    def test_unauthenticated_request_is_forbidden(self):
+        self.client.logout()
+
+        data = {'votes': [{'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True}]}
+        resp = self.client.post(self.url, data=data, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_no_votes_passed_returns_bad_request(self):
+        resp = self.client.post(self.url, data={'votes': []}, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_happy_path(self):
+        data = {
+            'votes': [
+                {'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True},
+                {'emotion': Emotion.MELANCHOLY, 'song_code': self.other_song.code, 'vote': False, 'context': 'WORK'},
+            ]
+        }
+        resp = self.client.post(self.url, data=data, format='json')
+        results = resp.json()['results']
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertListEqual([result['status'] for result in results], [201, 201])
+        self.assertTrue(UserSongVote.objects.filter(
+            user=self.user,
+            emotion__name=Emotion.HAPPY,
+            song=self.song,
+            vote=True
+        ).exists())
+        self.assertTrue(UserSongVote.objects.filter(
+            user=self.user,
+            emotion__name=Emotion.MELANCHOLY,
+            song=self.other_song,
+            vote=False,
+            context='WORK'
+        ).exists())
+
+    def test_votes_are_saved_with_constant_number_of_queries(self):
+        songs = [MoodyUtil.create_song() for _ in range(10)]
+        data = {'votes': [{'emotion': Emotion.HAPPY, 'song_code': song.code, 'vote': False} for song in songs]}
+        get_emotion_registry()
+
+        # Session and user lookups, then songs, existing votes and the insert. Emotions come from the registry
+        with self.assertNumQueries(5):
+            resp = self.client.post(self.url, data=data, format='json')
+
+        self.assertListEqual([result['status'] for result in resp.json()['results']], [201] * len(songs))
+
+    def test_results_match_vote_view_semantics_for_each_vote(self):
+        MoodyUtil.create_user_song_vote(self.user, self.other_song, Emotion.objects.get(name=Emotion.HAPPY), True)
+
+        data = {
+            'votes': [
+                {'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True},
+                {'emotion': Emotion.HAPPY, 'song_code': 'unknown-song-code', 'vote': True},
+                {'emotion': Emotion.HAPPY, 'song_code': self.other_song.code, 'vote': True},
+                {'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True},
+                {'emotion': 'invalid-emotion', 'song_code': self.song.code, 'vote': True},
+                {'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True, 'context': 'WORK'},
+            ]
+        }
+        resp = self.client.post(self.url, data=data, format='json')
+        results = resp.json()['results']
+
+        self.assertListEqual([result['status'] for result in results], [201, 404, 400, 400, 400, 201])
+        self.assertIn('emotion', results[4]['errors'])
+        self.assertEqual(UserSongVote.objects.filter(user=self.user, song=self.song).count(), 2)
+
+    @mock.patch('tunes.views.dispatch_update_user_emotion_attributes')
+    def test_attribute_update_is_dispatched_once_for_each_upvoted_emotion(self, mock_dispatch):
+        data = {
+            'votes': [
+                {'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True},
+                {'emotion': Emotion.HAPPY, 'song_code': self.other_song.code, 'vote': True},
+                {'emotion': Emotion.CALM, 'song_code': self.song.code, 'vote': True},
+                {'emotion': Emotion.MELANCHOLY, 'song_code': self.song.code, 'vote': False},
+            ]
+        }
+        self.client.post(self.url, data=data, format='json')
+
+        happy = Emotion.objects.get(name=Emotion.HAPPY)
+        calm = Emotion.objects.get(name=Emotion.CALM)
+
+        self.assertEqual(mock_dispatch.call_count, 2)
+        mock_dispatch.assert_any_call(self.user.id, happy.id, song_id=None, trace_id=mock.ANY)
+        mock_dispatch.assert_any_call(self.user.id, calm.id, song_id=self.song.id, trace_id=mock.ANY)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_bulk_vote_updates_vote_version(self):
+        cache.clear()
+        emotion = Emotion.objects.get(name=Emotion.HAPPY)
+        version = get_vote_version(self.user.pk, emotion.pk)
+
+        data = {'votes': [{'emotion': emotion.name, 'song_code': self.song.code, 'vote': True}]}
+        self.client.post(self.url, data=data, format='json')
+
+        self.assertNotEqual(get_vote_version(self.user.pk, emotion.pk), version)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_bulk_vote_adds_songs_to_cached_voted_song_ids(self):
+        cache.clear()
+        manager = VotedSongIdsManager(self.user)
+        manager.get_voted_song_ids(Emotion.HAPPY)
+        manager.get_voted_song_ids(Emotion.HAPPY, 'WORK')
+
+        data = {
+            'votes': [
+                {'emotion': Emotion.HAPPY, 'song_code': self.song.code, 'vote': True, 'context': 'WORK'},
+                {'emotion': Emotion.HAPPY, 'song_code': self.other_song.code, 'vote': False},
+            ]
+        }
+        self.client.post(self.url, data=data, format='json')
+
+        with self.assertNumQueries(0):
+            self.assertListEqual(
+                manager.get_voted_song_ids(Emotion.HAPPY).tolist(),
+                sorted([self.song.pk, self.other_song.pk])
+            )
+            self.assertListEqual(manager.get_voted_song_ids(Emotion.HAPPY, 'WORK').tolist(), [self.song.pk])
+
+
 class TestPlaylistView(APITestCase):
     @classmethod
     def setUpTestData(cls):
@@ -991,6 +1369,174 @@ class TestPlaylistView(APITestCase):
         self.assertEqual(resp_data['first_page'], 'http://testserver/tunes/playlist/?context=WORK&emotion=HPY')
         self.assertEqual(resp_data['last_page'], 'http://testserver/tunes/playlist/?context=WORK&emotion=HPY&page=last')
 
+    def test_analytics_cover_whole_playlist_and_are_computed_with_the_page(self):
+        votes = []
+
+        for _ in range(20):
+            song = MoodyUtil.create_song()
+            votes.append(UserSongVote(user=self.user, emotion=self.emotion, song=song, vote=True))
+
+        # Use bulk_create method to skip updating UserEmotion attributes
+        UserSongVote.objects.bulk_create(votes)
+
+        expected_averages = average(
+            UserSongVote.objects.filter(user=self.user),
+            'song__valence',
+            'song__energy',
+            'song__danceability'
+        )
+
+        data = {'emotion': self.emotion.name, 'page': 2}
+
+        # Session and user lookups, then the count and the page with the playlist analytics
+        with self.assertNumQueries(4):
+            resp = self.client.get(self.url, data=data)
+
+        resp_data = resp.json()
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp_data['valence'], expected_averages['song__valence__avg'] * 100)
+        self.assertEqual(resp_data['energy'], expected_averages['song__energy__avg'] * 100)
+        self.assertEqual(resp_data['danceability'], expected_averages['song__danceability__avg'] * 100)
+
+    def test_analytics_with_attribute_averaging_zero_keeps_other_averages(self):
+        song = MoodyUtil.create_song(energy=.5, danceability=.75)
+        Song.objects.filter(pk=song.pk).update(valence=0)  # `create_song` falls back to the emotion for 0
+        MoodyUtil.create_user_song_vote(self.user, song, self.emotion, True)
+
+        resp = self.client.get(self.url, data={'emotion': self.emotion.name})
+        resp_data = resp.json()
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp_data['valence'], 0)
+        self.assertEqual(resp_data['energy'], 50)
+        self.assertEqual(resp_data['danceability'], 75)
+
+    def test_cursor_pagination_analytics_cover_whole_playlist(self):
+        self.create_votes_for_cursor_pagination(20)
+        expected_averages = average(
+            UserSongVote.objects.filter(user=self.user),
+            'song__valence',
+            'song__energy',
+            'song__danceability'
+        )
+
+        first_page = self.client.get(self.url, data={'emotion': self.emotion.name, 'pagination': 'cursor'}).json()
+        resp_data = self.client.get(first_page['next']).json()
+
+        self.assertEqual(resp_data['valence'], expected_averages['song__valence__avg'] * 100)
+        self.assertEqual(resp_data['energy'], expected_averages['song__energy__avg'] * 100)
+
+    def create_votes_for_cursor_pagination(self, count):
+        votes = []
+
+        for _ in range(count):
+            song = MoodyUtil.create_song()
+            votes.append(UserSongVote(user=self.user, emotion=self.emotion, song=song, vote=True))
+
+        # Use bulk_create method to skip updating UserEmotion attributes
+        UserSongVote.objects.bulk_create(votes)
+
+        return list(UserSongVote.objects.filter(user=self.user).order_by('-created', '-id'))
+
+    def test_cursor_pagination_returns_every_song_once_in_order(self):
+        votes = self.create_votes_for_cursor_pagination(20)
+
+        song_codes = []
+        url = '{}?emotion={}&pagination=cursor'.format(self.url, self.emotion.name)
+
+        while url:
+            resp_data = self.client.get(url).json()
+            song_codes.extend(result['song']['code'] for result in resp_data['results'])
+            url = resp_data['next']
+
+        self.assertEqual(song_codes, [vote.song.code for vote in votes])
+
+    def test_cursor_pagination_previous_link_returns_previous_page(self):
+        self.create_votes_for_cursor_pagination(20)
+        data = {'emotion': self.emotion.name, 'pagination': 'cursor'}
+
+        first_page = self.client.get(self.url, data=data).json()
+        second_page = self.client.get(first_page['next']).json()
+        previous_page = self.client.get(second_page['previous']).json()
+
+        self.assertIsNone(first_page['previous'])
+        self.assertEqual(previous_page['results'], first_page['results'])
+
+    def test_cursor_pagination_does_not_count_songs_unless_asked(self):
+        self.create_votes_for_cursor_pagination(5)
+        data = {'emotion': self.emotion.name, 'pagination': 'cursor'}
+
+        resp_data = self.client.get(self.url, data=data).json()
+        self.assertNotIn('count', resp_data)
+
+        data['include_count'] = True
+        resp_data = self.client.get(self.url, data=data).json()
+        self.assertEqual(resp_data['count'], 5)
+
+    def test_cursor_pagination_counts_songs_for_any_true_include_count_value(self):
+        self.create_votes_for_cursor_pagination(5)
+        data = {'emotion': self.emotion.name, 'pagination': 'cursor', 'include_count': 'yes'}
+
+        resp_data = self.client.get(self.url, data=data).json()
+        self.assertEqual(resp_data['count'], 5)
+
+    def test_cursor_pagination_last_page_link_returns_last_page(self):
+        votes = self.create_votes_for_cursor_pagination(20)
+        data = {'emotion': self.emotion.name, 'pagination': 'cursor'}
+
+        resp_data = self.client.get(self.url, data=data).json()
+        last_page = self.client.get(resp_data['last_page']).json()
+
+        self.assertEqual(
+            [result['song']['code'] for result in last_page['results']],
+            [vote.song.code for vote in votes[-settings.REST_FRAMEWORK['PAGE_SIZE']:]]
+        )
+        self.assertIsNone(last_page['next'])
+        self.assertEqual(last_page['first_page'], 'http://testserver/tunes/playlist/?emotion=HPY&pagination=cursor')
+
+    def test_cursor_pagination_with_invalid_cursor_returns_not_found(self):
+        data = {'emotion': self.emotion.name, 'pagination': 'cursor', 'cursor': 'foo'}
+        resp = self.client.get(self.url, data=data)
+
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_unchanged_playlist_returns_not_modified(self):
+        cache.clear()
+        MoodyUtil.create_user_song_vote(user=self.user, song=self.song, emotion=self.emotion, vote=True)
+
+        data = {'emotion': self.emotion.name}
+        etag = self.client.get(self.url, data=data)['ETag']
+
+        # User lookup only (the session is read from the cache), the playlist queries are not run
+        with self.assertNumQueries(1):
+            resp = self.client.get(self.url, data=data, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_vote_for_emotion_returns_updated_playlist(self):
+        cache.clear()
+
+        data = {'emotion': self.emotion.name}
+        etag = self.client.get(self.url, data=data)['ETag']
+        MoodyUtil.create_user_song_vote(user=self.user, song=self.song, emotion=self.emotion, vote=True)
+
+        resp = self.client.get(self.url, data=data, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()['results'][0]['song']['code'], self.song.code)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_different_page_does_not_match_etag(self):
+        cache.clear()
+
+        etag = self.client.get(self.url, data={'emotion': self.emotion.name})['ETag']
+        resp = self.client.get(self.url, data={'emotion': self.emotion.name, 'genre': 'rock'}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
 
 class TestOptionsView(APITestCase):
     @classmethod
@@ -1025,6 +1571,34 @@ class TestOptionsView(APITestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertDictEqual(resp.json(), expected_response)
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_new_genre_is_included_right_after_song_is_created(self):
+        self.client.get(self.url)
+
+        new_song = MoodyUtil.create_song(genre='hiphop')
+        resp = self.client.get(self.url)
+
+        self.assertIn(new_song.genre, resp.json()['genres'])
+
+    def test_genres_are_listed_without_scanning_songs(self):
+        # Session and user lookups, and the genre table lookup
+        with self.assertNumQueries(3):
+            resp = self.client.get(self.url)
+
+        self.assertEqual(resp.json()['genres'], [self.song.genre])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_new_genre_does_not_match_etag(self):
+        cache.clear()
+        etag = self.client.get(self.url)['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        MoodyUtil.create_song(genre='hiphop')
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
 
 class TestVoteInfoView(APITestCase):
     @classmethod
@@ -1108,3 +1682,66 @@ class TestVoteInfoView(APITestCase):
 
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(resp_data['contexts'], expected_contexts)
+
+
+class TestBulkVoteInfoView(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('tunes:vote-info-bulk')
+        cls.user = MoodyUtil.create_user()
+        cls.song = MoodyUtil.create_song()
+        cls.other_song = MoodyUtil.create_song()
+        cls.emotion = Emotion.objects.get(name=Emotion.HAPPY)
+
+    def setUp(self):
+        self.client.login(username=self.user.username, password=MoodyUtil.DEFAULT_USER_PASSWORD)
+
+    def test_unauthenticated_request_is_forbidden(self):
+        self.client.logout()
+
+        resp = self.client.get(self.url)
+
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_no_song_codes_passed_returns_bad_request(self):
+        resp = self.client.get(self.url, data={'emotion': self.emotion.name})
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_happy_path(self):
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True)
+        MoodyUtil.create_user_song_vote(self.user, self.song, self.emotion, True, 'WORK')
+        MoodyUtil.create_user_song_vote(self.user, self.other_song, self.emotion, True, 'PARTY')
+        MoodyUtil.create_user_song_vote(
+            self.user,
+            self.other_song,
+            Emotion.objects.get(name=Emotion.CALM),
+            True,
+            'RELAX'
+        )
+
+        data = {
+            'emotion': self.emotion.name,
+            'song_codes': [self.song.code, self.other_song.code]
+        }
+
+        with self.assertNumQueries(3):  # Session, user and votes lookups
+            resp = self.client.get(self.url, data=data)
+
+        resp_data = resp.json()
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertCountEqual(resp_data['contexts'][self.song.code], ['', 'WORK'])
+        self.assertListEqual(resp_data['contexts'][self.other_song.code], ['PARTY'])
+
+    def test_endpoint_returns_empty_list_for_songs_with_no_votes(self):
+        data = {
+            'emotion': self.emotion.name,
+            'song_codes': [self.song.code]
+        }
+
+        resp = self.client.get(self.url, data=data)
+        resp_data = resp.json()
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(resp_data['contexts'], {self.song.code: []})
@@ -7,7 +7,9 @@ urlpatterns = [
     path('browse/', views.BrowseView.as_view(), name='browse'),
     path('browse/last/', views.LastPlaylistView.as_view(), name='last'),
     path('vote/', views.VoteView.as_view(), name='vote'),
+    path('vote/bulk/', views.BulkVoteView.as_view(), name='vote-bulk'),
     path('vote/info/', views.VoteInfoView.as_view(), name='vote-info'),
+    path('vote/info/bulk/', views.BulkVoteInfoView.as_view(), name='vote-info-bulk'),
     path('playlist/', views.PlaylistView.as_view(), name='playlist'),
     path('options/', views.OptionView.as_view(), name='options'),
 ]
@@ -1,8 +1,17 @@
+import random
+
+import numpy as np
 from django.conf import settings
 from django.core.cache import cache
+from django.db.models import Q, Avg, Exists, IntegerField, Value, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.sql.datastructures import BaseTable
 
 from accounts.models import UserSongVote
-from tunes.models import Song
+from accounts.utils import get_vote_version
+from tunes.emotion_registry import get_emotion_registry
+from tunes.feature_index import get_song_feature_index
+from tunes.models import Genre, Song
 
 
 def generate_browse_playlist(
@@ -14,7 +23,9 @@ def generate_browse_playlist(
         jitter=None,
         artist=None,
         top_artists=None,
-        songs=None
+        genre=None,
+        songs=None,
+        exclude_song_ids=None
 ):
     """
     Build a browse playlist of songs for the given criteria.
@@ -35,9 +46,11 @@ def generate_browse_playlist(
     :param artist: (str) Optional artist of songs to return
     :param jitter: (float) Optional "shuffle" for the boundary box to give users songs from outside their norm
     :param top_artists: (list[str]) Optional array of top artists for user in Spotify to use in search
+    :param genre: (str) Optional genre of songs to return
     :param songs: (QuerySet) Optional queryset of songs to filter
+    :param exclude_song_ids: (np.ndarray) Optional sorted array of ids of songs to leave out of the playlist
 
-    :return playlist: (QuerySet) `QuerySet` of `Song` instances for the given parameters
+    :return playlist: (QuerySet|list) Collection of `Song` instances for the given parameters
     """
     energy_lower_limit = energy_upper_limit = energy
     valence_lower_limit = valence_upper_limit = valence
@@ -73,7 +86,10 @@ def generate_browse_playlist(
 
         params = {key: params[key] for key in params if key.startswith(strategy)}
 
-    playlist = songs.filter(**params).order_by('?')
+    playlist = songs.filter(**params)
+
+    if genre:
+        playlist = playlist.filter(genre=genre)
 
     # Filter by artist if provided, skipping over top_artists filter
     # to ensure we return tracks from specified artist when provided
@@ -82,28 +98,279 @@ def generate_browse_playlist(
 
     # Filter by user top artists on Spotify if provided
     elif top_artists:
-        top_artists_playlist = playlist.filter(artist__in=top_artists)
+        top_artists_filter = Q(artist__in=top_artists)
+
+        playlist = exclude_songs(playlist, exclude_song_ids)
+
+        if limit:
+            return list(_sample_top_artists_playlist(playlist, top_artists_filter, limit))
+
+        # Without a limit, only return songs by top artists unless there are no songs by top artists
+        return playlist.annotate(
+            has_top_artist_songs=Exists(playlist.filter(top_artists_filter))
+        ).filter(top_artists_filter | Q(has_top_artist_songs=False)).order_by('?')
+
+    # The feature index only covers the song attributes and genre, so it can't be used to filter by artist
+    if artist:
+        return sample_songs(playlist, limit, exclude_song_ids=exclude_song_ids)
+
+    return _sample_browse_playlist(playlist, params, limit, genre=genre, exclude_song_ids=exclude_song_ids)
+
+
+def _sample_top_artists_playlist(songs, top_artists_filter, limit):
+    """
+    Sample songs for a browse playlist with songs by the top artists of the user first, filling out the
+    rest of the playlist with songs by other artists. This ensures we don't return a small playlist if
+    there are fewer top artist songs than the limit.
+
+    The playlist is built in one query, from a `random_key` walk from the same random starting point
+    over the top artist songs and over the other songs. Each walk is limited to `limit` songs, so the
+    query never sorts every matching song.
+
+    :param songs: (QuerySet) Collection of `Song` records filtered by the playlist params
+    :param top_artists_filter: (Q) Filter for songs by the top artists of the user
+    :param limit: (int) Max number of songs to return
+
+    :return: (QuerySet) Collection of `Song` records, with top artist songs first
+    """
+    start_key = random.random()
+    walks = [
+        songs.filter(top_artists_filter, random_key__gte=start_key),
+        songs.filter(top_artists_filter, random_key__lt=start_key),
+        songs.exclude(top_artists_filter).filter(random_key__gte=start_key),
+        songs.exclude(top_artists_filter).filter(random_key__lt=start_key),
+    ]
+    walks = [
+        walk.annotate(walk_order=Value(order, output_field=IntegerField())).order_by('random_key')[:limit]
+        for order, walk in enumerate(walks)
+    ]
+
+    return walks[0].union(*walks[1:], all=True).order_by('walk_order', 'random_key')[:limit]
+
+
+def _sample_browse_playlist(songs, params, limit, genre=None, exclude_song_ids=None):
+    """
+    Sample songs for a browse playlist, from the `SongFeatureIndex` if it is enabled
+
+    :param songs: (QuerySet) Collection of `Song` records filtered by the playlist params
+    :param params: (dict) Range lookups used to filter the songs, like `{'energy__range': (.4, .6)}`
+    :param limit: (int) Optional max number of songs to return
+    :param genre: (str) Optional genre of songs to return
+    :param exclude_song_ids: (np.ndarray) Optional sorted array of ids of songs to leave out
+
+    :return: (QuerySet|list) Randomly ordered collection of `Song` records
+    """
+    if settings.BROWSE_USE_SONG_FEATURE_INDEX and limit:
+        ranges = {key.split('__')[0]: value for key, value in params.items()}
+        return sample_songs_from_feature_index(songs, ranges, limit, genre=genre, exclude_song_ids=exclude_song_ids)
+
+    return sample_songs(songs, limit, exclude_song_ids=exclude_song_ids)
+
+
+def generate_nearest_browse_playlist(
+        energy,
+        valence,
+        danceability,
+        limit,
+        genre=None,
+        exclude_song_ids=None,
+        songs=None
+):
+    """
+    Build a browse playlist of the songs closest to the given attributes.
+
+    Instead of sampling songs from a box around the attributes, this uses the KD-tree in the
+    `SongFeatureIndex` to find the `limit` songs with the smallest weighted distance to the attributes
+    (weights are set in `settings.BROWSE_NEAREST_FEATURE_WEIGHTS`). Songs at the same distance are
+    returned in random order.
+
+    If excluded songs crowd out the nearest songs past `settings.SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE`,
+    we sample songs from the database around the attributes instead of querying a larger part of the index.
+
+    :param energy: (float) Energy estimate of `Song` records returned
+    :param valence: (float) Valence estimate of `Song` records returned
+    :param danceability: (float) Danceability estimate of `Song` records returned
+    :param limit: (int) Max number of songs to return
+    :param genre: (str) Optional genre of songs to return
+    :param exclude_song_ids: (iterable[int]) Optional ids of songs to leave out of the playlist
+    :param songs: (QuerySet) Optional queryset of songs to fetch the playlist from
+
+    :return playlist: (list) Collection of `Song` instances ordered by their distance to the attributes
+    """
+    if songs is None:
+        songs = Song.objects.all()
+
+    song_feature_index = get_song_feature_index()
+    song_ids = song_feature_index.get_nearest_song_ids(
+        {'energy': energy, 'valence': valence, 'danceability': danceability},
+        limit,
+        exclude_song_ids=exclude_song_ids,
+        genre=genre
+    )
+
+    if song_ids is None:
+        jitter = settings.BROWSE_DEFAULT_JITTER
+        params = {
+            'energy__range': (energy - jitter, energy + jitter),
+            'valence__range': (valence - jitter, valence + jitter),
+            'danceability__range': (danceability - jitter, danceability + jitter),
+        }
+
+        if genre:
+            params['genre'] = genre
+
+        return list(sample_songs(songs.filter(**params), limit, exclude_song_ids=exclude_song_ids))
+
+    song_ids = song_ids.tolist()
+
+    songs_by_id = songs.in_bulk(song_ids)
+
+    return [songs_by_id[song_id] for song_id in song_ids if song_id in songs_by_id]
+
+
+def sample_songs_from_feature_index(songs, ranges, limit, genre=None, song_feature_index=None, exclude_song_ids=None):
+    """
+    Return a random sample of songs, using the in-process `SongFeatureIndex` to find the ids of songs
+    matching the attribute ranges and genre. Only the sampled songs are fetched from the database, in
+    batches of shuffled candidate ids until we have enough songs for the playlist.
+
+    Songs are fetched through the `songs` queryset, so any filters on it (excluding songs the user has
+    voted on, as well as the attribute ranges themselves in case the index is stale) still apply.
+
+    :param songs: (QuerySet) Collection of `Song` records to sample from
+    :param ranges: (dict) Mapping of song attribute to a tuple of (lower limit, upper limit)
+    :param limit: (int) Max number of songs to return
+    :param genre: (str) Optional genre of songs to return
+    :param song_feature_index: (SongFeatureIndex) Optional index to use instead of the index for this process
+    :param exclude_song_ids: (np.ndarray) Optional sorted array of ids of songs to leave out
+
+    :return: (list) Randomly ordered collection of `Song` records
+    """
+    if song_feature_index is None:
+        song_feature_index = get_song_feature_index()
+
+    candidate_song_ids = song_feature_index.get_candidate_song_ids(ranges, genre=genre)
 
-        if top_artists_playlist:
+    if exclude_song_ids is not None and len(exclude_song_ids):
+        candidate_song_ids = candidate_song_ids[~np.isin(candidate_song_ids, exclude_song_ids, assume_unique=True)]
 
-            if limit and top_artists_playlist.count() < limit:
-                # If playlist filtered by top artists contains fewer songs than the limit,
-                # fill it out with songs from other artists. This ensures we don't return
-                # a small playlist if the top artist playlist is less than the desired limit
-                playlist_minus_top_artists = playlist.exclude(artist__in=top_artists)
-                filler_track_count = limit - top_artists_playlist.count()
-                top_artists_playlist = top_artists_playlist.union(playlist_minus_top_artists[:filler_track_count])
+    candidate_song_ids = np.random.permutation(candidate_song_ids)
 
-            playlist = top_artists_playlist
+    batch_size = max(limit, settings.SONG_FEATURE_INDEX_FETCH_BATCH_SIZE)
+    playlist = []
 
-    if limit:
-        playlist = playlist[:limit]
+    for start in range(0, len(candidate_song_ids), batch_size):
+        batch = candidate_song_ids[start:start + batch_size].tolist()
+        songs_by_id = songs.in_bulk(batch)
+
+        playlist.extend(songs_by_id[song_id] for song_id in batch if song_id in songs_by_id)
+
+        if len(playlist) >= limit:
+            break
+
+    return playlist[:limit]
+
+
+def sample_songs(songs, limit=None, method=None, exclude_song_ids=None):
+    """
+    Return a random sample of songs from the given queryset.
+
+    The sampling method is controlled by `settings.BROWSE_PLAYLIST_SAMPLING_METHOD`:
+        - `random` orders every matching song by random() and slices off the first `limit` songs
+        - `random_key` walks the `Song.random_key` index from a random starting point, wrapping around
+          to the start of the key space if there are not enough songs past the starting point. This
+          avoids sorting every matching song, at the cost of songs close to each other in key order
+          being returned together until the keys are reshuffled by `ShuffleSongRandomKeysTask`
+        - `tablesample` orders a TABLESAMPLE of the song table by random(), falling back to the
+          `random_key` walk if the sample does not contain enough matching songs
+
+    Sampling without a `limit` needs every matching song, so it always orders the songs by random().
+
+    Songs in `exclude_song_ids` are left out of the songs in the query, so every method only fetches
+    the songs it returns.
+
+    :param songs: (QuerySet) Collection of `Song` records to sample from
+    :param limit: (int) Optional max number of songs to return
+    :param method: (str) Optional sampling method to use, one of `settings.BROWSE_PLAYLIST_SAMPLING_METHODS`
+    :param exclude_song_ids: (np.ndarray) Optional sorted array of ids of songs to leave out of the sample
+
+    :return: (QuerySet|list) Randomly ordered collection of `Song` records
+    """
+    method = method or settings.BROWSE_PLAYLIST_SAMPLING_METHOD
+
+    if method not in settings.BROWSE_PLAYLIST_SAMPLING_METHODS:
+        raise ValueError(
+            'Invalid sampling method, must be one of: {}'.format(', '.join(settings.BROWSE_PLAYLIST_SAMPLING_METHODS))
+        )
+
+    songs = exclude_songs(songs, exclude_song_ids)
+
+    if not limit or method == 'random':
+        playlist = songs.order_by('?')
+
+        return playlist[:limit] if limit else playlist
+
+    if method == 'tablesample':
+        sampled_song_ids = RawSQL(
+            'SELECT id FROM {} TABLESAMPLE SYSTEM (%s)'.format(Song._meta.db_table),
+            (settings.BROWSE_PLAYLIST_TABLESAMPLE_PERCENTAGE,)
+        )
+
+        playlist = list(songs.filter(id__in=sampled_song_ids).order_by('?')[:limit])
+
+        if len(playlist) >= limit:
+            return playlist
+
+    start_key = random.random()
+    playlist = list(songs.filter(random_key__gte=start_key).order_by('random_key')[:limit])
+
+    if len(playlist) < limit:
+        playlist.extend(songs.filter(random_key__lt=start_key).order_by('random_key')[:limit - len(playlist)])
 
     return playlist
 
 
+def exclude_songs(songs, exclude_song_ids):
+    """
+    Leave the excluded songs out of a queryset of songs
+
+    :param songs: (QuerySet) Collection of `Song` records
+    :param exclude_song_ids: (np.ndarray) Sorted array of ids of songs to leave out, or None
+
+    :return: (QuerySet)
+    """
+    if exclude_song_ids is None or not len(exclude_song_ids):
+        return songs
+
+    return songs.exclude(id__in=exclude_song_ids.tolist())
+
+
+def get_genres():
+    """
+    Return the names of every song genre, ordered by name. The names are cached until a genre is
+    added or removed, see `tunes.signals.clear_cached_genres`.
+
+    :return: (list[str])
+    """
+    genres = cache.get(settings.GENRE_CHOICES_CACHE_KEY)
+
+    if genres is None:
+        genres = list(Genre.objects.order_by('name').values_list('name', flat=True))
+        cache.set(settings.GENRE_CHOICES_CACHE_KEY, genres, settings.GENRE_CHOICES_CACHE_TIMEOUT)
+
+    return genres
+
+
 class CachedPlaylistManager(object):
-    """Facilitates caching and retrieving the last previous user browse playlists"""
+    """
+    Facilitates caching and retrieving the last previous user browse playlists.
+
+    Playlists are cached as the ids of their songs (the bytes of a NumPy array in playlist order) along
+    with the options the playlist was generated with, instead of pickling the `Song` instances. The songs
+    are loaded again with a single query when the playlist is retrieved. Entries cached before the format
+    was versioned hold the songs themselves under `playlist`, and are still read until they expire.
+    """
+    CACHE_FORMAT_VERSION = 2
 
     def __init__(self, user):
         self.user = user
@@ -116,45 +383,381 @@ class CachedPlaylistManager(object):
         """
         return 'browse:cached-playlist:{}'.format(self.user.username)
 
-    def cache_browse_playlist(self, playlist, emotion, context, description):
+    def build_cache_data(self, playlist, emotion, context, description):
         """
-        Cache the playlist generated by the user for use in retrieving the last seen playlist
+        Build the value to cache for the playlist
 
         :param playlist: (QuerySet) Playlist recently generated by the user
         :param emotion: (str) Emotion user requested for the browse playlist
         :param context: (str) Optional context set when generating the browse playlist
         :param description: (str) Optional description set when generating the browse playlist
+
+        :return: (dict)
         """
-        cache_key = self._make_cache_key()
+        # Iterate over the playlist instead of querying for its ids, so the songs cached are the same songs
+        # returned to the user for playlists ordered randomly
+        song_ids = np.fromiter((song.pk for song in playlist), dtype=np.int32)
 
-        cache_data = {
+        return {
+            'version': self.CACHE_FORMAT_VERSION,
             'emotion': emotion,
             'context': context,
             'description': description,
-            'playlist': playlist
+            'song_ids': song_ids.tobytes(),
         }
 
+    def cache_browse_playlist(self, playlist, emotion, context, description):
+        """
+        Cache the playlist generated by the user for use in retrieving the last seen playlist
+
+        :param playlist: (QuerySet) Playlist recently generated by the user
+        :param emotion: (str) Emotion user requested for the browse playlist
+        :param context: (str) Optional context set when generating the browse playlist
+        :param description: (str) Optional description set when generating the browse playlist
+        """
+        cache_key = self._make_cache_key()
+        cache_data = self.build_cache_data(playlist, emotion, context, description)
+
         cache.set(cache_key, cache_data, settings.BROWSE_PLAYLIST_CACHE_TIMEOUT)
 
+    def parse_cache_data(self, cached_data):
+        """
+        Parse the value cached for a playlist, in either the current or the legacy format
+
+        :param cached_data: (dict) Value retrieved from the cache
+
+        :return: (dict)
+            - emotion (str)
+            - context (str)
+            - description (str)
+            - song_ids (list[int]): Ids of the songs in the playlist, in playlist order
+        """
+        if cached_data.get('version') == self.CACHE_FORMAT_VERSION:
+            song_ids = np.frombuffer(cached_data['song_ids'], dtype=np.int32).tolist()
+        else:
+            song_ids = [song.pk for song in cached_data['playlist']]
+
+        return {
+            'emotion': cached_data['emotion'],
+            'context': cached_data.get('context'),
+            'description': cached_data.get('description'),
+            'song_ids': song_ids,
+        }
+
     def retrieve_cached_browse_playlist(self):
         """
         Retrieve the cached playlist for user if one exists, else return None.
 
-        :return: (list|None)
+        :return: (dict|None) Cached playlist in the format returned from `parse_cache_data`
         """
         cache_key = self._make_cache_key()
-        return cache.get(cache_key)
+        cached_data = cache.get(cache_key)
+
+        if cached_data is None:
+            return None
+
+        return self.parse_cache_data(cached_data)
+
+    @staticmethod
+    def get_playlist_songs(song_ids):
+        """
+        Load the songs for a cached playlist in one query. Songs that no longer exist are left out.
+
+        :param song_ids: (list[int]) Ids of the songs in the playlist, in playlist order
+
+        :return: (list[Song]) Songs in playlist order
+        """
+        songs = Song.objects.in_bulk(song_ids)
+
+        return [songs[song_id] for song_id in song_ids if song_id in songs]
+
+
+class VotedSongIdsManager(object):
+    """
+    Facilitates caching and retrieving the ids of songs a user has voted on for an emotion, optionally
+    for a single context. Song ids are cached as the bytes of a sorted NumPy array, to keep the cached
+    value small for users with a lot of votes.
+
+    Cached ids are stored along with the version of the votes for the user and emotion they were loaded
+    for (see `accounts.utils.get_vote_version`). Saving a vote bumps the version, so ids cached before the
+    vote are stale. Views that save votes add the songs to the cached ids with `add_voted_song_ids`, which
+    only updates ids cached for the version right before the vote. Ids that missed a vote (from a concurrent
+    request) keep their old version and are loaded again from the database the next time they are retrieved.
+    """
+    ALL_CONTEXTS = '*'
+
+    def __init__(self, user):
+        self.user = user
+
+    def _make_cache_key(self, emotion, context=None):
+        """
+        Make a cache key for storing the ids of songs the user has voted on for the emotion and context
+
+        :param emotion: (str) Emotion of the votes
+        :param context: (str) Optional context of the votes, if not provided use votes for all contexts
+
+        :return: (str)
+        """
+        return 'browse:voted-song-ids:{}:{}:{}'.format(self.user.pk, emotion, context or self.ALL_CONTEXTS)
+
+    def _load_voted_song_ids(self, emotion_id, context=None):
+        votes = self.user.usersongvote_set.filter(emotion_id=emotion_id)
+
+        if context:
+            votes = votes.filter(context=context)
+
+        return np.unique(np.fromiter(votes.values_list('song_id', flat=True), dtype=np.int32))
+
+    def get_voted_song_ids(self, emotion, context=None):
+        """
+        Retrieve the ids of songs the user has voted on for the emotion and context, loading them
+        from the database and caching them if they are not cached for the current version of the votes.
+
+        :param emotion: (str) Emotion of the votes
+        :param context: (str) Optional context of the votes, if not provided use votes for all contexts
+
+        :return: (np.ndarray) Sorted array of song ids
+        """
+        emotion_id = get_emotion_registry().get(name=emotion).id
+        cache_key = self._make_cache_key(emotion, context)
+
+        # Read the version before loading the votes, so ids loaded before a concurrent vote is saved
+        # are cached under the version from before the vote and loaded again on the next request
+        version = get_vote_version(self.user.pk, emotion_id)
+        cached_value = cache.get(cache_key)
+
+        if cached_value is not None:
+            cached_version, cached_song_ids = cached_value
+
+            if version is not None and cached_version == version:
+                return np.frombuffer(cached_song_ids, dtype=np.int32)
+
+        song_ids = self._load_voted_song_ids(emotion_id, context)
+
+        if version is not None:
+            if cached_value is None:
+                cache.add(cache_key, (version, song_ids.tobytes()), settings.VOTED_SONG_IDS_CACHE_TIMEOUT)
+            else:
+                cache.set(cache_key, (version, song_ids.tobytes()), settings.VOTED_SONG_IDS_CACHE_TIMEOUT)
+
+        return song_ids
+
+    def add_voted_song_ids(self, emotion, song_ids_by_context, version):
+        """
+        Add the songs the user just voted on to the cached ids of songs voted on for the emotion, for both
+        the context of the votes and all contexts. Cached ids are only updated if they were cached for the
+        version of the votes right before the new votes, so they can't miss a vote saved by another request.
+
+        :param emotion: (str) Emotion of the votes
+        :param song_ids_by_context: (dict) Mapping of context to the ids of songs voted on for the context
+        :param version: (int|None) Version of the votes after saving the new votes, see `update_vote_version`
+        """
+        if version is None:
+            return
+
+        song_ids_by_cache_key = {}
+        for context, song_ids in song_ids_by_context.items():
+            for cache_key in {self._make_cache_key(emotion, context), self._make_cache_key(emotion)}:
+                song_ids_by_cache_key.setdefault(cache_key, []).extend(song_ids)
+
+        updated_values = {}
+        for cache_key, (cached_version, cached_song_ids) in cache.get_many(list(song_ids_by_cache_key)).items():
+            if cached_version != version - 1:
+                continue
+
+            song_ids = np.union1d(
+                np.frombuffer(cached_song_ids, dtype=np.int32),
+                np.array(song_ids_by_cache_key[cache_key], dtype=np.int32)
+            )
+            updated_values[cache_key] = (version, song_ids.tobytes())
+
+        if updated_values:
+            cache.set_many(updated_values, settings.VOTED_SONG_IDS_CACHE_TIMEOUT)
+
+
+class BrowseCandidatePoolManager(object):
+    """
+    Facilitates building and sampling from pools of browse playlist candidates shared by every user.
+
+    Most users browse with UserEmotion attributes at or close to the default attributes of the emotion,
+    so the database is asked the same range question for each of them. A pool holds a shuffled sample of
+    the ids of songs in the browse range around the default attributes of an emotion, for each browse
+    strategy and genre. Pools are cached as the bytes of a NumPy array and rebuilt periodically by
+    `BuildBrowseCandidatePoolsTask`.
+
+    Playlists drawn from a pool only match the live query for users whose attributes are within
+    `settings.BROWSE_CANDIDATE_POOL_DRIFT_THRESHOLD` of the emotion defaults, see `is_near_emotion`.
+    """
+    ALL_GENRES = '*'
+
+    def _make_cache_key(self, emotion, strategy, genre=None):
+        """
+        Make a cache key for storing the candidate pool for the emotion, strategy, and genre
+
+        :param emotion: (str) Emotion of the pool
+        :param strategy: (str) Browse strategy of the pool
+        :param genre: (str) Optional genre of the pool, if not provided use songs in every genre
+
+        :return: (str)
+        """
+        return 'browse:candidate-pool:{}:{}:{}'.format(emotion, strategy, genre or self.ALL_GENRES)
+
+    @staticmethod
+    def is_near_emotion(emotion, energy, valence, danceability):
+        """
+        Determine if the attributes for a browse playlist are close enough to the default attributes of
+        the emotion for the playlist to be drawn from the candidate pools for the emotion
+
+        :param emotion: (Emotion) Emotion of the browse playlist
+        :param energy: (float) Energy estimate for the browse playlist
+        :param valence: (float) Valence estimate for the browse playlist
+        :param danceability: (float) Danceability estimate for the browse playlist
+
+        :return: (bool)
+        """
+        threshold = settings.BROWSE_CANDIDATE_POOL_DRIFT_THRESHOLD
+
+        return (
+            abs(emotion.energy - energy) <= threshold and
+            abs(emotion.valence - valence) <= threshold and
+            abs(emotion.danceability - danceability) <= threshold
+        )
+
+    def build_pool(self, emotion, strategy, genre=None):
+        """
+        Build the candidate pool for the emotion, strategy, and genre from the live browse query
+
+        :param emotion: (Emotion) Emotion to build the pool around
+        :param strategy: (str) Browse strategy to filter songs by
+        :param genre: (str) Optional genre of songs in the pool
+
+        :return: (np.ndarray) Shuffled array of song ids
+        """
+        playlist = generate_browse_playlist(
+            emotion.energy,
+            emotion.valence,
+            emotion.danceability,
+            strategy=strategy,
+            jitter=settings.BROWSE_DEFAULT_JITTER,
+            genre=genre
+        )
+
+        return np.fromiter(
+            playlist.values_list('id', flat=True)[:settings.BROWSE_CANDIDATE_POOL_SIZE],
+            dtype=np.int32
+        )
+
+    def build_pools(self):
+        """
+        Build and cache the candidate pools for every emotion, strategy, and genre
+
+        :return: (int) Number of pools cached
+        """
+        genres = [None] + get_genres()
+        pools = {}
+
+        for emotion in get_emotion_registry().all():
+            for strategy in settings.BROWSE_PLAYLIST_STRATEGIES:
+                for genre in genres:
+                    cache_key = self._make_cache_key(emotion.name, strategy, genre)
+                    pools[cache_key] = self.build_pool(emotion, strategy, genre).tobytes()
+
+        cache.set_many(pools, settings.BROWSE_CANDIDATE_POOL_CACHE_TIMEOUT)
+
+        return len(pools)
+
+    def get_playlist(self, emotion, strategy, limit, genre=None, exclude_song_ids=None):
+        """
+        Sample a browse playlist from the candidate pool for the emotion, strategy, and genre
+
+        :param emotion: (str) Emotion of the browse playlist
+        :param strategy: (str) Browse strategy of the browse playlist
+        :param limit: (int) Number of songs to return
+        :param genre: (str) Optional genre of songs to return
+        :param exclude_song_ids: (np.ndarray) Optional ids of songs to leave out of the playlist
+
+        :return: (list[Song]|None) Randomly ordered songs, or None if the pool is not cached or does not
+            have `limit` songs left after leaving out the excluded songs
+        """
+        cached_song_ids = cache.get(self._make_cache_key(emotion, strategy, genre))
+
+        if cached_song_ids is None:
+            return None
+
+        song_ids = np.frombuffer(cached_song_ids, dtype=np.int32)
+
+        if exclude_song_ids is not None and len(exclude_song_ids):
+            song_ids = song_ids[~np.isin(song_ids, exclude_song_ids)]
+
+        if len(song_ids) < limit:
+            return None
+
+        sampled_song_ids = np.random.choice(song_ids, limit, replace=False).tolist()
+
+        return CachedPlaylistManager.get_playlist_songs(sampled_song_ids)
 
 
 def filter_duplicate_votes_on_song_from_playlist(user_votes):
     """
     Filter queryset of UserSongVotes on unique songs (prevent the same song from appearing twice in the playlist
-    even if there are multiple votes for the song)
+    even if there are multiple votes for the song). The most recent vote for each song is kept.
+
+    Votes are deduplicated on `song_id` with a single DISTINCT ON pass over the votes, which needs the votes
+    to be ordered by song. Use `order_votes_by_newest` for a playlist ordered from newest to oldest vote.
 
     :param user_votes: (QuerySet) Collection of votes a user has previously voted as making them feel an Emotion
 
-    :return: (Queryset) Collection of votes without duplicate votes for the same song
+    :return: (Queryset) Collection of votes without duplicate votes for the same song, ordered by song
+    """
+    return user_votes.select_related('song').order_by('song_id', '-created', '-id').distinct('song_id')
+
+
+class _SubqueryTable(BaseTable):
     """
-    vote_ids = user_votes.distinct('song__code').values_list('id', flat=True)
+    Base table of a query that selects from a subquery of the same model instead of the table for the model
+    """
+
+    def __init__(self, queryset, alias):
+        super().__init__(queryset.model._meta.db_table, alias)
+        self.queryset = queryset
+
+    def as_sql(self, compiler, connection):
+        sql, params = self.queryset.query.get_compiler(connection=connection).as_sql()
+
+        return '({}) {}'.format(sql, compiler.quote_name_unless_alias(self.table_alias)), params
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(self.queryset, change_map.get(self.table_alias, self.table_alias))
 
-    return UserSongVote.objects.select_related('song').filter(id__in=vote_ids).order_by('-created')
+
+def order_votes_by_newest(votes):
+    """
+    Order a collection of votes from newest to oldest, by selecting from the votes in a subquery. Use
+    this for querysets that can't be ordered on their own, like votes deduplicated by
+    `filter_duplicate_votes_on_song_from_playlist`. Filters on the returned queryset (like keyset
+    pagination) and window aggregates apply to the votes returned by the subquery.
+
+    :param votes: (QuerySet) Collection of `UserSongVote` records
+
+    :return: (QuerySet) Collection of votes, newest first
+    """
+    ordered_votes = UserSongVote.objects.select_related('song').order_by('-created', '-id')
+
+    alias = ordered_votes.query.get_initial_alias()
+    ordered_votes.query.alias_map[alias] = _SubqueryTable(votes.select_related(None), alias)
+
+    return ordered_votes
+
+
+def get_playlist_analytics_annotations():
+    """
+    Return window aggregates of the average song attributes over a whole emotion playlist. Adding these
+    to the query for a page of the playlist computes the analytics for the playlist in the same statement
+    as the page, as long as the page is selected with LIMIT/OFFSET (which are applied after the window).
+
+    :return: (dict) Mapping of annotation name to window expression, for each song attribute
+    """
+    return {
+        'playlist_{}_avg'.format(attribute): Window(Avg('song__{}'.format(attribute)))
+        for attribute in ('valence', 'energy', 'danceability')
+    }
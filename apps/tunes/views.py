@@ -3,22 +3,32 @@ import random
 import re
 
 from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.db import IntegrityError
 from django.http import Http404, JsonResponse
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from rest_framework import generics, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from accounts.models import UserSongVote
-from base.mixins import DeleteRequestValidatorMixin, GetRequestValidatorMixin, PostRequestValidatorMixin
+from accounts.utils import dispatch_update_user_emotion_attributes, get_vote_version, update_vote_version
+from base.mixins import (
+    ConditionalGetMixin,
+    DeleteRequestValidatorMixin,
+    GetRequestValidatorMixin,
+    PostRequestValidatorMixin,
+)
+from base.pagination import AnnotatedPageNumberPagination, CreatedKeysetPagination
 from libs.moody_logging import auto_fingerprint, update_logging_data
-from libs.utils import average
+from libs.utils import average, get_version_counter
 from spotify.models import SpotifyUserData
+from tunes.emotion_registry import get_emotion_registry
 from tunes.models import Emotion, Song
 from tunes.serializers import (
     BrowseSongsRequestSerializer,
+    BulkVoteInfoRequestSerializer,
+    BulkVoteInfoSerializer,
+    BulkVoteSongsRequestSerializer,
     DeleteVoteRequestSerializer,
     EmptyResponseSerializer,
     LastPlaylistSerializer,
@@ -30,7 +40,17 @@ from tunes.serializers import (
     VoteInfoSerializer,
     VoteSongsRequestSerializer,
 )
-from tunes.utils import CachedPlaylistManager, filter_duplicate_votes_on_song_from_playlist, generate_browse_playlist
+from tunes.utils import (
+    BrowseCandidatePoolManager,
+    CachedPlaylistManager,
+    VotedSongIdsManager,
+    filter_duplicate_votes_on_song_from_playlist,
+    generate_browse_playlist,
+    generate_nearest_browse_playlist,
+    get_genres,
+    get_playlist_analytics_annotations,
+    order_votes_by_newest,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -66,6 +86,7 @@ class BrowseView(GetRequestValidatorMixin, generics.ListAPIView):
         jitter = self.cleaned_data.get('jitter')
         limit = self.cleaned_data.get('limit') or self.default_limit
         artist = self.cleaned_data.get('artist')
+        mode = self.cleaned_data.get('mode') or settings.BROWSE_DEFAULT_MODE
 
         energy = None
         valence = None
@@ -98,7 +119,7 @@ class BrowseView(GetRequestValidatorMixin, generics.ListAPIView):
             # If the user doesn't have a UserEmotion record for the emotion, fall back to the
             # default attributes for the emotion
             if not user_emotion:
-                emotion = Emotion.objects.get(name=self.cleaned_data['emotion'])
+                emotion = get_emotion_registry().get(name=self.cleaned_data['emotion'])
                 energy = emotion.energy
                 valence = emotion.valence
                 danceability = emotion.danceability
@@ -126,6 +147,7 @@ class BrowseView(GetRequestValidatorMixin, generics.ListAPIView):
                 'emotion': Emotion.get_full_name_from_keyword(self.cleaned_data['emotion']),
                 'genre': self.cleaned_data.get('genre'),
                 'context': self.cleaned_data.get('context'),
+                'mode': mode,
                 'strategy': strategy,
                 'energy': energy,
                 'valence': valence,
@@ -137,17 +159,38 @@ class BrowseView(GetRequestValidatorMixin, generics.ListAPIView):
             }
         )
 
-        playlist = generate_browse_playlist(
-            energy,
-            valence,
-            danceability,
-            strategy=strategy,
-            limit=limit,
-            jitter=jitter,
-            artist=artist,
-            top_artists=top_artists,
-            songs=queryset
-        )
+        if mode == 'nearest':
+            playlist = generate_nearest_browse_playlist(
+                energy,
+                valence,
+                danceability,
+                limit,
+                genre=self.cleaned_data.get('genre'),
+                exclude_song_ids=self.get_previously_voted_song_ids(),
+                songs=queryset
+            )
+        else:
+            playlist = None
+
+            # Candidate pools are built around the emotion defaults for the default jitter, and don't
+            # account for the artist or the top artists of the user
+            if settings.BROWSE_USE_CANDIDATE_POOLS and jitter == self.default_jitter and not (artist or top_artists):
+                playlist = self.get_playlist_from_candidate_pool(energy, valence, danceability, strategy, limit)
+
+            if playlist is None:
+                playlist = generate_browse_playlist(
+                    energy,
+                    valence,
+                    danceability,
+                    strategy=strategy,
+                    limit=limit,
+                    jitter=jitter,
+                    artist=artist,
+                    top_artists=top_artists,
+                    genre=self.cleaned_data.get('genre'),
+                    songs=queryset,
+                    exclude_song_ids=self.get_previously_voted_song_ids()
+                )
 
         cached_playlist_manager.cache_browse_playlist(
             playlist,
@@ -158,51 +201,81 @@ class BrowseView(GetRequestValidatorMixin, generics.ListAPIView):
 
         return playlist
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-
-        if self.cleaned_data.get('genre'):
-            queryset = queryset.filter(genre=self.cleaned_data['genre'])
-
-        user_votes = self.request.user.usersongvote_set.filter(emotion__name=self.cleaned_data['emotion'])
-
-        # If a context is provided, only exclude songs a user has voted on for that context
-        # This allows a song to be a candidate for multiple context playlists for a particular emotion
-        # Songs in WORK context could also be in PARTY context, maybe?
-        if self.cleaned_data.get('context'):
-            user_votes = user_votes.filter(context=self.cleaned_data['context'])
+    def get_playlist_from_candidate_pool(self, energy, valence, danceability, strategy, limit):
+        """
+        Draw the browse playlist from the shared candidate pool for the emotion, if the attributes for the
+        playlist are close enough to the emotion defaults and the pool has enough songs the user has not
+        voted on
+
+        :return: (list[Song]|None) Playlist, or None if the live query should be used instead
+        """
+        emotion = get_emotion_registry().get(name=self.cleaned_data['emotion'])
+
+        if not BrowseCandidatePoolManager.is_near_emotion(emotion, energy, valence, danceability):
+            return None
+
+        return BrowseCandidatePoolManager().get_playlist(
+            emotion.name,
+            strategy,
+            limit,
+            genre=self.cleaned_data.get('genre'),
+            exclude_song_ids=self.get_previously_voted_song_ids()
+        )
 
-        previously_voted_song_ids = user_votes.values_list('song__id', flat=True)
+    def get_previously_voted_song_ids(self):
+        if not hasattr(self, '_previously_voted_song_ids'):
+            # If a context is provided, only exclude songs a user has voted on for that context
+            # This allows a song to be a candidate for multiple context playlists for a particular emotion
+            # Songs in WORK context could also be in PARTY context, maybe?
+            self._previously_voted_song_ids = VotedSongIdsManager(self.request.user).get_voted_song_ids(
+                self.cleaned_data['emotion'],
+                self.cleaned_data.get('context')
+            )
 
-        return queryset.exclude(id__in=previously_voted_song_ids)
+        return self._previously_voted_song_ids
 
 
-class LastPlaylistView(generics.RetrieveAPIView):
+class LastPlaylistView(ConditionalGetMixin, generics.RetrieveAPIView):
     """
     Return a JSON response of the cached user playlist if one exists.
     """
     serializer_class = LastPlaylistSerializer
 
+    def get_cached_playlist(self):
+        if not hasattr(self, '_cached_playlist'):
+            self._cached_playlist = CachedPlaylistManager(self.request.user).retrieve_cached_browse_playlist()
+
+        return self._cached_playlist
+
+    def get_etag_versions(self):
+        cached_playlist = self.get_cached_playlist()
+
+        if cached_playlist is None:
+            return None
+
+        emotion = get_emotion_registry().get(name=cached_playlist['emotion'])
+
+        return [
+            cached_playlist,
+            get_vote_version(self.request.user.pk, emotion.pk),
+            get_version_counter(settings.SONG_CATALOG_VERSION_CACHE_KEY),
+        ]
+
     @update_logging_data
     def get_object(self, **kwargs):
-        cached_playlist_manager = CachedPlaylistManager(self.request.user)
-        cached_playlist = cached_playlist_manager.retrieve_cached_browse_playlist()
+        cached_playlist = self.get_cached_playlist()
 
         if cached_playlist:
             emotion = cached_playlist['emotion']
-            playlist = cached_playlist['playlist']
-            context = cached_playlist.get('context')
-            description = cached_playlist.get('description')
+            context = cached_playlist['context']
+            description = cached_playlist['description']
 
             # Filter out songs user has already voted on from the playlist
             # for the emotion to prevent double votes on songs
-            user_voted_songs = self.request.user.usersongvote_set.filter(
-                emotion__name=emotion
-            ).values_list(
-                'song__pk', flat=True
-            )
+            user_voted_songs = set(VotedSongIdsManager(self.request.user).get_voted_song_ids(emotion).tolist())
 
-            playlist = [song for song in playlist if song.pk not in user_voted_songs]
+            song_ids = [song_id for song_id in cached_playlist['song_ids'] if song_id not in user_voted_songs]
+            playlist = CachedPlaylistManager.get_playlist_songs(song_ids)
 
             return {
                 'emotion': emotion,
@@ -257,7 +330,7 @@ class VoteView(PostRequestValidatorMixin, DeleteRequestValidatorMixin, generics.
 
             raise Http404('No song exists with code: {}'.format(self.cleaned_data['song_code']))
 
-        emotion = Emotion.objects.get(name=self.cleaned_data['emotion'])
+        emotion = get_emotion_registry().get(name=self.cleaned_data['emotion'])
 
         vote_data = {
             'user_id': self.request.user.id,
@@ -273,6 +346,12 @@ class VoteView(PostRequestValidatorMixin, DeleteRequestValidatorMixin, generics.
             vote._trace_id = request.trace_id
             vote.save()
 
+            VotedSongIdsManager(self.request.user).add_voted_song_ids(
+                emotion.name,
+                {vote.context: [song.id]},
+                getattr(vote, '_vote_version', None)
+            )
+
             logger.info(
                 'Saved vote for user {} voting on song {} for emotion {}'.format(
                     self.request.user.username,
@@ -327,10 +406,19 @@ class VoteView(PostRequestValidatorMixin, DeleteRequestValidatorMixin, generics.
 
             raise Http404()
 
+        voted_song_ids_manager = VotedSongIdsManager(self.request.user)
+
         for vote in votes:
             vote._trace_id = request.trace_id
             vote.delete()
 
+            # Deleting a vote keeps the vote around with `vote` set to False, so the song is still voted on
+            voted_song_ids_manager.add_voted_song_ids(
+                self.cleaned_data['emotion'],
+                {vote.context: [vote.song_id]},
+                getattr(vote, '_vote_version', None)
+            )
+
             logger.info(
                 'Deleted vote for user {} with song {} and emotion {} and context {}'.format(
                     self.request.user.username,
@@ -349,11 +437,137 @@ class VoteView(PostRequestValidatorMixin, DeleteRequestValidatorMixin, generics.
         return JsonResponse({'status': 'OK'})
 
 
-class PlaylistView(GetRequestValidatorMixin, generics.ListAPIView):
+class BulkVoteView(PostRequestValidatorMixin, generics.CreateAPIView):
+    """
+    post: Register many `UserSongVote` records for the given request user at once. Each vote is validated and
+    saved the same way as a POST to /tunes/vote/, and the response includes the status code that request would
+    have returned for each vote.
+    """
+    post_request_serializer = BulkVoteSongsRequestSerializer
+
+    serializer_class = EmptyResponseSerializer
+
+    if settings.DEBUG:  # pragma: no cover
+        from base.documentation_utils import build_documentation_for_request_serializer
+        schema = build_documentation_for_request_serializer(BulkVoteSongsRequestSerializer, 'form')
+
+    @update_logging_data
+    def create(self, request, *args, **kwargs):
+        results = []
+        valid_votes = []
+
+        for vote_data in self.cleaned_data['votes']:
+            serializer = VoteSongsRequestSerializer(data=vote_data)
+
+            if serializer.is_valid():
+                results.append({'song_code': serializer.validated_data['song_code'], 'status': None})
+                valid_votes.append((len(results) - 1, serializer.validated_data))
+            else:
+                results.append({
+                    'song_code': vote_data.get('song_code'),
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': serializer.errors,
+                })
+
+        # Resolve every song and emotion in the request up front, instead of one lookup per vote
+        song_codes = {vote['song_code'] for _, vote in valid_votes}
+        song_ids_by_code = {}
+        for code, song_id in Song.objects.filter(code__in=song_codes).values_list('code', 'id'):
+            # Codes that match more than one song are treated as missing, the same as in VoteView
+            song_ids_by_code[code] = None if code in song_ids_by_code else song_id
+
+        emotion_registry = get_emotion_registry()
+        emotion_ids_by_name = {
+            name: emotion_registry.get(name=name).id for name in {vote['emotion'] for _, vote in valid_votes}
+        }
+
+        existing_votes = set(
+            UserSongVote.objects.filter(
+                user=self.request.user,
+                song_id__in=[song_id for song_id in song_ids_by_code.values() if song_id],
+            ).values_list('song_id', 'emotion_id', 'context')
+        )
+
+        new_votes = []
+        for index, vote in valid_votes:
+            song_id = song_ids_by_code.get(vote['song_code'])
+            if not song_id:
+                results[index]['status'] = status.HTTP_404_NOT_FOUND
+                continue
+
+            emotion_id = emotion_ids_by_name[vote['emotion']]
+            context = vote.get('context', '')
+
+            # Votes that already exist, or appear earlier in this request, would violate the unique
+            # constraint on UserSongVote and are rejected the same way VoteView rejects them
+            if (song_id, emotion_id, context) in existing_votes:
+                results[index]['status'] = status.HTTP_400_BAD_REQUEST
+                continue
+
+            existing_votes.add((song_id, emotion_id, context))
+            results[index]['status'] = status.HTTP_201_CREATED
+            new_votes.append(UserSongVote(
+                user_id=self.request.user.id,
+                emotion_id=emotion_id,
+                song_id=song_id,
+                vote=vote['vote'],
+                context=context,
+                description=vote.get('description', ''),
+            ))
+
+        # `bulk_create` does not send the post_save signal, so we update the vote versions (adding the new
+        # votes to the cached voted song ids) and dispatch the UserEmotion attribute updates ourselves, once
+        # for each emotion upvoted
+        UserSongVote.objects.bulk_create(new_votes, ignore_conflicts=True)
+
+        song_ids_by_emotion = {}
+        for vote in new_votes:
+            song_ids_by_context = song_ids_by_emotion.setdefault(vote.emotion_id, {})
+            song_ids_by_context.setdefault(vote.context, []).append(vote.song_id)
+
+        voted_song_ids_manager = VotedSongIdsManager(self.request.user)
+        for emotion_id, song_ids_by_context in song_ids_by_emotion.items():
+            voted_song_ids_manager.add_voted_song_ids(
+                emotion_registry.get(pk=emotion_id).name,
+                song_ids_by_context,
+                update_vote_version(self.request.user.id, emotion_id)
+            )
+
+        upvoted_song_ids_by_emotion = {}
+        for vote in new_votes:
+            if vote.vote:
+                upvoted_song_ids_by_emotion.setdefault(vote.emotion_id, []).append(vote.song_id)
+
+        for emotion_id, song_ids in upvoted_song_ids_by_emotion.items():
+            dispatch_update_user_emotion_attributes(
+                self.request.user.id,
+                emotion_id,
+                song_id=song_ids[0] if len(song_ids) == 1 else None,
+                trace_id=request.trace_id
+            )
+
+        logger.info(
+            'Saved {} of {} votes for user {}'.format(
+                len(new_votes),
+                len(results),
+                self.request.user.username
+            ),
+            extra={
+                'fingerprint': auto_fingerprint('created_bulk_votes', **kwargs),
+                'results': results,
+                'trace_id': request.trace_id,
+            }
+        )
+
+        return JsonResponse({'results': results, 'trace_id': request.trace_id})
+
+
+class PlaylistView(GetRequestValidatorMixin, ConditionalGetMixin, generics.ListAPIView):
     """
     Returns a JSON response of songs that the user has voted as making them feel a desired emotion.
     """
     serializer_class = PlaylistSerializer
+    pagination_class = AnnotatedPageNumberPagination
     queryset = UserSongVote.objects.all()
 
     get_request_serializer = PlaylistSongsRequestSerializer
@@ -377,6 +591,7 @@ class PlaylistView(GetRequestValidatorMixin, generics.ListAPIView):
                 'context': self.cleaned_data.get('context'),
                 'artist': self.cleaned_data.get('artist'),
                 'page': self.request.GET.get('page'),
+                'pagination': self.cleaned_data.get('pagination'),
                 'trace_id': request.trace_id,
             }
         )
@@ -385,19 +600,39 @@ class PlaylistView(GetRequestValidatorMixin, generics.ListAPIView):
 
         first_page = last_page = None
 
-        if resp.data['previous']:
-            first_page = re.sub(r'&page=[0-9]*', '', resp.data['previous'])
+        if isinstance(self.paginator, CreatedKeysetPagination):
+            if resp.data['previous']:
+                first_page = self.paginator.get_first_link()
 
-        if resp.data['next']:
-            last_page = re.sub(r'page=[0-9]*', 'page=last', resp.data['next'])
+            if resp.data['next']:
+                last_page = self.paginator.get_last_link()
+        else:
+            if resp.data['previous']:
+                first_page = re.sub(r'&page=[0-9]*', '', resp.data['previous'])
 
-        queryset = self.filter_queryset(self.get_queryset())
+            if resp.data['next']:
+                last_page = re.sub(r'page=[0-9]*', 'page=last', resp.data['next'])
 
         # Update response data with analytics for emotion
-        votes_for_emotion_data = average(queryset, 'song__valence', 'song__energy', 'song__danceability')
-        valence = votes_for_emotion_data['song__valence__avg'] or 0
-        energy = votes_for_emotion_data['song__energy__avg'] or 0
-        danceability = votes_for_emotion_data['song__danceability__avg'] or 0
+        if isinstance(self.paginator, CreatedKeysetPagination):
+            # Keyset pages are selected in the WHERE clause, which is applied before window aggregates,
+            # so the analytics for the whole playlist need their own query
+            queryset = self.filter_queryset(self.get_queryset())
+            votes_for_emotion_data = average(queryset, 'song__valence', 'song__energy', 'song__danceability')
+            valence = votes_for_emotion_data['song__valence__avg'] or 0
+            energy = votes_for_emotion_data['song__energy__avg'] or 0
+            danceability = votes_for_emotion_data['song__danceability__avg'] or 0
+        else:
+            # Analytics were computed over the whole playlist in the query for the page. Round them
+            # the same way as `average` to keep the response the same as for keyset pages
+            page = self.paginator.page
+            averages = [
+                getattr(page[0], 'playlist_{}_avg'.format(attribute)) if len(page) else None
+                for attribute in ('valence', 'energy', 'danceability')
+            ]
+
+            # Averages are None without songs on the page, and can be 0 for an attribute on their own
+            valence, energy, danceability = [round(value, 2) if value is not None else 0 for value in averages]
 
         # Normalize emotion data as whole numbers
         normalized_valence = valence * 100
@@ -415,6 +650,27 @@ class PlaylistView(GetRequestValidatorMixin, generics.ListAPIView):
 
         return resp
 
+    def get_etag_versions(self):
+        emotion = get_emotion_registry().get(name=self.cleaned_data['emotion'])
+
+        return [
+            get_vote_version(self.request.user.pk, emotion.pk),
+            get_version_counter(settings.SONG_CATALOG_VERSION_CACHE_KEY),
+        ]
+
+    def get_page_annotations(self):
+        return get_playlist_analytics_annotations()
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.cleaned_data.get('pagination') == 'cursor':
+                self._paginator = CreatedKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+
+        return self._paginator
+
     def filter_queryset(self, queryset):
         if self.cleaned_data.get('genre'):
             queryset = queryset.filter(song__genre=self.cleaned_data['genre'])
@@ -425,30 +681,35 @@ class PlaylistView(GetRequestValidatorMixin, generics.ListAPIView):
         if self.cleaned_data.get('artist'):
             queryset = queryset.filter(song__artist__icontains=self.cleaned_data['artist'])
 
-        return filter_duplicate_votes_on_song_from_playlist(queryset)
+        return order_votes_by_newest(filter_duplicate_votes_on_song_from_playlist(queryset))
 
     def get_queryset(self):
         queryset = super().get_queryset()
 
         return queryset.filter(
             user=self.request.user,
-            emotion__name=self.cleaned_data['emotion'],
+            emotion_id=get_emotion_registry().get(name=self.cleaned_data['emotion']).id,
             vote=True
         )
 
 
-class OptionView(generics.GenericAPIView):
+class OptionView(ConditionalGetMixin, generics.RetrieveAPIView):
     """
     Returns a JSON response of available site options. This returns the emotions we have in our system, as well as the
     different genres of songs in our database.
     """
     serializer_class = OptionsSerializer
 
-    @method_decorator(cache_page(settings.OPTIONS_CACHE_TIMEOUT))
-    def get(self, request, *args, **kwargs):
+    def get_etag_versions(self):
+        return [
+            get_version_counter(settings.EMOTION_VERSION_CACHE_KEY),
+            get_version_counter(settings.GENRE_VERSION_CACHE_KEY),
+        ]
+
+    def retrieve(self, request, *args, **kwargs):
         # Build map of emotions including code name and display name
         emotion_choices = []
-        for emotion in Emotion.objects.all():
+        for emotion in get_emotion_registry().all():
             emotion_choices.append({
                 'name': emotion.full_name,
                 'code': emotion.name
@@ -464,7 +725,7 @@ class OptionView(generics.GenericAPIView):
             })
 
         # Retrieve list of song genres
-        genre_choices = Song.objects.all().values_list('genre', flat=True).distinct()
+        genre_choices = get_genres()
 
         data = {
             'emotions': emotion_choices,
@@ -502,3 +763,38 @@ class VoteInfoView(GetRequestValidatorMixin, generics.RetrieveAPIView):
         )
 
         return {'contexts': contexts}
+
+
+class BulkVoteInfoView(GetRequestValidatorMixin, generics.RetrieveAPIView):
+    """
+    Returns a JSON response of info on votes for a given user and emotion for many songs at once, as a mapping
+    of song code to the different contexts for the song that the user has voted on.
+    """
+
+    serializer_class = BulkVoteInfoSerializer
+
+    get_request_serializer = BulkVoteInfoRequestSerializer
+
+    if settings.DEBUG:  # pragma: no cover
+        from base.documentation_utils import build_documentation_for_request_serializer
+        schema = build_documentation_for_request_serializer(BulkVoteInfoRequestSerializer, 'query')
+
+    def get_object(self):
+        contexts = {song_code: [] for song_code in self.cleaned_data['song_codes']}
+
+        contexts_by_song = UserSongVote.objects.filter(
+            user=self.request.user,
+            emotion__name=self.cleaned_data['emotion'],
+            song__code__in=contexts.keys(),
+        ).values(
+            'song__code',
+        ).annotate(
+            contexts=ArrayAgg('context'),
+        ).values_list(
+            'song__code',
+            'contexts',
+        )
+
+        contexts.update(contexts_by_song)
+
+        return {'contexts': contexts}
@@ -1,7 +1,10 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
 from libs.tests.helpers import MoodyUtil
-from libs.utils import average
+from libs.utils import RateLimiter, average, get_version_counter, increment_cache_counter
 from tunes.models import Song
 
 
@@ -49,3 +52,82 @@ class TestAverage(TestCase):
         self.assertEqual(calculated_attrs['valence__avg'], expected_valence)
         self.assertEqual(calculated_attrs['energy__avg'], expected_energy)
         self.assertEqual(calculated_attrs['danceability__avg'], expected_danceability)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestIncrementCacheCounter(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_increment_cache_counter_creates_and_increments_counter(self):
+        self.assertEqual(increment_cache_counter('test-counter'), 1)
+        self.assertEqual(increment_cache_counter('test-counter'), 2)
+        self.assertEqual(cache.get('test-counter'), 2)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_increment_cache_counter_with_dummy_cache_returns_none(self):
+        self.assertIsNone(increment_cache_counter('test-counter'))
+
+    def test_increment_cache_counter_creates_counter_from_initial_value(self):
+        self.assertEqual(increment_cache_counter('test-counter', initial=10), 11)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestGetVersionCounter(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('libs.utils.time.time')
+    def test_missing_counter_is_created_from_current_time(self, mock_time):
+        mock_time.return_value = 100
+
+        self.assertEqual(get_version_counter('test-version'), 100000)
+        self.assertEqual(cache.get('test-version'), 100000)
+
+    def test_returns_existing_counter(self):
+        cache.set('test-version', 5)
+
+        self.assertEqual(get_version_counter('test-version'), 5)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_with_dummy_cache_returns_none(self):
+        self.assertIsNone(get_version_counter('test-version'))
+
+
+@mock.patch('libs.utils.time.sleep')
+@mock.patch('libs.utils.time.monotonic')
+class TestRateLimiter(TestCase):
+    def test_acquire_within_burst_does_not_wait(self, mock_monotonic, mock_sleep):
+        mock_monotonic.return_value = 100
+        rate_limiter = RateLimiter(rate=1, burst=2)
+
+        self.assertEqual(rate_limiter.acquire(), 0)
+        self.assertEqual(rate_limiter.acquire(), 0)
+        mock_sleep.assert_not_called()
+
+    def test_acquire_over_burst_waits_for_token(self, mock_monotonic, mock_sleep):
+        mock_monotonic.return_value = 100
+        rate_limiter = RateLimiter(rate=2)
+
+        rate_limiter.acquire()
+        wait = rate_limiter.acquire()
+
+        self.assertEqual(wait, .5)
+        mock_sleep.assert_called_once_with(.5)
+
+    def test_waiting_callers_are_spaced_by_rate(self, mock_monotonic, mock_sleep):
+        mock_monotonic.return_value = 100
+        rate_limiter = RateLimiter(rate=2)
+
+        waits = [rate_limiter.acquire() for _ in range(3)]
+
+        self.assertEqual(waits, [0, .5, 1])
+
+    def test_bucket_refills_over_time(self, mock_monotonic, mock_sleep):
+        mock_monotonic.return_value = 100
+        rate_limiter = RateLimiter(rate=2)
+        rate_limiter.acquire()
+
+        mock_monotonic.return_value = 101
+
+        self.assertEqual(rate_limiter.acquire(), 0)
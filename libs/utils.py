@@ -1,3 +1,7 @@
+import threading
+import time
+
+from django.core.cache import cache
 from django.core.exceptions import FieldError
 from django.db.models import Avg
 
@@ -30,3 +34,93 @@ def average(collection, *criteria, precision=2):
             collection.model.__name__,
             criteria
         ))
+
+
+def increment_cache_counter(key, initial=0):
+    """
+    Increment the integer counter stored in the cache for `key`, creating the counter if it does not exist.
+    Counters are stored without an expiration, and are useful as version numbers to let other processes know
+    that data they are holding on to is out of date.
+
+    :param key: (str) Cache key for the counter
+    :param initial: (int) Value to create the counter with before incrementing it, if it does not exist
+
+    :return: (int|None) New value of the counter, or None if the cache backend did not store the counter
+    """
+    cache.add(key, initial, timeout=None)
+
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Counter was evicted before we could increment it, or the cache backend does not store values
+        return None
+
+
+def get_version_counter_seed():
+    """
+    Return a starting value for version counters. Counters start from the current time instead of zero,
+    so a counter that was evicted from the cache and created again does not repeat a version it held
+    before (unless it was bumped more than once a millisecond).
+
+    :return: (int) Current time in milliseconds
+    """
+    return int(time.time() * 1000)
+
+
+def get_version_counter(key):
+    """
+    Return the value of the version counter stored in the cache for `key`, creating the counter from
+    `get_version_counter_seed()` if it does not exist. Bump the counter with
+    `increment_cache_counter(key, initial=get_version_counter_seed())`.
+
+    :param key: (str) Cache key for the counter
+
+    :return: (int|None) Value of the counter, or None if the cache backend did not store the counter
+    """
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, get_version_counter_seed(), timeout=None)
+        version = cache.get(key)
+
+    return version
+
+
+class RateLimiter(object):
+    """
+    Thread safe token bucket for spreading calls to an external service over time. Each call to `acquire()` takes
+    a token from the bucket, and blocks until the token is available if the bucket is empty. The bucket holds up
+    to `burst` tokens and refills at `rate` tokens a second, so threads sharing a limiter share one budget.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: (float) Number of tokens added to the bucket each second
+        :param burst: (int) Max number of tokens the bucket can hold
+        """
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting until one is available
+
+        :return: (float) Number of seconds spent waiting for the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+
+            # Reserve the token now, even if it is not available yet, so waiting threads are served in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
@@ -152,12 +152,40 @@ CACHES = {
     }
 }
 
+EMOTION_VERSION_CACHE_KEY = 'emotion-version'
 GENRE_CHOICES_CACHE_KEY = 'song-genre-choices'
+GENRE_VERSION_CACHE_KEY = 'song-genre-version'
+SONG_CATALOG_VERSION_CACHE_KEY = 'song-catalog-version'
+USER_EMOTION_ATTRIBUTES_UPDATE_COALESCED_CACHE_KEY = 'user-emotion-attributes-update-coalesced'
+USER_EMOTION_ATTRIBUTES_UPDATE_DISPATCHED_CACHE_KEY = 'user-emotion-attributes-update-dispatched'
 SESSION_CACHE_ALIAS = 'session'
 
+# Put an in-process LRU cache in front of the default cache, to save a round trip to the cache
+# server for hot keys that are read far more often than they are written
+if env.bool('MTDJ_CACHE_USE_LOCAL_TIER', default=False):
+    CACHES['default-remote'] = CACHES['default']
+    CACHES['default'] = {
+        'BACKEND': 'base.cache.TwoTierCache',
+        'LOCATION': 'default-remote',
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('MTDJ_CACHE_LOCAL_TIER_MAX_ENTRIES', default=1000),
+            'TIMEOUT': env.int('MTDJ_CACHE_LOCAL_TIER_TIMEOUT', default=60),
+            'VERSION_CHECK_INTERVAL': env.int('MTDJ_CACHE_LOCAL_TIER_VERSION_CHECK_INTERVAL', default=1),
+            'POLICIES': {
+                # Only keys shared by every user and rarely written are kept in the local tier. A write to a
+                # local key drops the local values for its whole policy in every process, so per-user keys
+                # (written on most votes and browse requests) would keep flushing the local tier
+                '': {'local': False},
+                GENRE_CHOICES_CACHE_KEY: {'timeout': 60 * 10},
+                'browse:candidate-pool:': {'timeout': 60 * 5},
+            },
+        },
+    }
+
 BROWSE_PLAYLIST_CACHE_TIMEOUT = 60 * 10  # 10 minutes
+VOTED_SONG_IDS_CACHE_TIMEOUT = 60 * 60  # 1 hour
+BROWSE_CANDIDATE_POOL_CACHE_TIMEOUT = 60 * 60  # 1 hour, to outlive a failed rebuild of the pools
 GENRE_CHOICES_CACHE_TIMEOUT = 60 * 60 * 24 * 7  # 1 week
-OPTIONS_CACHE_TIMEOUT = 60 * 60 * 24 * 7  # 1 week
 
 AUTH_USER_MODEL = 'accounts.MoodyUser'
 LOGIN_URL = '/accounts/login/'
@@ -18,9 +18,64 @@ BROWSE_DEFAULT_JITTER = env.float('MTDJ_BROWSE_DEFAULT_JITTER', default=0.05)
 BROWSE_DEFAULT_LIMIT = env.int('MTDJ_BROWSE_DEFAULT_LIMIT', default=9)
 BROWSE_PLAYLIST_STRATEGIES = ['energy', 'valence', 'danceability']
 
+# Method used to pick a random sample of songs for browse playlists. One of:
+#   random: ORDER BY random() over every matching song
+#   random_key: range scan over the indexed Song.random_key column from a random starting point
+#   tablesample: ORDER BY random() over a TABLESAMPLE of the song table, falling back to random_key if too small
+BROWSE_PLAYLIST_SAMPLING_METHODS = ['random', 'random_key', 'tablesample']
+BROWSE_PLAYLIST_SAMPLING_METHOD = env.str('MTDJ_BROWSE_PLAYLIST_SAMPLING_METHOD', default='random_key')
+BROWSE_PLAYLIST_TABLESAMPLE_PERCENTAGE = env.float('MTDJ_BROWSE_PLAYLIST_TABLESAMPLE_PERCENTAGE', default=10)
+SONG_RANDOM_KEY_SHUFFLE_BATCH_SIZE = env.int('MTDJ_SONG_RANDOM_KEY_SHUFFLE_BATCH_SIZE', default=10000)
+
+# In-process index of song attributes used to pick browse playlist candidates without range queries
+BROWSE_USE_SONG_FEATURE_INDEX = env.bool('MTDJ_BROWSE_USE_SONG_FEATURE_INDEX', default=False)
+SONG_FEATURE_INDEX_FETCH_BATCH_SIZE = 50
+SONG_FEATURE_INDEX_MEMORY_BUDGET = env.int('MTDJ_SONG_FEATURE_INDEX_MEMORY_BUDGET', default=64 * 1024 * 1024)  # 64 MB
+SONG_FEATURE_INDEX_REFRESH_INTERVAL = env.int('MTDJ_SONG_FEATURE_INDEX_REFRESH_INTERVAL', default=60 * 60)  # 1 hour
+SONG_FEATURE_INDEX_VERSION_CHECK_INTERVAL = env.int('MTDJ_SONG_FEATURE_INDEX_VERSION_CHECK_INTERVAL', default=5)
+SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE = env.int('MTDJ_SONG_FEATURE_INDEX_MAX_NEAREST_QUERY_SIZE', default=1000)
+
+# Shared pools of browse playlist candidates around the default attributes of each emotion, used for users
+# whose attributes are within the drift threshold of the emotion defaults
+BROWSE_USE_CANDIDATE_POOLS = env.bool('MTDJ_BROWSE_USE_CANDIDATE_POOLS', default=False)
+BROWSE_CANDIDATE_POOL_SIZE = env.int('MTDJ_BROWSE_CANDIDATE_POOL_SIZE', default=1000)
+BROWSE_CANDIDATE_POOL_DRIFT_THRESHOLD = env.float('MTDJ_BROWSE_CANDIDATE_POOL_DRIFT_THRESHOLD', default=0.01)
+
+# Browse playlist modes. One of:
+#   box: random songs inside a box of `jitter` around the emotion attributes
+#   nearest: the songs closest to the emotion attributes, using the weighted distance between attributes
+BROWSE_PLAYLIST_MODES = ['box', 'nearest']
+BROWSE_DEFAULT_MODE = 'box'
+BROWSE_NEAREST_FEATURE_WEIGHTS = {
+    'valence': env.float('MTDJ_BROWSE_NEAREST_VALENCE_WEIGHT', default=1.0),
+    'energy': env.float('MTDJ_BROWSE_NEAREST_ENERGY_WEIGHT', default=1.0),
+    'danceability': env.float('MTDJ_BROWSE_NEAREST_DANCEABILITY_WEIGHT', default=1.0),
+}
+
+# Emotion playlist pagination modes. One of:
+#   page: page numbers, with a count of all the songs in the playlist
+#   cursor: keyset pagination on (created, id) with an opaque cursor, only counting songs when asked
+PLAYLIST_PAGINATION_MODES = ['page', 'cursor']
+
+# Seconds between checks of the emotion version counter by the in-process emotion registry
+EMOTION_REGISTRY_VERSION_CHECK_INTERVAL = env.int('MTDJ_EMOTION_REGISTRY_VERSION_CHECK_INTERVAL', default=60)
+
+BULK_VOTE_MAX_VOTES = 50
+BULK_VOTE_INFO_MAX_SONGS = 100
+
 CANDIDATE_BATCH_SIZE_FOR_USER_EMOTION_ATTRIBUTES_UPDATE = 15
 
+# Votes for the same user and emotion within this many seconds of each other are coalesced into one update
+USER_EMOTION_ATTRIBUTES_UPDATE_WINDOW = env.int('MTDJ_USER_EMOTION_ATTRIBUTES_UPDATE_WINDOW', default=5)
+
 CREATE_USER_EMOTION_RECORDS_SIGNAL_UID = 'user_post_save_create_useremotion_records'
 UPDATE_USER_EMOTION_ATTRIBUTES_SIGNAL_UID = 'user_song_vote_post_save_update_useremotion_attributes'
+UPDATE_USER_SONG_VOTE_VERSION_SIGNAL_UID = 'user_song_vote_post_save_update_user_song_vote_version'
 ADD_SPOTIFY_DATA_TOP_ARTISTS_SIGNAL_UID = 'spotify_auth_post_save_add_spotify_top_artists'
 LOG_MOODY_USER_FAILED_LOGIN_SIGNAL_UID = 'moody_user_failed_login'
+UPDATE_SONG_CATALOG_VERSION_SIGNAL_UID = 'song_post_save_update_song_catalog_version'
+ADD_SONG_GENRE_SIGNAL_UID = 'song_post_save_add_song_genre'
+UPDATE_GENRE_CHOICES_SIGNAL_UID = 'genre_post_save_clear_cached_genres'
+DELETE_GENRE_CHOICES_SIGNAL_UID = 'genre_post_delete_clear_cached_genres'
+UPDATE_EMOTION_VERSION_SIGNAL_UID = 'emotion_post_save_update_emotion_version'
+DELETE_EMOTION_VERSION_SIGNAL_UID = 'emotion_post_delete_update_emotion_version'
@@ -15,6 +15,10 @@ SPOTIFY = {
     'max_songs_from_list': env.int('MTDJ_SPOTIFY_MAX_SONGS_FROM_LIST', default=10),
     'max_songs_from_category': env.int('MTDJ_SPOTIFY_MAX_SONGS_FROM_CATEGORY', default=25),
     'max_playlist_from_category': env.int('MTDJ_SPOTIFY_MAX_PLAYLISTS_FROM_CATEGORY', default=10),
+    'max_concurrent_categories': env.int('MTDJ_SPOTIFY_MAX_CONCURRENT_CATEGORIES', default=4),
+    'ingestion_requests_per_second': env.float('MTDJ_SPOTIFY_INGESTION_REQUESTS_PER_SECOND', default=10),
+    'audio_features_batch_wait': env.float('MTDJ_SPOTIFY_AUDIO_FEATURES_BATCH_WAIT', default=1),
+    'pending_songs_batch_wait': env.int('MTDJ_SPOTIFY_PENDING_SONGS_BATCH_WAIT', default=5),
     'auth_redirect_uri': env.str('MTDJ_SPOTIFY_REDIRECT_URI', default='https://moodytunes.vm/spotify/callback/'),
     'auth_user_token_timeout': 60 * 60,  # User auth token is good for one hour
     'auth_user_scopes': [SPOTIFY_PLAYLIST_MODIFY_SCOPE, SPOTIFY_TOP_ARTIST_READ_SCOPE, SPOTIFY_UPLOAD_PLAYLIST_IMAGE],
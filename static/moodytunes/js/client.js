@@ -37,7 +37,9 @@
             if (this.checkTruthyObject(params)) {
                 for (let key in params) {
                     if (params.hasOwnProperty(key)) {
-                        requestUrl.searchParams.append(key, params[key]);
+                        // Append array values as a repeated parameter (ex song_codes=foo&song_codes=bar)
+                        let values = Array.isArray(params[key]) ? params[key] : [params[key]];
+                        values.forEach(value => requestUrl.searchParams.append(key, value));
                     }
                 }
             }
@@ -185,6 +187,14 @@
             };
             this.request('GET', '/tunes/vote/info/', params, {}, '', callback);
         },
+        getInfoForVotes: function (songCodes, emotion, callback) {
+            // Retrieve the contexts the user has voted on for many songs in one request
+            let params = {
+                song_codes: songCodes,
+                emotion: emotion
+            };
+            this.request('GET', '/tunes/vote/info/bulk/', params, {}, '', callback);
+        },
         updateUserProfile: function (data, callback) {
             this.request('PATCH', '/accounts/user_profile/', {}, data, '', callback);
         }
@@ -27,6 +27,14 @@
         lastContext,
         lastArtist;
 
+    // Contexts the user has voted on for each song in the displayed playlist, keyed by song code
+    let voteContexts = {};
+
+    // Incremented for every request for vote contexts, so responses to earlier requests that arrive
+    // after a newer request was made are dropped instead of overwriting the newer contexts
+    let playlistContextsRequestId = 0;
+    let songContextsRequestId = 0;
+
     function hideConfirmDeleteModal() {
         confirmDeleteModal.style.display = 'none';
     }
@@ -78,6 +86,10 @@
         let description = document.getElementById('add-description-input').value || '';
 
         document.MoodyTunesClient.postVote(song, emotion, context, description, true, data => {
+            if (voteContexts[song]) {
+                voteContexts[song].push(context);
+            }
+
             successAddContextToVote(context);
         });
     }
@@ -170,6 +182,7 @@
     function showContextsToAddForVote() {
         let song = this.dataset.song;
         let availableContexts = [];
+        let requestId = ++songContextsRequestId;
 
         document.MoodyTunesClient.getOptions(function (data) {
             data.contexts.forEach( obj => {
@@ -178,12 +191,25 @@
                 }
             });
 
-            document.MoodyTunesClient.getInfoForVote(song, emotion, function (data) {
-                let contexts = data.contexts;
+            let displayContextsToAdd = function (contexts) {
+                // Another song was selected while we waited for the contexts
+                if (requestId !== songContextsRequestId) {
+                    return;
+                }
+
                 let optionContexts = availableContexts.filter(context => !contexts.includes(context.code));
 
                 confirmAddContextToVote(song, optionContexts);
-            });
+            };
+
+            // Use the contexts retrieved for the playlist if we have them, else request them for the song
+            if (voteContexts[song]) {
+                displayContextsToAdd(voteContexts[song]);
+            } else {
+                document.MoodyTunesClient.getInfoForVote(song, emotion, function (data) {
+                    displayContextsToAdd(data.contexts);
+                });
+            }
         });
     }
 
@@ -276,6 +302,16 @@
             return;
         }
 
+        // Retrieve the contexts for every song in the playlist in one request
+        voteContexts = {};
+        let requestId = ++playlistContextsRequestId;
+        document.MoodyTunesClient.getInfoForVotes(votes.map(vote => vote.song.code), emotion, function (data) {
+            // Drop the contexts if another playlist was displayed while we waited for them
+            if (requestId === playlistContextsRequestId) {
+                voteContexts = data.contexts;
+            }
+        });
+
         votes.forEach(vote => {
             let song = vote.song;
 